@@ -6,12 +6,15 @@ from .models import (
     Person,
     MovieCast,
     Review,
-    WatchList
+    WatchList,
+    MovieStats
 )
 # Register your models here.
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'bio', 'avatar_url')
+    list_display = ('user', 'bio', 'avatar_url', 'follower_count', 'review_count')
+    # maintained from signals, rebuild with `manage.py rebuild_profile_counters` / `process_avatars`
+    readonly_fields = Profile.DERIVED_FIELDS
 
 @admin.register(Follower)
 class FollowerAdmin(admin.ModelAdmin):
@@ -42,4 +45,11 @@ class ReviewAdmin(admin.ModelAdmin):
 @admin.register(WatchList)
 class WatchListAdmin(admin.ModelAdmin):
     list_display = ('user', 'movie')
-    search_fields = ('user__username', 'movie__movie_name')
\ No newline at end of file
+    search_fields = ('user__username', 'movie__movie_name')
+
+@admin.register(MovieStats)
+class MovieStatsAdmin(admin.ModelAdmin):
+    # maintained from Review signals, rebuild with `manage.py rebuild_movie_stats`
+    list_display = ('movie', 'review_count', 'avg_rating')
+    search_fields = ('movie__movie_name',)
+    readonly_fields = ('movie', 'review_count', 'rating_sum', 'avg_rating')
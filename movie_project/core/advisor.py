@@ -0,0 +1,71 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from .benchmark import benchmark_targets
+from .instrumentation import record_queries
+
+# EXPLAIN QUERY PLAN lines worth an index: a table walked row by row, or a sort the index couldn't provide
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT|RIGHT PART OF ORDER BY)')
+# tables that are fine to scan: tiny, or Django/allauth bookkeeping
+SCAN_OK = {'sqlite_master', 'django_site', 'django_content_type', 'auth_permission', 'socialaccount_socialapp'}
+
+
+def explain(sql, params):
+    """EXPLAIN QUERY PLAN detail lines for one statement (SQLite only)"""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_issues(plan):
+    # FTS5 results come back unordered, ranking them always needs a sort
+    ranked_search = any('VIRTUAL TABLE INDEX' in line for line in plan)
+    issues = []
+    for line in plan:
+        scan = FULL_SCAN.match(line.strip())
+        if scan and scan.group(1) not in SCAN_OK:
+            issues.append(f'full scan of {scan.group(1)}')
+        elif TEMP_SORT.search(line) and not ranked_search:
+            issues.append(line.strip().lower())
+    return issues
+
+
+def advise(username='synth_0', only=None, log=None):
+    """Replay every read-only view once and EXPLAIN each distinct SELECT it ran.
+
+    Returns {url name: [{'sql', 'plan', 'issues'}]} with only the queries
+    that have issues. Run it against a database seeded with
+    generate_synthetic_data so the planner sees realistic statistics.
+    """
+    log = log or (lambda msg: None)
+    user = get_user_model().objects.get(username=username)
+    client = Client()
+    client.force_login(user)
+
+    report = {}
+    for name, url in benchmark_targets(user):
+        if only and name not in only:
+            continue
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            with record_queries() as recorder:
+                client.get(url)
+        findings, seen = [], set()
+        for sql, params, _ in recorder.queries:
+            if not sql.lstrip().upper().startswith('SELECT') or sql in seen:
+                continue
+            seen.add(sql)
+            plan = explain(sql, params)
+            issues = plan_issues(plan)
+            if issues:
+                findings.append({'sql': sql, 'plan': plan, 'issues': issues})
+        report[name] = findings
+        log(f'{name:<22} {len(seen):>3} distinct selects, {len(findings)} flagged')
+        for finding in findings:
+            log(f"    {'; '.join(finding['issues'])}: {finding['sql'][:160]}")
+    return report
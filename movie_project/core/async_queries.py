@@ -0,0 +1,38 @@
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .instrumentation import current_recorder, record_queries
+
+
+def _in_worker(func):
+    # QueryInstrumentationMiddleware only wraps the request thread's connections
+    recorder = current_recorder()
+
+    @wraps(func)
+    def run():
+        # worker threads keep their own connection between calls, recycle it like a request would
+        close_old_connections()
+        if recorder is None:
+            return func()
+        with record_queries(recorder):
+            return func()
+    return run
+
+
+async def gather_queries(*funcs):
+    """Run independent blocking ORM callables concurrently, returns their results in order.
+
+    Each callable runs in its own worker thread, and so on its own database
+    connection, instead of queueing behind the others on the single
+    thread-sensitive executor the async ORM uses. Inside a transaction (or
+    with ASYNC_CONCURRENT_QUERIES off) they run one after another on the
+    request's connection, since other connections couldn't see its writes.
+    """
+    in_atomic = await sync_to_async(lambda: connection.in_atomic_block)()
+    if in_atomic or not getattr(settings, 'ASYNC_CONCURRENT_QUERIES', True):
+        return [await sync_to_async(func)() for func in funcs]
+    return await asyncio.gather(*(sync_to_async(_in_worker(func), thread_sensitive=False)() for func in funcs))
@@ -0,0 +1,130 @@
+import hashlib
+import io
+import logging
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .fragments import bump_profile
+from .models import Profile
+
+logger = logging.getLogger(__name__)
+
+# square edge lengths in px: small (feed, nav, lists), medium (2x of small), large (profile header)
+SIZES = (48, 96, 256)
+# (extension, Pillow format, save options); WebP is served where supported, JPEG is the fallback
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+VARIANT_DIR = 'avatars/sized'
+# refuse to decode anything bigger, uploads are photos, not posters
+MAX_PIXELS = 40_000_000
+
+
+def is_external(name):
+    # profiles created by signals carry DEFAULT_AVATAR_URL, a full URL rather than an uploaded file
+    return '://' in (name or '')
+
+
+def variant_paths(variants):
+    return {path for formats in (variants or {}).values() for path in formats.values()}
+
+
+def discard(variants):
+    """Delete the files of an avatar_variants dict once the current transaction commits"""
+    def delete():
+        for path in paths:
+            default_storage.delete(path)
+    paths = variant_paths(variants)
+    if paths:
+        transaction.on_commit(delete)
+
+
+def render_variants(data):
+    """{size: {ext: bytes}} for one uploaded image, center-cropped to squares and recompressed"""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width * image.height > MAX_PIXELS:
+            raise ValueError(f'{image.width}x{image.height} image is too large')
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        variants = {}
+        for size in SIZES:
+            square = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            flat = square
+            if square.mode == 'RGBA':
+                # JPEG has no alpha channel
+                flat = Image.new('RGB', square.size, (255, 255, 255))
+                flat.paste(square, mask=square.getchannel('A'))
+            variants[size] = {}
+            for ext, fmt, options in FORMATS:
+                out = io.BytesIO()
+                (square if fmt == 'WEBP' else flat).save(out, fmt, **options)
+                variants[size][ext] = out.getvalue()
+    return variants
+
+
+def process_avatar(profile_id):
+    """Write the sized variants of a profile's current avatar and store their paths.
+
+    Returns the stored dict, or None if the avatar was replaced meanwhile.
+    Old variants are deleted. Profiles without an uploaded file (or an
+    unreadable one) end up with no variants and keep using the original.
+    """
+    profile = Profile.objects.only('id', 'user_id', 'avatar_url', 'avatar_variants').get(pk=profile_id)
+    name = profile.avatar_url.name
+    paths = {}
+    if name and not is_external(name):
+        try:
+            with default_storage.open(name) as f:
+                data = f.read()
+            variants = render_variants(data)
+        except (OSError, UnidentifiedImageError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning('avatar of profile %s not processed: %s', profile_id, e)
+            variants = {}
+        digest = hashlib.sha1(data).hexdigest()[:12] if variants else ''
+        for size, encoded in variants.items():
+            paths[str(size)] = {
+                ext: default_storage.save(f'{VARIANT_DIR}/{profile.user_id}-{digest}-{size}.{ext}', ContentFile(content))
+                for ext, content in encoded.items()
+            }
+    # only if the avatar wasn't replaced again while we were working
+    updated = Profile.objects.filter(pk=profile_id, avatar_url=name).update(avatar_variants=paths)
+    if updated:
+        bump_profile(profile.user_id)
+    written = variant_paths(paths)
+    for path in (variant_paths(profile.avatar_variants) - written) if updated else written:
+        default_storage.delete(path)
+    return paths if updated else None
+
+
+def _process_in_thread(profile_id):
+    try:
+        process_avatar(profile_id)
+    except Exception:
+        logger.exception('avatar processing failed for profile %s', profile_id)
+    finally:
+        close_old_connections()
+
+
+def schedule(profile_id):
+    """Process a new avatar after the upload commits, as configured by AVATAR_PROCESSING.
+
+    'sync' processes it during the request, 'thread' in a background thread
+    and 'deferred' leaves it for `manage.py process_avatars`, run from cron.
+    Until then templates fall back to the original upload.
+    """
+    mode = getattr(settings, 'AVATAR_PROCESSING', 'thread')
+    if mode == 'sync':
+        transaction.on_commit(lambda: process_avatar(profile_id))
+    elif mode == 'thread':
+        transaction.on_commit(lambda: threading.Thread(target=_process_in_thread, args=(profile_id,), daemon=True).start())
+
+
+def pending_profiles():
+    """Profiles with an uploaded avatar but no variants yet"""
+    return Profile.objects.exclude(avatar_url='').exclude(avatar_url__isnull=True).exclude(avatar_url__contains='://').filter(avatar_variants={})
@@ -0,0 +1,273 @@
+import asyncio
+import math
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.template import base as template_base
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import URLPattern, reverse
+
+from .instrumentation import record_queries
+from .models import Follower, MovieStats, Review
+from .urls import urlpatterns
+
+# views that change state on GET (or are staff only), never replayed by the benchmark
+SKIPPED_VIEWS = {
+    'add_to_watchlist', 'remove_from_watchlist', 'follow_user', 'unfollow_user',
+    'like', 'unlike', 'watched', 'unwatched', 'delete_review', 'add_movie', 'fragment_cache_stats',
+    'toggle_interactions',
+}
+# pages that have async variants (settings.ASYNC_VIEWS), the default set for load tests
+LOAD_VIEWS = ('get_all_movies', 'list_one_movie', 'view_profile', 'feed')
+# query strings for views that do nothing useful without one
+QUERY_STRINGS = {
+    'search_movies': 'q=night',
+}
+
+
+@contextmanager
+def render_timer():
+    """Accumulate wall time spent in top-level Template.render calls"""
+    timings = {'seconds': 0.0}
+    original = template_base.Template.render
+    depth = [0]
+
+    def timed_render(self, context):
+        depth[0] += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            depth[0] -= 1
+            if depth[0] == 0:
+                timings['seconds'] += time.perf_counter() - started
+
+    template_base.Template.render = timed_render
+    try:
+        yield timings
+    finally:
+        template_base.Template.render = original
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    # nearest-rank percentile
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def url_arguments(user):
+    """Values for the URL parameters used in core/urls.py, picked from the current data"""
+    followed = Follower.objects.filter(follower=user).select_related('following').first()
+    busiest = MovieStats.objects.order_by('-review_count').values_list('movie_id', flat=True).first()
+    review = Review.objects.filter(user=user).values_list('id', flat=True).first()
+    return {
+        'movie_id': busiest,
+        'username': followed.following.username if followed else None,
+        'action': 'followers',
+        'list_name': 'watchlist',
+        'review_id': review,
+    }
+
+
+def benchmark_targets(user):
+    """(url name, url) for every read-only route in core/urls.py"""
+    arguments = url_arguments(user)
+    targets = []
+    for pattern in urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in SKIPPED_VIEWS:
+            continue
+        kwargs = {name: arguments.get(name) for name in pattern.pattern.converters}
+        if any(value is None for value in kwargs.values()):
+            continue
+        url = reverse(pattern.name, kwargs=kwargs)
+        if pattern.name in QUERY_STRINGS:
+            url += '?' + QUERY_STRINGS[pattern.name]
+        targets.append((pattern.name, url))
+    return targets
+
+
+def measure(client, url, iterations=20):
+    """Hit `url` repeatedly, returns query count, SQL/render time and latency percentiles.
+
+    The first request warms caches and connections and is left out of the
+    timings, but its query count is reported as `cold_queries`.
+    """
+    with record_queries() as cold:
+        client.get(url)
+    latencies, sql_times, render_times, query_counts = [], [], [], []
+    status = None
+    for _ in range(iterations):
+        with record_queries() as recorder, render_timer() as rendered:
+            started = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - started)
+        status = response.status_code
+        query_counts.append(recorder.count)
+        sql_times.append(recorder.total_time)
+        render_times.append(rendered['seconds'])
+    return {
+        'url': url,
+        'status': status,
+        'queries': max(query_counts),
+        'cold_queries': cold.count,
+        'sql_ms': round(statistics.mean(sql_times) * 1000, 3),
+        'render_ms': round(statistics.mean(render_times) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+    }
+
+
+def run_benchmark(username='synth_0', iterations=20, only=None, log=None):
+    """Benchmark every read-only view as `username`, returns a JSON-serializable report"""
+    log = log or (lambda msg: None)
+    user = get_user_model().objects.get(username=username)
+    client = Client()
+    client.force_login(user)
+    budgets = getattr(settings, 'VIEW_QUERY_BUDGETS', {})
+
+    views = {}
+    for name, url in benchmark_targets(user):
+        if only and name not in only:
+            continue
+        # the test client talks to 'testserver', which production ALLOWED_HOSTS won't list
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            result = measure(client, url, iterations)
+        result['query_budget'] = budgets.get(name)
+        result['over_budget'] = (result['query_budget'] is not None
+                                 and max(result['queries'], result['cold_queries']) > result['query_budget'])
+        views[name] = result
+        log(f"{name:<22} {result['queries']:>4} queries ({result['cold_queries']:>4} cold)  sql {result['sql_ms']:>8.2f}ms  "
+            f"render {result['render_ms']:>8.2f}ms  p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms"
+            + ('  OVER BUDGET' if result['over_budget'] else ''))
+    return {
+        'meta': {
+            'username': username,
+            'iterations': iterations,
+            'database': connection.vendor,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'views': views,
+    }
+
+
+def _wsgi_load(user, url, concurrency, requests):
+    """Latencies of `requests` GETs through the WSGI handler, one thread (and DB connection) per concurrent client"""
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def worker(count):
+        client = Client()
+        client.force_login(user)
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                status = client.get(url).status_code
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    if status != 200:
+                        failures.append(status)
+        finally:
+            connection.close()
+
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, counts))
+    return latencies, failures
+
+
+async def _asgi_load(user, url, concurrency, requests):
+    """Latencies of `requests` GETs through the ASGI handler, `concurrency` clients on one event loop"""
+    latencies, failures = [], []
+
+    async def worker(count):
+        client = AsyncClient()
+        await client.aforce_login(user)
+        for _ in range(count):
+            started = time.perf_counter()
+            status = (await client.get(url)).status_code
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                failures.append(status)
+
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    await asyncio.gather(*(worker(count) for count in counts))
+    return latencies, failures
+
+
+def run_load(username='synth_0', handler='wsgi', concurrency=8, requests=200, only=None, log=None):
+    """Throughput and tail latency of each page under `concurrency` simultaneous clients.
+
+    `handler` picks the WSGI or ASGI request path; which view variants are
+    routed is up to settings.ASYNC_VIEWS. Run once per configuration and
+    diff the two reports with compare_reports.
+    """
+    log = log or (lambda msg: None)
+    user = get_user_model().objects.get(username=username)
+    only = only or LOAD_VIEWS
+
+    views = {}
+    for name, url in benchmark_targets(user):
+        if name not in only:
+            continue
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            started = time.perf_counter()
+            if handler == 'asgi':
+                latencies, failures = asyncio.run(_asgi_load(user, url, concurrency, requests))
+            else:
+                latencies, failures = _wsgi_load(user, url, concurrency, requests)
+            elapsed = time.perf_counter() - started
+        result = {
+            'url': url,
+            'errors': len(failures),
+            'rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        }
+        views[name] = result
+        log(f"{name:<22} {result['rps']:>8.1f} req/s  p50 {result['p50_ms']:>8.2f}ms  "
+            f"p95 {result['p95_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms"
+            + (f"  {result['errors']} ERRORS" if result['errors'] else ''))
+    return {
+        'meta': {
+            'kind': 'load',
+            'handler': handler,
+            'async_views': getattr(settings, 'ASYNC_VIEWS', False),
+            'concurrency': concurrency,
+            'requests': requests,
+            'username': username,
+            'database': connection.vendor,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'views': views,
+    }
+
+
+def compare_reports(old, new, fields=None):
+    """Per-view deltas between two benchmark (or two load) reports, as printable lines"""
+    if fields is None:
+        fields = (('rps', 'p50_ms', 'p95_ms', 'p99_ms') if new['meta'].get('kind') == 'load'
+                  else ('queries', 'sql_ms', 'render_ms', 'p50_ms', 'p95_ms'))
+    lines = []
+    for name in sorted(set(old['views']) | set(new['views'])):
+        before, after = old['views'].get(name), new['views'].get(name)
+        if before is None or after is None:
+            lines.append(f"{name}: only in {'new' if before is None else 'old'} report")
+            continue
+        deltas = []
+        for field in fields:
+            delta = after[field] - before[field]
+            change = f' ({delta / before[field]:+.0%})' if before[field] else ''
+            deltas.append(f'{field} {before[field]} -> {after[field]}{change}')
+        lines.append(f"{name}: " + ', '.join(deltas))
+    return lines
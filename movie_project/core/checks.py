@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Version stamps and invalidations only reach other processes through a shared cache"""
+    if settings.CACHES['default']['BACKEND'].endswith(('.LocMemCache', '.DummyCache')):
+        return [Warning(
+            'The default cache is local to each process.',
+            hint='ETags, page/fragment purges, interaction sets and follow graph rebuilds written by one worker '
+                 'or management command are not seen by the others; set REDIS_URL, MEMCACHED_LOCATION or '
+                 'CACHE_BACKEND=database.',
+            id='core.W001',
+        )]
+    return []
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import connections
+
+
+def apply_sqlite_pragmas(connection):
+    """Run settings.SQLITE_PRAGMAS on a new SQLite connection (see the connection_created receiver)"""
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    read_only = 'mode=ro' in str(connection.settings_dict['NAME'])
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            # journal_mode is stored in the database file, a read-only connection can't change it
+            if name == 'journal_mode' and read_only:
+                continue
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+class PrimaryReplicaRouter:
+    """Send reads to the 'replica' alias and writes to 'default'.
+
+    Reads inside a transaction on the primary stay on the primary, so code
+    that reads back its own uncommitted writes keeps working. With SQLite in
+    WAL mode the replica is just a read-only connection to the same file, so
+    committed writes are visible to it immediately.
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return 'replica'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
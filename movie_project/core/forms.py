@@ -9,6 +9,17 @@ class ProfileForm(forms.ModelForm):
             'bio': forms.Textarea(attrs={'rows': 4, 'placeholder': 'Tell us about yourself'}),
             'avatar_url': forms.FileInput(attrs={'accept': 'image/*'}),
         }
+
+    # resized copies are what gets served (core.avatars), but the original is still decoded once
+    MAX_AVATAR_BYTES = 10 * 1024 * 1024
+
+    def clean_avatar_url(self):
+        avatar = self.cleaned_data.get('avatar_url')
+
+        if avatar and getattr(avatar, 'size', 0) > self.MAX_AVATAR_BYTES:
+            raise forms.ValidationError("Avatar images must be smaller than 10 MB.")
+
+        return avatar
     
 
 class ReviewForm(forms.ModelForm):
@@ -0,0 +1,162 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# hits/misses per fragment name, for this process only
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+# bumped only when a movie itself is added, edited or deleted, for pages that just show titles
+# (profiles) and for which movies a listing page shows (listing_version)
+MOVIE_EDITS_VERSION_KEY = 'fragments:movie-edits:v'
+# bumped by every like/unlike, only for the logged-in catalog's ETag ("liked by people you follow")
+LIKES_VERSION_KEY = 'fragments:likes:v'
+
+
+def _version_key(movie_id):
+    return f'fragments:movie:{movie_id}:v'
+
+
+def _page_version_key(movie_id):
+    # what movie.html shows beyond the cached fragments: the like count
+    return f'fragments:movie-page:{movie_id}:v'
+
+
+def _profile_version_key(user_id):
+    return f'fragments:profile:{user_id}:v'
+
+
+def _incr_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def _versions(keys):
+    """{id: version} for {id: cache key}, in one cache round trip.
+
+    A version that isn't in the cache (never set, or evicted) is seeded
+    from the clock rather than restarting at 1, so a reseeded key can
+    never match something cached or sent under an older version.
+    """
+    found = cache.get_many(keys.values())
+    versions, missing = {}, {}
+    for name, key in keys.items():
+        if key in found:
+            versions[name] = found[key]
+        else:
+            versions[name] = missing[key] = time.time_ns()
+    if missing:
+        cache.set_many(missing, None)
+    return versions
+
+
+def movie_versions(movie_ids):
+    """{movie id: version} for the given movies, bumped by bump_movie"""
+    return _versions({movie_id: _version_key(movie_id) for movie_id in movie_ids})
+
+
+def movie_page_version(movie_id):
+    """Version of a whole movie page: its fragment version plus the like count's, in one round trip"""
+    versions = _versions({'fragments': _version_key(movie_id), 'page': _page_version_key(movie_id)})
+    return f"{versions['fragments']}.{versions['page']}"
+
+
+def profile_versions(user_ids):
+    """{user id: version} of what each user's profile shows (counters, lists, bio, avatar), bumped by bump_profile"""
+    return _versions({user_id: _profile_version_key(user_id) for user_id in user_ids})
+
+
+def attach_versions(movies):
+    """Set `fragment_version` on each movie, for the {% fragment %} keys in templates"""
+    versions = movie_versions([movie.id for movie in movies])
+    for movie in movies:
+        movie.fragment_version = versions[movie.id]
+    return movies
+
+
+def movie_edits_version():
+    return _versions({MOVIE_EDITS_VERSION_KEY: MOVIE_EDITS_VERSION_KEY})[MOVIE_EDITS_VERSION_KEY]
+
+
+def likes_version():
+    return _versions({LIKES_VERSION_KEY: LIKES_VERSION_KEY})[LIKES_VERSION_KEY]
+
+
+def listing_version(name, page, movie_ids):
+    """Version of one page of a movie listing: the movie edits version plus that of every movie on the page.
+
+    `movie_ids()` runs the page's id query. Its result is cached per movie
+    edits version, so a repeat visit costs no query, and a review or stats
+    change only moves the pages that list that movie.
+    """
+    edits = movie_edits_version()
+    ids_key = f"fragments:listing:{name}:{edits}:{hashlib.md5(str(page).encode()).hexdigest()}"
+    ids = cache.get(ids_key)
+    if ids is None:
+        ids = list(movie_ids())
+        cache.set(ids_key, ids, getattr(settings, 'FRAGMENT_CACHE_TTL', 600))
+    versions = movie_versions(ids)
+    digest = hashlib.md5(':'.join(f'{movie_id}.{versions[movie_id]}' for movie_id in ids).encode()).hexdigest()
+    return f'{edits}.{digest}'
+
+
+def bump_movie(movie_id):
+    """Invalidate everything cached for a movie (fragments, its page, listings showing it) once the current transaction commits"""
+    if movie_id:
+        transaction.on_commit(lambda: _incr_version(_version_key(movie_id)))
+
+
+def bump_movie_page(movie_id):
+    """A like or unlike: purge the movie's page but keep its card/review fragments and the catalog, which don't show likes"""
+    def bump():
+        _incr_version(_page_version_key(movie_id))
+        _incr_version(LIKES_VERSION_KEY)
+    if movie_id:
+        transaction.on_commit(bump)
+
+
+def bump_movie_edits():
+    transaction.on_commit(lambda: _incr_version(MOVIE_EDITS_VERSION_KEY))
+
+
+def bump_profile(user_id):
+    """Mark a user's profile page as changed once the current transaction commits"""
+    if user_id:
+        transaction.on_commit(lambda: _incr_version(_profile_version_key(user_id)))
+
+
+def fragment_key(name, vary_on):
+    digest = hashlib.md5(':'.join(str(value) for value in vary_on).encode()).hexdigest()
+    return f'fragments:{name}:{digest}'
+
+
+def get_or_render(name, vary_on, render):
+    """Cached HTML for (name, vary_on), calling render() on a miss"""
+    key = fragment_key(name, vary_on)
+    html = cache.get(key)
+    hit = html is not None
+    if not hit:
+        html = render()
+        cache.set(key, html, getattr(settings, 'FRAGMENT_CACHE_TTL', 600))
+    with _stats_lock:
+        _stats[name, 'hits' if hit else 'misses'] += 1
+    return html
+
+
+def fragment_stats():
+    """{fragment name: {'hits', 'misses', 'hit_ratio'}} since this process started"""
+    with _stats_lock:
+        names = {name for name, _ in _stats}
+        report = {name: {'hits': _stats[name, 'hits'], 'misses': _stats[name, 'misses']} for name in sorted(names)}
+    for counts in report.values():
+        total = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = round(counts['hits'] / total, 3) if total else None
+    return report
@@ -0,0 +1,220 @@
+import heapq
+import random
+import threading
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Follower
+
+GENERATION_KEY = 'follow_graph:generation'
+# followees of the user whose own followees are counted for suggestions; caps the work for users following thousands
+SUGGESTION_FANOUT = 200
+EMPTY = array('q')
+
+
+def _contains(ids, value):
+    i = bisect_left(ids, value)
+    return i < len(ids) and ids[i] == value
+
+
+class FollowGraph:
+    """Follow edges held as sorted array('q') adjacency lists per user id, in both directions.
+
+    About 16 bytes per edge plus a dict entry per user, instead of a model
+    instance per row; membership tests are binary searches.
+    """
+
+    def __init__(self, following=None, followers=None):
+        self.following = following or {}
+        self.followers = followers or {}
+        self.built_at = time.monotonic()
+        self.generation = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_edges(cls, edges):
+        """Build from (follower id, following id) pairs, no duplicates expected"""
+        following, followers = defaultdict(list), defaultdict(list)
+        for follower_id, following_id in edges:
+            following[follower_id].append(following_id)
+            followers[following_id].append(follower_id)
+        return cls(
+            {user_id: array('q', sorted(ids)) for user_id, ids in following.items()},
+            {user_id: array('q', sorted(ids)) for user_id, ids in followers.items()},
+        )
+
+    @property
+    def edge_count(self):
+        return sum(len(ids) for ids in self.following.values())
+
+    def follows(self, follower_id, following_id):
+        return _contains(self.following.get(follower_id, EMPTY), following_id)
+
+    def is_mutual(self, a, b):
+        return self.follows(a, b) and self.follows(b, a)
+
+    def mutuals(self, user_id):
+        """Ids of the users `user_id` follows who follow back, ascending"""
+        followers = self.followers.get(user_id, EMPTY)
+        return [other for other in self.following.get(user_id, EMPTY) if _contains(followers, other)]
+
+    def suggestions(self, user_id, limit=10, fanout=SUGGESTION_FANOUT):
+        """[(user id, mutual count)] of people followed by the people `user_id` follows, most shared first"""
+        mine = self.following.get(user_id, EMPTY)
+        counts = Counter()
+        for friend in mine[:fanout]:
+            counts.update(self.following.get(friend, EMPTY))
+        candidates = ((-count, other) for other, count in counts.items()
+                      if other != user_id and not _contains(mine, other))
+        return [(other, -count) for count, other in heapq.nsmallest(limit, candidates)]
+
+    def add(self, follower_id, following_id):
+        with self.lock:
+            for index, key, value in ((self.following, follower_id, following_id), (self.followers, following_id, follower_id)):
+                ids = index.setdefault(key, array('q'))
+                i = bisect_left(ids, value)
+                if i == len(ids) or ids[i] != value:
+                    ids.insert(i, value)
+
+    def remove(self, follower_id, following_id):
+        with self.lock:
+            for index, key, value in ((self.following, follower_id, following_id), (self.followers, following_id, follower_id)):
+                ids = index.get(key, EMPTY)
+                i = bisect_left(ids, value)
+                if i < len(ids) and ids[i] == value:
+                    del ids[i]
+
+
+_graph = None
+_build_lock = threading.Lock()
+# edge changes applied while a build is reading its snapshot, replayed onto the new graph; None when idle
+_pending = None
+_pending_lock = threading.Lock()
+
+
+def build_graph():
+    """A FollowGraph of the whole Follower table, read in index order"""
+    edges = Follower.objects.order_by('follower_id', 'following_id').values_list('follower_id', 'following_id')
+    return FollowGraph.from_edges(edges.iterator(chunk_size=10000))
+
+
+def _build_and_swap(generation):
+    """Build a new graph and make it this process's, keeping follows committed while it was being read"""
+    global _graph, _pending
+    with _pending_lock:
+        _pending = []
+    try:
+        graph = build_graph()
+        graph.generation = generation
+    except BaseException:
+        with _pending_lock:
+            _pending = None
+        raise
+    with _pending_lock:
+        # replaying is idempotent, so changes the snapshot already has do no harm
+        for follower_id, following_id, added in _pending:
+            (graph.add if added else graph.remove)(follower_id, following_id)
+        _graph, _pending = graph, None
+    return graph
+
+
+def _rebuild(generation):
+    try:
+        _build_and_swap(generation)
+    finally:
+        connection.close()
+        _build_lock.release()
+
+
+def follow_graph():
+    """This process's graph, built on first use and refreshed after FOLLOW_GRAPH_TTL seconds or rebuild_follow_graph.
+
+    Follows and unfollows made by this process are applied as they commit;
+    ones made by other processes show up at the next refresh. Refreshes run
+    in a background thread while the current graph keeps serving.
+    """
+    generation = cache.get(GENERATION_KEY)
+    ttl = getattr(settings, 'FOLLOW_GRAPH_TTL', 900)
+    graph = _graph
+    if graph is None:
+        with _build_lock:
+            return _graph if _graph is not None else _build_and_swap(generation)
+    stale = graph.generation != generation or time.monotonic() - graph.built_at > ttl
+    if stale and _build_lock.acquire(blocking=False):
+        threading.Thread(target=_rebuild, args=(generation,), daemon=True).start()
+    return graph
+
+
+def invalidate_graph():
+    """Make every process rebuild its graph on next use; reaches other processes only through a shared cache (CACHES)"""
+    cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def edge_changed(follower_id, following_id, added):
+    """Apply a follow/unfollow to this process's graph, and to one being built, once the transaction commits"""
+    def apply():
+        with _pending_lock:
+            if _graph is not None:
+                (_graph.add if added else _graph.remove)(follower_id, following_id)
+            if _pending is not None:
+                _pending.append((follower_id, following_id, added))
+    transaction.on_commit(apply)
+
+
+def benchmark_graph(edges=1_000_000, users=100_000, queries=1000, seed=42, log=None):
+    """Build time, memory and query latency of a FollowGraph over random edges; no database involved.
+
+    Out-degrees follow a skewed distribution (most users follow a few
+    dozen, a few follow thousands) and popular users attract more followers.
+    """
+    log = log or (lambda msg: None)
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(1 / (rank + 1) ** 0.7 for rank in range(users)))
+    population = range(users)
+    edge_set = set()
+    while len(edge_set) < edges:
+        follower = rng.randrange(users)
+        # pareto out-degree: median around 8, a long tail up to 5000
+        degree = min(int(rng.paretovariate(1.5) * 5), 5000, edges - len(edge_set))
+        for following in rng.choices(population, cum_weights=cum_weights, k=degree):
+            if following != follower:
+                edge_set.add((follower, following))
+    edge_list = sorted(edge_set)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    graph = FollowGraph.from_edges(edge_list)
+    build_s = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    log(f'built {graph.edge_count} edges over {len(graph.following)} followers in {build_s:.2f}s, '
+        f'{retained / 2**20:.1f} MiB retained, {peak / 2**20:.1f} MiB peak')
+
+    followers = list(graph.following)
+    sample = [rng.choice(followers) for _ in range(queries)]
+    latencies = {'suggestions': [], 'is_mutual': []}
+    for user_id in sample:
+        started = time.perf_counter()
+        graph.suggestions(user_id)
+        latencies['suggestions'].append(time.perf_counter() - started)
+        other = rng.randrange(users)
+        started = time.perf_counter()
+        graph.is_mutual(user_id, other)
+        latencies['is_mutual'].append(time.perf_counter() - started)
+
+    report = {'edges': graph.edge_count, 'users': users, 'build_s': round(build_s, 3),
+              'retained_mib': round(retained / 2**20, 1), 'peak_mib': round(peak / 2**20, 1)}
+    for name, values in latencies.items():
+        values.sort()
+        report[f'{name}_p50_us'] = round(values[len(values) // 2] * 1e6, 1)
+        report[f'{name}_p99_us'] = round(values[int(len(values) * 0.99) - 1] * 1e6, 1)
+        log(f"{name}: p50 {report[f'{name}_p50_us']}us, p99 {report[f'{name}_p99_us']}us")
+    return report
@@ -0,0 +1,108 @@
+from django.db import transaction
+
+from .fragments import bump_movie, bump_movie_edits
+from .models import Movie, MovieCast, Person
+from . import search
+
+# columns refreshed when an already imported TMDB movie is written again
+UPSERT_FIELDS = ['movie_name', 'movie_description', 'release_date', 'genre', 'length', 'poster_url']
+
+
+class IngestWriter:
+    """Buffers movies with their cast/crew and writes them in batched transactions.
+
+    Movies, new people and cast rows each go out as one bulk_create per flush
+    instead of one autocommitted statement per row. Movies carrying a tmdb_id
+    are upserted, so re-importing the same TMDB movie updates it in place. Person ids are cached by
+    name; pass preload_people=True for big imports to load the whole table once.
+    """
+
+    def __init__(self, batch_size=200, preload_people=False):
+        self.batch_size = batch_size
+        self.person_ids = {}
+        if preload_people:
+            # newest first so the oldest row wins when a name is duplicated
+            self.person_ids = dict(Person.objects.order_by('-id').values_list('person_name', 'id'))
+        self.pending = []
+        self.movies_written = 0
+        self.cast_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, movie, cast=()):
+        """Queue a movie (saved or not) with (person_name, role_type) pairs, flushing when the batch is full.
+
+        The pairs replace whatever cast the movie had; cast=None keeps it,
+        e.g. when its credits couldn't be fetched.
+        """
+        if cast is not None:
+            cast = [(name.strip(), role) for name, role in cast if name and name.strip()]
+        self.pending.append((movie, cast))
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def _resolve_people(self, names):
+        missing = {name for name in names if name not in self.person_ids}
+        if not missing:
+            return
+        for person_id, name in Person.objects.filter(person_name__in=missing).order_by('-id').values_list('id', 'person_name'):
+            self.person_ids[name] = person_id
+        new_people = [Person(person_name=name) for name in missing if name not in self.person_ids]
+        Person.objects.bulk_create(new_people, batch_size=500)
+        if any(person.pk is None for person in new_people):
+            # backend didn't return ids from the bulk insert
+            new_people = Person.objects.filter(person_name__in=[p.person_name for p in new_people])
+        for person in new_people:
+            self.person_ids.setdefault(person.person_name, person.pk)
+
+    def flush(self):
+        """Write everything buffered in one transaction, returns the movies that were written"""
+        if not self.pending:
+            return []
+        pending, self.pending = self.pending, []
+
+        # movies with a TMDB id are upserted on it, the last copy in a batch wins
+        batch = {}
+        for movie, cast in pending:
+            key = ('tmdb', movie.tmdb_id) if movie.pk is None and movie.tmdb_id else ('obj', id(movie))
+            batch[key] = (movie, cast)
+        batch = list(batch.values())
+
+        with transaction.atomic():
+            upserts = [movie for movie, _ in batch if movie.pk is None and movie.tmdb_id]
+            inserts = [movie for movie, _ in batch if movie.pk is None and not movie.tmdb_id]
+            Movie.objects.bulk_create(
+                upserts, batch_size=500,
+                update_conflicts=True, unique_fields=['tmdb_id'], update_fields=UPSERT_FIELDS,
+            )
+            Movie.objects.bulk_create(inserts, batch_size=500)
+            if any(movie.pk is None for movie in upserts):
+                # backend didn't return ids from the upsert
+                ids = dict(Movie.objects.filter(tmdb_id__in=[m.tmdb_id for m in upserts]).values_list('tmdb_id', 'id'))
+                for movie in upserts:
+                    movie.pk = ids[movie.tmdb_id]
+            recast = [(movie, cast) for movie, cast in batch if cast is not None]
+            self._resolve_people({name for _, cast in recast for name, _ in cast})
+            # a re-imported movie's cast is replaced, not merged
+            MovieCast.objects.filter(movie_id__in=[movie.pk for movie, _ in recast]).delete()
+            rows = [
+                MovieCast(movie_id=movie.pk, person_id=self.person_ids[name], role_type=role)
+                for movie, cast in recast for name, role in cast
+            ]
+            MovieCast.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+            # bulk_create skips signals, so refresh the search index and cached fragments by hand
+            search.index_movies([movie.pk for movie, _ in batch])
+            for movie, _ in batch:
+                bump_movie(movie.pk)
+            # new and retitled movies change which movies listings show
+            bump_movie_edits()
+
+        self.movies_written += len(batch)
+        self.cast_written += len(rows)
+        return [movie for movie, _ in batch]
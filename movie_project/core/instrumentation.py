@@ -0,0 +1,129 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('core.queries')
+
+# the recorder of the request being handled, for threads that open their own connections (core.async_queries)
+_current_recorder = ContextVar('query_recorder', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryRecorder:
+    """Execute wrapper that records every SQL statement, its params and duration.
+
+    Install with ``connection.execute_wrapper(recorder)``, or on every
+    database alias with record_queries(). Unlike CaptureQueriesContext it
+    doesn't need DEBUG or a debug cursor and keeps full timing precision.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - started))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, _, duration in self.queries)
+
+    @property
+    def duplicates(self):
+        """Statements repeated with the exact same params, beyond their first run"""
+        seen = Counter((sql, repr(params)) for sql, params, _ in self.queries)
+        return sum(n - 1 for n in seen.values())
+
+    def slowest(self, n=5):
+        return sorted(((sql, duration) for sql, _, duration in self.queries), key=lambda q: -q[1])[:n]
+
+
+@contextmanager
+def record_queries(recorder=None):
+    """Record the queries of every configured database (primary and replica) into one QueryRecorder.
+
+    Only this thread's connections are wrapped; worker threads started
+    meanwhile join in with record_queries(current_recorder()).
+    """
+    recorder = recorder or QueryRecorder()
+    token = _current_recorder.set(recorder)
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+def current_recorder():
+    """The QueryRecorder of the enclosing record_queries(), or None"""
+    return _current_recorder.get()
+
+
+class QueryInstrumentationMiddleware:
+    """Records the SQL each request runs and reports it.
+
+    Opt in with QUERY_INSTRUMENTATION = True. Every request gets a
+    Server-Timing header (query count, SQL time, duplicates) and one JSON log
+    line on the 'core.queries' logger with the slowest statements. Requests
+    over their VIEW_QUERY_BUDGETS entry are logged as warnings, or raise
+    QueryBudgetExceeded when QUERY_BUDGET_ACTION = 'raise'.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match else None
+        budget = getattr(settings, 'VIEW_QUERY_BUDGETS', {}).get(view)
+        top_n = getattr(settings, 'QUERY_INSTRUMENTATION_TOP_N', 5)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'duplicates': recorder.duplicates,
+            'sql_ms': round(recorder.total_time * 1000, 3),
+            'total_ms': round(elapsed * 1000, 3),
+            'budget': budget,
+            'slowest': [{'sql': sql, 'ms': round(duration * 1000, 3)} for sql, duration in recorder.slowest(top_n)],
+        }
+
+        response['Server-Timing'] = ', '.join([
+            f'sql;dur={record["sql_ms"]};desc="{recorder.count} queries"',
+            f'sql-dup;desc="{recorder.duplicates} duplicate queries"',
+            f'app;dur={record["total_ms"]}',
+        ])
+
+        over_budget = budget is not None and recorder.count > budget
+        logger.log(logging.WARNING if over_budget else logging.INFO, json.dumps(record, default=str))
+        if over_budget and getattr(settings, 'QUERY_BUDGET_ACTION', 'log') == 'raise':
+            raise QueryBudgetExceeded(f'{view} ran {recorder.count} queries, budget is {budget}')
+        return response
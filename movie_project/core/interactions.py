@@ -0,0 +1,77 @@
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Like, WatchList, Watched
+
+# interaction kind -> (model, Profile counter used to spot heavy users)
+INTERACTIONS = {
+    'watchlist': (WatchList, 'watchlist_count'),
+    'liked': (Like, 'like_count'),
+    'watched': (Watched, 'watched_count'),
+}
+
+
+def _key(user_id, kind):
+    return f'interactions:{user_id}:{kind}'
+
+
+def _pack(movie_ids):
+    # 8 bytes per id instead of a pickled set of python ints
+    return array('q', sorted(movie_ids)).tobytes()
+
+
+def _unpack(raw):
+    ids = array('q')
+    ids.frombytes(raw)
+    return frozenset(ids)
+
+
+def invalidate(user_id, kind):
+    """Drop a cached set once the current transaction commits, so a reader can't re-cache the old rows.
+
+    Other workers only see the delete through a shared cache (settings.CACHES);
+    with a per-process one they keep their copy for INTERACTION_CACHE_TTL.
+    """
+    transaction.on_commit(lambda: cache.delete(_key(user_id, kind)))
+
+
+def interaction_sets(user, movie_ids=None):
+    """{kind: frozenset of movie ids} for the user's watchlist, likes and watched movies.
+
+    Sets are cached per user and kind until a row changes. When `movie_ids`
+    is given (the movies on the page being rendered), users whose list is
+    longer than INTERACTION_SET_MAX only get those ids checked instead of
+    loading and caching their whole list.
+    """
+    if not user.is_authenticated:
+        return {kind: frozenset() for kind in INTERACTIONS}
+    keys = {kind: _key(user.pk, kind) for kind in INTERACTIONS}
+    cached = cache.get_many(keys.values())
+    limit = getattr(settings, 'INTERACTION_SET_MAX', 5000)
+    profile = user.profile if hasattr(user, 'profile') else None
+
+    sets, to_cache = {}, {}
+    for kind, (model, counter) in INTERACTIONS.items():
+        if keys[kind] in cached:
+            sets[kind] = _unpack(cached[keys[kind]])
+            continue
+        rows = model.objects.filter(user=user)
+        if movie_ids is not None and profile is not None and getattr(profile, counter) > limit:
+            sets[kind] = frozenset(rows.filter(movie_id__in=movie_ids).values_list('movie_id', flat=True))
+            continue
+        sets[kind] = frozenset(rows.values_list('movie_id', flat=True))
+        to_cache[keys[kind]] = _pack(sets[kind])
+    if to_cache:
+        cache.set_many(to_cache, getattr(settings, 'INTERACTION_CACHE_TTL', 3600))
+    return sets
+
+
+def cached_movie_ids(user):
+    """Movie ids in whichever of the user's interaction sets are cached; never touches the database"""
+    if not user.is_authenticated:
+        return frozenset()
+    cached = cache.get_many([_key(user.pk, kind) for kind in INTERACTIONS])
+    return frozenset().union(*map(_unpack, cached.values()))
@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import compare_reports, run_benchmark, run_load
+
+
+class Command(BaseCommand):
+    help = ('Measure query count, SQL/render time and p50/p95 latency of every read-only view, '
+            'or with --load, throughput and tail latency under concurrent clients')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', default='synth_0', help='user to log in as (see generate_synthetic_data)')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--only', nargs='*', help='url names to benchmark, default all')
+        parser.add_argument('--output', help='write the JSON report here')
+        parser.add_argument('--compare', help='previous JSON report to diff against')
+        parser.add_argument('--fail-over-budget', action='store_true',
+                            help='exit non-zero when a view exceeds VIEW_QUERY_BUDGETS')
+        parser.add_argument('--load', action='store_true',
+                            help='concurrent load test instead; compare a WSGI run against '
+                                 'an ASYNC_VIEWS=True --handler asgi run with --output/--compare')
+        parser.add_argument('--handler', choices=['wsgi', 'asgi'], default='wsgi', help='request path for --load')
+        parser.add_argument('--concurrency', type=int, default=8, help='simultaneous clients for --load')
+        parser.add_argument('--requests', type=int, default=200, help='requests per view for --load')
+
+    def handle(self, *args, **options):
+        if options['load']:
+            report = run_load(
+                username=options['username'],
+                handler=options['handler'],
+                concurrency=options['concurrency'],
+                requests=options['requests'],
+                only=options['only'],
+                log=self.stdout.write,
+            )
+        else:
+            report = run_benchmark(
+                username=options['username'],
+                iterations=options['iterations'],
+                only=options['only'],
+                log=self.stdout.write,
+            )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Report written to {options['output']}")
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+            for line in compare_reports(previous, report):
+                self.stdout.write(line)
+        over = [name for name, result in report['views'].items() if result.get('over_budget')]
+        if over and options['fail_over_budget']:
+            raise CommandError(f"Over query budget: {', '.join(over)}")
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.recommendations import benchmark_build, build_neighbors
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the item-item neighbor lists behind /recommendations/ from likes, watched movies '
+            'and reviews (needs numpy and scipy), or with --benchmark time the build on random data')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=50, help='neighbors kept per movie')
+        parser.add_argument('--benchmark', action='store_true', help='time the build on random data instead, the database is not touched')
+        parser.add_argument('--users', type=int, default=100_000, help='users for --benchmark')
+        parser.add_argument('--movies', type=int, default=10_000, help='movies for --benchmark')
+        parser.add_argument('--per-user', type=int, default=50, help='interactions per user for --benchmark')
+        parser.add_argument('--output', help='write the --benchmark timings here as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            if options['benchmark']:
+                timings = benchmark_build(users=options['users'], movies=options['movies'], per_user=options['per_user'],
+                                          k=options['k'], log=self.stdout.write)
+                if options['output']:
+                    with open(options['output'], 'w') as f:
+                        json.dump(timings, f, indent=2, sort_keys=True)
+                return
+            stored = build_neighbors(k=options['k'], log=self.stdout.write)
+        except ImportError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Neighbor lists stored for {stored} movies'))
@@ -0,0 +1,38 @@
+import json
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from core.assets import BundlingStaticFilesStorage, transfer_report
+
+
+class Command(BaseCommand):
+    help = ('Collect static files into STATIC_ROOT as minified stylesheets and shared bundles with hashed names '
+            'and .gz/.br copies, then report the css/js bytes each page transfers before and after')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--report-only', action='store_true', help='skip collectstatic, report on the current STATIC_ROOT')
+        parser.add_argument('--output', help='write the report here as JSON')
+
+    def handle(self, *args, **options):
+        if not isinstance(staticfiles_storage, BundlingStaticFilesStorage):
+            raise CommandError('set STATIC_BUNDLING=True so collectstatic uses core.assets.BundlingStaticFilesStorage')
+        if not options['report_only']:
+            try:
+                call_command('collectstatic', interactive=False, clear=True, verbosity=0)
+            except ValueError as e:
+                raise CommandError(str(e)) from e
+        report = transfer_report()
+        width = max(map(len, report), default=0)
+        self.stdout.write(f"{'page':<{width}}  requests  {'before':>8}  {'after':>8}")
+        for page, row in report.items():
+            self.stdout.write(f"{page:<{width}}  {row['requests_before']:>3} -> {row['requests_after']:<2}  "
+                              f"{row['bytes_before']:>8}  {row['bytes_after']:>8}")
+        before = sum(row['bytes_before'] for row in report.values())
+        after = sum(row['bytes_after'] for row in report.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(report)} pages: {before} -> {after} bytes of local css/js on a first visit of each'))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
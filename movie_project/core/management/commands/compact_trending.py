@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.trending import compact
+
+
+class Command(BaseCommand):
+    help = 'Prune decayed trending scores and refresh the cached trending list (run periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-score', type=float, default=0.01, help='drop movies whose decayed score is below this')
+        parser.add_argument('--rebuild', action='store_true', help='recompute every score from the event tables first')
+
+    def handle(self, *args, **options):
+        kept, removed = compact(min_score=options['min_score'], rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Trending scores: {kept} kept, {removed} removed'))
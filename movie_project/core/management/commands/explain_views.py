@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.advisor import advise
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN QUERY PLAN on the queries every read-only view issues and flag '
+            'full table scans and temp B-tree sorts (seed with generate_synthetic_data first)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', default='synth_0', help='user to log in as (see generate_synthetic_data)')
+        parser.add_argument('--only', nargs='*', help='url names to check, default all')
+        parser.add_argument('--output', help='write the findings as JSON here')
+        parser.add_argument('--fail', action='store_true', help='exit non-zero when anything is flagged')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('explain_views reads SQLite query plans, the default database is ' + connection.vendor)
+        report = advise(username=options['username'], only=options['only'], log=self.stdout.write)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Findings written to {options['output']}")
+        flagged = [name for name, findings in report.items() if findings]
+        if flagged and options['fail']:
+            raise CommandError(f"Queries without a supporting index in: {', '.join(flagged)}")
+        if not flagged:
+            self.stdout.write(self.style.SUCCESS('No full scans or temp sorts found'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from core.synthetic import SYNTHETIC_PASSWORD, generate_dataset
+
+
+class Command(BaseCommand):
+    help = 'Fill an empty database with a deterministic synthetic dataset for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--movies', type=int, default=1000)
+        parser.add_argument('--people', type=int, default=2000)
+        parser.add_argument('--cast-per-movie', type=int, default=8)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--reviews-per-user', type=int, default=10)
+        parser.add_argument('--likes-per-user', type=int, default=30)
+        parser.add_argument('--watched-per-user', type=int, default=30)
+        parser.add_argument('--watchlist-per-user', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        counts = generate_dataset(
+            users=options['users'],
+            movies=options['movies'],
+            people=options['people'],
+            cast_per_movie=options['cast_per_movie'],
+            follows_per_user=options['follows_per_user'],
+            reviews_per_user=options['reviews_per_user'],
+            likes_per_user=options['likes_per_user'],
+            watched_per_user=options['watched_per_user'],
+            watchlist_per_user=options['watchlist_per_user'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {counts['users']} users and {counts['movies']} movies "
+            f"(log in as synth_0 / {SYNTHETIC_PASSWORD})"
+        ))
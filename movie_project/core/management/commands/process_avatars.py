@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.avatars import pending_profiles, process_avatar
+from core.models import Profile
+
+
+class Command(BaseCommand):
+    help = ('Write the resized avatar variants of profiles that have none yet, '
+            'e.g. uploads from before core.avatars or with AVATAR_PROCESSING = "deferred"')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='reprocess every uploaded avatar, e.g. after changing SIZES')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(avatar_url='').exclude(avatar_url__isnull=True) if options['all'] else pending_profiles()
+        started = time.perf_counter()
+        processed = failed = 0
+        for profile_id in list(profiles.values_list('id', flat=True)):
+            if process_avatar(profile_id):
+                processed += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Avatars: {processed} processed, {failed} skipped (missing, unreadable or external) '
+            f'in {time.perf_counter() - started:.2f}s'))
@@ -0,0 +1,31 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.graph import benchmark_graph, build_graph, invalidate_graph
+
+
+class Command(BaseCommand):
+    help = ('Make every process rebuild its in-memory follow graph from the Follower table (through the shared cache), '
+            'or with --benchmark measure build time, memory and query latency on random edges')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--benchmark', action='store_true', help='benchmark on random data, the database is not touched')
+        parser.add_argument('--edges', type=int, default=1_000_000, help='edges for --benchmark')
+        parser.add_argument('--users', type=int, default=100_000, help='users for --benchmark')
+        parser.add_argument('--output', help='write the --benchmark report here as JSON')
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            report = benchmark_graph(edges=options['edges'], users=options['users'], log=self.stdout.write)
+            if options['output']:
+                with open(options['output'], 'w') as f:
+                    json.dump(report, f, indent=2, sort_keys=True)
+            return
+        started = time.perf_counter()
+        graph = build_graph()
+        invalidate_graph()
+        self.stdout.write(self.style.SUCCESS(
+            f'Follow graph: {graph.edge_count} edges, {len(graph.following)} users following someone, '
+            f'built in {time.perf_counter() - started:.2f}s; processes refresh theirs on next use'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.stats import rebuild_movie_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild/reconcile the denormalized MovieStats rows from the Review table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drift, do not write anything')
+
+    def handle(self, *args, **options):
+        created, fixed, cleared = rebuild_movie_stats(dry_run=options['dry_run'])
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}MovieStats: {created} created, {fixed} corrected, {cleared} cleared'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.profiles import rebuild_profile_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild/reconcile the denormalized Profile counters (followers, reviews, likes, ...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drift, do not write anything')
+
+    def handle(self, *args, **options):
+        fixed = rebuild_profile_counters(dry_run=options['dry_run'])
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}Profile counters: {fixed} profiles corrected'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Create (if needed) and repopulate the FTS5 movie search index'
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index()
+        if indexed is None:
+            self.stdout.write(self.style.WARNING('FTS5 is not available on this database, search uses icontains'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} movies'))
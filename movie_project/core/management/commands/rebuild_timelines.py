@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import timeline
+from core.models import Follower, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized feed timelines from Follower/Review/Like/Watched, or just prune them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune-only', action='store_true', help='Only trim every timeline to TIMELINE_MAX_ENTRIES')
+
+    def handle(self, *args, **options):
+        if options['prune_only']:
+            owner_ids = TimelineEntry.objects.values_list('owner_id', flat=True).distinct().order_by()
+            removed = timeline.trim(owner_ids)
+            self.stdout.write(self.style.SUCCESS(f'Pruned {removed} timeline rows'))
+            return
+
+        edges = Follower.objects.values_list('follower_id', 'following_id').order_by('follower_id')
+        with transaction.atomic():
+            TimelineEntry.objects.all().delete()
+            for follower_id, following_id in edges.iterator():
+                timeline.backfill(follower_id, following_id)
+        total = TimelineEntry.objects.count()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt timelines: {total} rows for {edges.count()} follow edges'))
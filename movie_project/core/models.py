@@ -7,6 +7,27 @@ class Profile(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL,on_delete=models.CASCADE,related_name='profile',unique=True)
     bio = models.TextField(blank=True,null=True)
     avatar_url = models.ImageField(upload_to='avatars/',blank=True,null=True)
+    # {"48": {"webp": path, "jpg": path}, ...} resized copies of avatar_url, written by core.avatars
+    avatar_variants = models.JSONField(default=dict,blank=True)
+    # denormalized counters, kept in sync by core.profiles
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    watched_count = models.PositiveIntegerField(default=0)
+    watchlist_count = models.PositiveIntegerField(default=0)
+    COUNTER_FIELDS = ('follower_count', 'following_count', 'review_count', 'like_count', 'watched_count', 'watchlist_count')
+    # written in the background by core.avatars
+    DERIVED_FIELDS = COUNTER_FIELDS + ('avatar_variants',)
+
+    def save(self, *args, **kwargs):
+        # counters only change through F() updates and variants through core.avatars,
+        # so a full save of a stale instance must not write them back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Profile of {self.user}"
@@ -24,19 +45,29 @@ class Follower(models.Model):
     
 
 class Movie(models.Model):
-    movie_name = models.CharField(max_length=255,unique=True)
+    movie_name = models.CharField(max_length=255,db_index=True)
     movie_description = models.TextField()
     release_date = models.DateField()
     genre = models.CharField(max_length=50)
     length = models.IntegerField(help_text='Movie time in minutes')
     poster_url = models.URLField(blank=True,null=True)
+    tmdb_id = models.PositiveIntegerField(unique=True,blank=True,null=True)
+
+    class Meta:
+        indexes = [
+            # the catalog (list_movies): movies with a poster, newest first
+            models.Index(
+                fields=['-release_date', '-id'], name='movie_catalog',
+                condition=models.Q(poster_url__isnull=False) & ~models.Q(poster_url=''),
+            ),
+        ]
 
     def __str__(self):
         return self.movie_name
     
 
 class Person(models.Model):
-    person_name = models.CharField(max_length=255)
+    person_name = models.CharField(max_length=255,db_index=True)
 
     def __str__(self):
         return self.person_name
@@ -63,7 +94,11 @@ class Review(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-
+    class Meta:
+        indexes = [
+            models.Index(fields=['movie', '-created_at'], name='review_movie_recent'),
+            models.Index(fields=['user', '-created_at', '-id'], name='review_user_recent'),
+        ]
 
     def __str__(self):
         return f'Review by {self.user} on {self.movie}'
@@ -87,6 +122,7 @@ class Like(models.Model):
     created_at = models.DateTimeField(auto_now=True)
     class Meta:
         unique_together = ('user', 'movie')
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='like_user_recent')]
 
     def __str__(self):
         return f'{self.user.username} likes {self.movie.movie_name}'
@@ -98,6 +134,81 @@ class Watched(models.Model):
     created_at = models.DateTimeField(auto_now=True)
     class Meta:
         unique_together = ('user', 'movie')
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='watched_user_recent')]
+
+    def __str__(self):
+        return f'{self.user.username} has watched {self.movie.movie_name}'
+
+
+class MovieStats(models.Model):
+    # denormalized review aggregates, kept in sync by core.stats
+    movie = models.OneToOneField(Movie,on_delete=models.CASCADE,primary_key=True,related_name='stats')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    avg_rating = models.FloatField(blank=True,null=True)
+
+    def __str__(self):
+        return f'Stats for {self.movie_id}: {self.review_count} reviews'
+
+
+class TrendingScore(models.Model):
+    # exponentially decayed activity of a movie, kept by core.trending. rank_key is
+    # log2(score) + time in half-lives, so ordering by it never needs re-decaying
+    movie = models.OneToOneField(Movie,on_delete=models.CASCADE,primary_key=True,related_name='trending')
+    rank_key = models.FloatField(db_index=True)
+
+    def __str__(self):
+        return f'Trending {self.movie_id}: {self.rank_key:.3f}'
+
+
+class MovieNeighbors(models.Model):
+    # most similar movies by co-interaction, written by core.recommendations.build_neighbors.
+    # packed arrays (int64 ids, float32 cosine similarities), most similar first
+    movie = models.OneToOneField(Movie,on_delete=models.CASCADE,primary_key=True,related_name='neighbors')
+    neighbor_ids = models.BinaryField()
+    scores = models.BinaryField()
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Neighbors of {self.movie_id}'
+
+
+class UserSeeds(models.Model):
+    # a user's weighted movies (likes, watched, reviews by rating, watchlist) as of the last
+    # build_neighbors, so /recommendations/ never reads the interaction tables.
+    # packed arrays (int64 movie ids, float32 weights), ascending ids
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,on_delete=models.CASCADE,primary_key=True,related_name='recommendation_seeds')
+    movie_ids = models.BinaryField()
+    weights = models.BinaryField()
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Recommendation seeds of {self.user_id}'
+
+
+class TimelineEntry(models.Model):
+    # materialized feed row: one per (follower, event by someone they follow)
+    REVIEW = 'review'
+    LIKE = 'like'
+    WATCHED = 'watched'
+    KIND_CHOICES = [(REVIEW, 'Review'), (LIKE, 'Like'), (WATCHED, 'Watched')]
+
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,on_delete=models.CASCADE,related_name='timeline')
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL,on_delete=models.CASCADE,related_name='+')
+    kind = models.CharField(max_length=10,choices=KIND_CHOICES)
+    movie = models.ForeignKey(Movie,on_delete=models.CASCADE,related_name='+')
+    review = models.ForeignKey(Review,on_delete=models.CASCADE,null=True,blank=True,related_name='+')
+    like = models.ForeignKey(Like,on_delete=models.CASCADE,null=True,blank=True,related_name='+')
+    watched = models.ForeignKey(Watched,on_delete=models.CASCADE,null=True,blank=True,related_name='+')
+    created_at = models.DateTimeField()
+    # hash of the event, mixed with a per-session seed by the feed's shuffle mode (core.timeline)
+    shuffle_key = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-id'], name='timeline_owner_recent'),
+            models.Index(fields=['owner', 'actor'], name='timeline_owner_actor'),
+        ]
 
     def __str__(self):
-        return f'{self.user.username} has watched {self.movie.movie_name}'
\ No newline at end of file
+        return f'{self.actor_id} {self.kind} {self.movie_id} -> {self.owner_id}'
@@ -0,0 +1,139 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from . import fragments
+
+
+def _page_key(request, view_name, version):
+    digest = hashlib.md5(f'{request.get_host()}{request.get_full_path()}'.encode()).hexdigest()
+    return f'page:{view_name}:{version}:{digest}'
+
+
+def movie_page_version(request, movie_id, **kwargs):
+    return fragments.movie_page_version(movie_id)
+
+
+def cache_anonymous_page(version):
+    """Serve a view's full response from the cache for logged-out GETs.
+
+    Keys are the path and query string plus `version(request, **kwargs)`,
+    one of the fragment versions in core.fragments. Review, movie and stats
+    changes bump those (bump_movie), which purges exactly the affected
+    movie's page and the listing pages showing it (listing_version); likes
+    only purge the movie's own page (bump_movie_page). Logged-in users always get a fresh
+    render, and responses that set cookies or a CSRF token are never stored.
+    """
+    def decorator(view):
+        def key_for(request, kwargs):
+            return _page_key(request, view.__name__, version(request, **kwargs))
+
+        def store(request, key, response):
+            cacheable = (
+                response.status_code == 200
+                and not response.streaming
+                and not response.cookies
+                and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            )
+            if cacheable:
+                cache.set(key, response, getattr(settings, 'ANONYMOUS_PAGE_CACHE_TTL', 600))
+                response['X-Page-Cache'] = 'miss'
+            return response
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method != 'GET' or (await request.auser()).is_authenticated:
+                    return await view(request, *args, **kwargs)
+                key = await sync_to_async(key_for)(request, kwargs)
+                response = await cache.aget(key)
+                if response is not None:
+                    response['X-Page-Cache'] = 'hit'
+                    return response
+                response = await view(request, *args, **kwargs)
+                return await sync_to_async(store)(request, key, response)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            key = key_for(request, kwargs)
+            response = cache.get(key)
+            if response is not None:
+                response['X-Page-Cache'] = 'hit'
+                return response
+            return store(request, key, view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def movie_page_etag(request, user, movie_id, **kwargs):
+    # review, like and stats changes bump the movie; the viewer's watchlist/watched marks bump their profile
+    return [fragments.movie_page_version(movie_id)]
+
+
+def profile_page_etag(request, user, username, **kwargs):
+    if username == user.get_username():
+        return None
+    # the one query left: the viewed user's id, to find their version
+    user_id = get_user_model().objects.filter(username=username).values_list('id', flat=True).first()
+    if user_id is None:
+        return None
+    return [user_id, fragments.profile_versions([user_id])[user_id], fragments.movie_edits_version()]
+
+
+def conditional_page(validator):
+    """Answer a GET whose If-None-Match still matches with 304 Not Modified, before the view runs.
+
+    The ETag hashes `validator(request, user, **kwargs)`, a few version
+    stamps from core.fragments (None to skip), with the viewer's id and
+    profile version for the per-user parts of the page (navbar, their
+    likes/watchlist marks, follow buttons), and PAGE_ETAG_VERSION so a
+    deploy with new templates invalidates what browsers kept. Pages are
+    sent `private, no-cache`: browsers keep them but revalidate every time.
+    """
+    def decorator(view):
+        def etag_for(request, user, kwargs):
+            parts = validator(request, user, **kwargs)
+            if parts is None:
+                return None
+            viewer = [user.pk, fragments.profile_versions([user.pk])[user.pk]] if user.is_authenticated else [0]
+            stamp = ':'.join(map(str, [view.__name__, getattr(settings, 'PAGE_ETAG_VERSION', ''), *viewer, *parts]))
+            return f'W/"{hashlib.md5(stamp.encode()).hexdigest()}"'
+
+        def not_modified(request, etag):
+            if etag is None or request.method not in ('GET', 'HEAD'):
+                return None
+            return get_conditional_response(request, etag=etag)
+
+        def finish(request, etag, response):
+            if etag is not None and request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ('Cookie',))
+            return response
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                user = await request.auser()
+                # auser() and request.user cache separately, the templates read request.user
+                request.user = user
+                etag = await sync_to_async(etag_for)(request, user, kwargs) if request.method in ('GET', 'HEAD') else None
+                response = not_modified(request, etag) or await view(request, *args, **kwargs)
+                return finish(request, etag, response)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = etag_for(request, request.user, kwargs) if request.method in ('GET', 'HEAD') else None
+            response = not_modified(request, etag) or view(request, *args, **kwargs)
+            return finish(request, etag, response)
+        return wrapper
+    return decorator
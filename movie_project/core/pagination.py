@@ -0,0 +1,105 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(*values):
+    """Pack keyset values into an opaque, url-safe token"""
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor, returns None for missing or tampered tokens"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset, with opaque next/prev tokens"""
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None, approx_total=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.approx_total = approx_total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _seek(ordering, values, forward):
+    """Q matching rows strictly after (forward) or before `values` in `ordering`"""
+    condition = Q(pk__in=[])
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        lookup = 'lt' if descending == forward else 'gt'
+        equal = {f.lstrip('-'): v for f, v in zip(ordering[:i], values[:i])}
+        condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+    return condition
+
+
+def _row_key(obj, ordering):
+    return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+
+def keyset_paginate(queryset, ordering, cursor=None, per_page=100, approx_total=None):
+    """Paginate `queryset` by seeking past the last seen `ordering` values.
+
+    Unlike Paginator this never COUNTs and never uses OFFSET, so every page
+    costs the same however deep it is. `ordering` must end in a unique field
+    (e.g. ['-release_date', '-id']) so the order is total.
+    """
+    position = decode_cursor(cursor)
+    forward = True
+    qs = queryset.order_by(*ordering)
+    if position and len(position) == len(ordering) + 1 and position[0] in ('n', 'p'):
+        forward = position[0] == 'n'
+        try:
+            qs = qs.filter(_seek(ordering, position[1:], forward))
+        except (ValidationError, ValueError, TypeError):
+            forward, qs = True, queryset.order_by(*ordering)
+            position = None
+    else:
+        position = None
+    if not forward:
+        qs = qs.reverse()
+
+    rows = list(qs[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or not forward:
+            next_cursor = encode_cursor('n', *_row_key(rows[-1], ordering))
+        if position is not None and (forward or has_more):
+            prev_cursor = encode_cursor('p', *_row_key(rows[0], ordering))
+    return KeysetPage(rows, next_cursor, prev_cursor, approx_total)
@@ -0,0 +1,69 @@
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .fragments import bump_profile
+from .models import Follower, Like, Profile, Review, WatchList, Watched
+
+# Profile counter -> (model, user foreign key it counts by)
+COUNTERS = {
+    'follower_count': (Follower, 'following_id'),
+    'following_count': (Follower, 'follower_id'),
+    'review_count': (Review, 'user_id'),
+    'like_count': (Like, 'user_id'),
+    'watched_count': (Watched, 'user_id'),
+    'watchlist_count': (WatchList, 'user_id'),
+}
+# movie lists shown on a profile: name -> (model, counter)
+PROFILE_LISTS = {
+    'watchlist': (WatchList, 'watchlist_count'),
+    'liked': (Like, 'like_count'),
+    'watched': (Watched, 'watched_count'),
+    'reviews': (Review, 'review_count'),
+}
+
+
+def counters_for(model):
+    """(counter, user foreign key) pairs a row of `model` contributes to"""
+    return [(counter, user_field) for counter, (counter_model, user_field) in COUNTERS.items() if counter_model is model]
+
+
+def adjust_counter(user_id, counter, delta):
+    """Shift one profile counter in a single UPDATE, never below zero"""
+    if not user_id or not delta:
+        return
+    value = F(counter) + delta if delta > 0 else Greatest(F(counter) + delta, 0)
+    Profile.objects.filter(user_id=user_id).update(**{counter: value})
+    # every row that moves a counter also changes a list on the profile page
+    bump_profile(user_id)
+
+
+def rebuild_profile_counters(dry_run=False):
+    """Recompute every profile counter from the underlying tables, returns the number of profiles fixed"""
+    actual = {
+        counter: dict(model.objects.values(user_field).annotate(n=Count('id')).values_list(user_field, 'n').order_by())
+        for counter, (model, user_field) in COUNTERS.items()
+    }
+    to_update = []
+    for profile in Profile.objects.only('id', 'user_id', *COUNTERS):
+        changed = False
+        for counter in COUNTERS:
+            value = actual[counter].get(profile.user_id, 0)
+            if getattr(profile, counter) != value:
+                setattr(profile, counter, value)
+                changed = True
+        if changed:
+            to_update.append(profile)
+    if not dry_run:
+        Profile.objects.bulk_update(to_update, list(COUNTERS), batch_size=500)
+    return len(to_update)
+
+
+def profile_list(user, name, limit):
+    """The newest `limit` rows of one profile movie list, movies joined in"""
+    model, _ = PROFILE_LISTS[name]
+    return list(model.objects.filter(user=user).select_related('movie').order_by('-id')[:limit])
+
+
+def profile_lists(user, limit):
+    """profile_list for every list shown on a profile, one query each"""
+    return {name: profile_list(user, name, limit) for name in PROFILE_LISTS}
@@ -0,0 +1,206 @@
+import heapq
+import time
+from array import array
+from collections import defaultdict
+
+from django.db import transaction
+
+from .interactions import cached_movie_ids
+from .models import Like, MovieNeighbors, Review, UserSeeds, WatchList, Watched
+
+# implicit feedback weights; a review counts by its rating, 3 stars being neutral
+LIKE_WEIGHT = 1.0
+WATCHED_WEIGHT = 0.5
+# saving a movie for later says less than having seen it; only a seed (UserSeeds), never in the matrix
+WATCHLIST_SEED_WEIGHT = 0.25
+# movies compared per sparse product, bounds the memory of the similarity step
+BLOCK_SIZE = 1000
+# most of a user's movies used as seeds for one recommendation request
+MAX_SEEDS = 500
+
+
+def _numpy():
+    # only the offline build needs them, the request path reads packed arrays
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError as e:
+        raise ImportError('building recommendations needs numpy and scipy (pip install numpy scipy)') from e
+    return numpy, sparse
+
+
+def _pairs(queryset, fields, np):
+    rows = list(queryset.values_list(*fields).iterator(chunk_size=10000))
+    return np.array(rows, dtype=np.float64).reshape(-1, len(fields))
+
+
+def load_interactions():
+    """(user ids, movie ids, weights) arrays of every like, watched movie and review"""
+    np, _ = _numpy()
+    likes = _pairs(Like.objects.all(), ('user_id', 'movie_id'), np)
+    watched = _pairs(Watched.objects.all(), ('user_id', 'movie_id'), np)
+    reviews = _pairs(Review.objects.all(), ('user_id', 'movie_id', 'rating'), np)
+    users = np.concatenate([likes[:, 0], watched[:, 0], reviews[:, 0]]).astype(np.int64)
+    movies = np.concatenate([likes[:, 1], watched[:, 1], reviews[:, 1]]).astype(np.int64)
+    weights = np.concatenate([
+        np.full(len(likes), LIKE_WEIGHT),
+        np.full(len(watched), WATCHED_WEIGHT),
+        (reviews[:, 2] - 3) / 2,
+    ])
+    return users, movies, weights
+
+
+def load_watchlists():
+    """(user ids, movie ids, weights) arrays of every watchlist entry"""
+    np, _ = _numpy()
+    saved = _pairs(WatchList.objects.all(), ('user_id', 'movie_id'), np)
+    return saved[:, 0].astype(np.int64), saved[:, 1].astype(np.int64), np.full(len(saved), WATCHLIST_SEED_WEIGHT)
+
+
+def user_seeds(users, movies, weights):
+    """Yield (user id, movie ids, summed weights) for every user, movie ids ascending.
+
+    Zero weights (a 3-star review) are kept: the movie still counts as seen.
+    """
+    np, sparse = _numpy()
+    user_ids, rows = np.unique(users, return_inverse=True)
+    movie_ids, cols = np.unique(movies, return_inverse=True)
+    matrix = sparse.coo_matrix((weights, (rows, cols)), shape=(len(user_ids), len(movie_ids))).tocsr()
+    matrix.sort_indices()
+    for row, user_id in enumerate(user_ids):
+        begin, end = matrix.indptr[row], matrix.indptr[row + 1]
+        yield int(user_id), movie_ids[matrix.indices[begin:end]], matrix.data[begin:end]
+
+
+def interaction_matrix(users, movies, weights):
+    """Sparse user x movie CSR matrix (duplicate pairs summed) with the movie id of each column"""
+    np, sparse = _numpy()
+    _, rows = np.unique(users, return_inverse=True)
+    movie_ids, cols = np.unique(movies, return_inverse=True)
+    matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(rows.max(initial=-1) + 1, len(movie_ids)))
+    matrix.eliminate_zeros()
+    return matrix, movie_ids
+
+
+def top_neighbors(matrix, k=50, block_size=BLOCK_SIZE):
+    """Yield (column, neighbor columns, cosine similarities) for every movie column, most similar first.
+
+    Columns are L2-normalized once, then compared BLOCK_SIZE at a time so
+    the movie x movie similarity matrix is never held in memory whole.
+    """
+    np, sparse = _numpy()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = (matrix @ sparse.diags(inverse)).tocsc()
+    transposed = normalized.T.tocsr()
+    for start in range(0, matrix.shape[1], block_size):
+        stop = min(start + block_size, matrix.shape[1])
+        # rows: movies of this block, columns: every movie
+        similarity = (transposed[start:stop] @ normalized).tocsr()
+        for offset in range(stop - start):
+            column = start + offset
+            begin, end = similarity.indptr[offset], similarity.indptr[offset + 1]
+            neighbors, scores = similarity.indices[begin:end], similarity.data[begin:end]
+            keep = (neighbors != column) & (scores > 0)
+            neighbors, scores = neighbors[keep], scores[keep]
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+                neighbors, scores = neighbors[top], scores[top]
+            order = np.argsort(-scores, kind='stable')
+            yield column, neighbors[order], scores[order]
+
+
+def build_neighbors(k=50, log=None):
+    """Recompute the top-k neighbor list of every movie with interactions and every user's seeds.
+
+    Returns the number of movies stored.
+    """
+    np, _ = _numpy()
+    log = log or (lambda msg: None)
+    started = time.perf_counter()
+    interactions = load_interactions()
+    matrix, movie_ids = interaction_matrix(*interactions)
+    log(f'matrix: {matrix.shape[0]} users x {matrix.shape[1]} movies, {matrix.nnz} interactions '
+        f'({time.perf_counter() - started:.2f}s)')
+    rows = [
+        MovieNeighbors(
+            movie_id=int(movie_ids[column]),
+            neighbor_ids=movie_ids[neighbors].astype('int64').tobytes(),
+            scores=scores.astype('float32').tobytes(),
+        )
+        for column, neighbors, scores in top_neighbors(matrix, k)
+        if len(neighbors)
+    ]
+    log(f'neighbors: {len(rows)} movies ({time.perf_counter() - started:.2f}s)')
+    watchlists = load_watchlists()
+    seeds = [
+        UserSeeds(user_id=user_id, movie_ids=seed_ids.astype('int64').tobytes(), weights=weights.astype('float32').tobytes())
+        for user_id, seed_ids, weights in user_seeds(*(np.concatenate(parts) for parts in zip(interactions, watchlists)))
+    ]
+    log(f'seeds: {len(seeds)} users ({time.perf_counter() - started:.2f}s)')
+    with transaction.atomic():
+        MovieNeighbors.objects.all().delete()
+        MovieNeighbors.objects.bulk_create(rows, batch_size=500)
+        UserSeeds.objects.all().delete()
+        UserSeeds.objects.bulk_create(seeds, batch_size=500)
+    return len(rows)
+
+
+def _unpack(raw, typecode):
+    values = array(typecode)
+    values.frombytes(raw)
+    return values
+
+
+def recommend(user, limit=20):
+    """Movie ids for `user`, best first, scored from the stored neighbor lists.
+
+    Reads only precomputed data: the user's UserSeeds row (weighted as in
+    load_interactions, a low rating pushes similar movies down) and one
+    MovieNeighbors row per seed. Seeded movies are not recommended, nor are
+    movies in the user's cached interaction sets, which catches most changes
+    since the last build. Users who had no interactions at the last build get
+    nothing until the next one.
+    """
+    row = UserSeeds.objects.filter(user_id=user.pk).values_list('movie_ids', 'weights').first()
+    if row is None:
+        return []
+    weights = dict(zip(_unpack(row[0], 'q'), _unpack(row[1], 'f')))
+    seen = set(weights) | cached_movie_ids(user)
+    # newest movies (highest ids) first for users with more than MAX_SEEDS
+    seeds = heapq.nlargest(MAX_SEEDS, (movie_id for movie_id, weight in weights.items() if weight))
+    scores = defaultdict(float)
+    rows = MovieNeighbors.objects.filter(movie_id__in=seeds).values_list('movie_id', 'neighbor_ids', 'scores')
+    for seed, neighbor_ids, similarities in rows:
+        for movie_id, similarity in zip(_unpack(neighbor_ids, 'q'), _unpack(similarities, 'f')):
+            if movie_id not in seen:
+                scores[movie_id] += weights[seed] * similarity
+    ranked = heapq.nlargest(limit, scores, key=scores.__getitem__)
+    return [movie_id for movie_id in ranked if scores[movie_id] > 0]
+
+
+def benchmark_build(users=100_000, movies=10_000, per_user=50, k=50, seed=42, log=None):
+    """Time matrix assembly and the neighbor search on random data of the given size, returns the timings.
+
+    Interactions are drawn from a Zipf-like popularity curve so a few movies
+    are very popular, as in real data; nothing touches the database.
+    """
+    np, _ = _numpy()
+    log = log or (lambda msg: None)
+    rng = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, movies + 1) ** 0.8
+    count = users * per_user
+    user_ids = np.repeat(np.arange(users, dtype=np.int64), per_user)
+    movie_ids = rng.choice(movies, size=count, p=popularity / popularity.sum())
+    weights = rng.choice([LIKE_WEIGHT, WATCHED_WEIGHT, 1.0, -1.0], size=count)
+
+    timings = {'users': users, 'movies': movies, 'interactions': count, 'k': k}
+    started = time.perf_counter()
+    matrix, _ = interaction_matrix(user_ids, movie_ids, weights)
+    timings['matrix_s'] = round(time.perf_counter() - started, 3)
+    log(f"matrix {matrix.shape[0]}x{matrix.shape[1]}, {matrix.nnz} nonzeros: {timings['matrix_s']}s")
+    started = time.perf_counter()
+    stored = sum(1 for _ in top_neighbors(matrix, k))
+    timings['neighbors_s'] = round(time.perf_counter() - started, 3)
+    log(f"top-{k} neighbors of {stored} movies: {timings['neighbors_s']}s")
+    return timings
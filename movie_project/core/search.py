@@ -0,0 +1,152 @@
+import re
+
+from django.db import OperationalError, connection
+
+from .models import Movie
+from .pagination import KeysetPage, decode_cursor, encode_cursor
+from .stats import with_stats
+
+FTS_TABLE = 'core_movie_fts'
+# bm25 column weights: title, description, cast/crew names
+RANK_WEIGHTS = (10.0, 1.0, 3.0)
+
+_fts_ready = None
+
+
+def fts_available():
+    """True when the default database is SQLite with FTS5 and the index table exists"""
+    global _fts_ready
+    if _fts_ready is None:
+        _fts_ready = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                _fts_ready = cursor.fetchone() is not None
+    return _fts_ready
+
+
+def ensure_index():
+    """Create the FTS5 table if the database supports it, returns whether it exists"""
+    global _fts_ready
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "movie_name, movie_description, people, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            weights = ', '.join(str(w) for w in RANK_WEIGHTS)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', %s)", [f'bm25({weights})'])
+    except OperationalError:
+        # sqlite built without FTS5
+        _fts_ready = False
+        return False
+    _fts_ready = True
+    return True
+
+
+_DOCUMENT_SQL = (
+    "SELECT m.id, m.movie_name, m.movie_description, COALESCE(GROUP_CONCAT(p.person_name, ' '), '') "
+    "FROM core_movie m "
+    "LEFT JOIN core_moviecast mc ON mc.movie_id = m.id "
+    "LEFT JOIN core_person p ON p.id = mc.person_id "
+)
+
+
+def index_movie(movie_id):
+    """(Re)write the index row of one movie, or drop it if the movie is gone"""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [movie_id])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, movie_name, movie_description, people) "
+            + _DOCUMENT_SQL + "WHERE m.id = %s GROUP BY m.id",
+            [movie_id],
+        )
+
+
+def index_movies(movie_ids):
+    for movie_id in set(movie_ids):
+        index_movie(movie_id)
+
+
+def remove_movie(movie_id):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [movie_id])
+
+
+def rebuild_index():
+    """Drop and repopulate the whole index, returns the number of indexed movies"""
+    if not ensure_index():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, movie_name, movie_description, people) "
+            + _DOCUMENT_SQL + "GROUP BY m.id"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    words = re.findall(r'\w+', query)
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def ranked_page(query, cursor=None, per_page=100):
+    """bm25-ranked, keyset-paginated search results.
+
+    Returns a KeysetPage of movies annotated with stats, or None when the
+    FTS index can't answer the query or finds nothing at all, and callers
+    should fall back to icontains (e.g. 'star OR', where every word must match).
+    """
+    expression = match_expression(query)
+    if not expression or not fts_available():
+        return None
+
+    position = decode_cursor(cursor)
+    forward = True
+    sql = f"SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+    params = [expression]
+    if (position and len(position) == 3 and position[0] in ('n', 'p')
+            and isinstance(position[1], (int, float)) and isinstance(position[2], int)):
+        forward = position[0] == 'n'
+        op = '>' if forward else '<'
+        sql += f" AND (rank {op} %s OR (rank = %s AND rowid {op} %s))"
+        params += [position[1], position[1], position[2]]
+    else:
+        position = None
+    sql += " ORDER BY rank, rowid" if forward else " ORDER BY rank DESC, rowid DESC"
+    sql += " LIMIT %s"
+    params.append(per_page + 1)
+
+    try:
+        with connection.cursor() as db:
+            db.execute(sql, params)
+            hits = db.fetchall()
+    except OperationalError:
+        return None
+    if not hits and position is None:
+        return None
+
+    has_more = len(hits) > per_page
+    hits = hits[:per_page]
+    if not forward:
+        hits.reverse()
+    movies = with_stats(Movie.objects.filter(id__in=[movie_id for movie_id, _ in hits])).in_bulk()
+    rows = [movies[movie_id] for movie_id, _ in hits if movie_id in movies]
+
+    next_cursor = prev_cursor = None
+    if hits:
+        if has_more or not forward:
+            next_cursor = encode_cursor('n', hits[-1][1], hits[-1][0])
+        if position is not None and (forward or has_more):
+            prev_cursor = encode_cursor('p', hits[0][1], hits[0][0])
+    return KeysetPage(rows, next_cursor, prev_cursor)
@@ -1,7 +1,15 @@
-from django.db.models.signals import post_save
+from django.core.management import call_command
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_init, post_delete, post_migrate
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Profile
+from .models import Follower, Like, Movie, MovieCast, Person, Profile, Review, TimelineEntry, WatchList, Watched
+from .profiles import adjust_counter, counters_for
+from .fragments import bump_movie, bump_movie_edits, bump_profile
+from .db import apply_sqlite_pragmas
+from .stats import apply_review_delta
+from .toggles import KINDS, interaction_added, interaction_removed
+from . import avatars, graph, search, timeline, trending
 
 # Default avatar URL
 DEFAULT_AVATAR_URL = "https://img.icons8.com/?size=100&id=tZuAOUGm9AuS&format=png&color=000000"
@@ -18,3 +26,201 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
         #if profile doesnt exist,create.
         else:
             Profile.objects.create(user=instance, avatar_url=DEFAULT_AVATAR_URL)
+
+
+@receiver(post_init, sender=Profile)
+def remember_avatar(sender, instance, **kwargs):
+    # read __dict__ so a deferred avatar_url doesn't trigger a query
+    value = instance.__dict__.get('avatar_url')
+    instance._avatar_snapshot = getattr(value, 'name', value) or ''
+
+
+@receiver(post_save, sender=Profile)
+def process_new_avatar(sender, instance, created, raw=False, **kwargs):
+    if raw or 'avatar_url' not in instance.__dict__:
+        return
+    name = instance.avatar_url.name or ''
+    old, instance._avatar_snapshot = instance._avatar_snapshot, name
+    if name == old and not created:
+        return
+    if not created:
+        # the old variants belong to the old picture; templates use the original until new ones exist
+        avatars.discard(instance.avatar_variants)
+        Profile.objects.filter(pk=instance.pk).update(avatar_variants={})
+        instance.avatar_variants = {}
+    if name and not avatars.is_external(name):
+        avatars.schedule(instance.pk)
+
+
+@receiver(post_init, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    # snapshot of what is currently counted in MovieStats for this review.
+    # read __dict__ so deferred fields don't trigger a query per instance
+    movie_id = instance.__dict__.get('movie_id')
+    rating = instance.__dict__.get('rating')
+    if instance.pk and movie_id is not None and rating is not None:
+        instance._stats_snapshot = (movie_id, rating)
+    else:
+        instance._stats_snapshot = None
+
+
+@receiver(post_save, sender=Review)
+def update_stats_on_review_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = (instance.movie_id, instance.rating)
+    old = instance._stats_snapshot
+    if created:
+        apply_review_delta(new[0], 1, new[1])
+    elif old is None:
+        # loaded without movie/rating, nothing to diff against; rebuild_movie_stats reconciles
+        pass
+    elif old[0] == new[0]:
+        apply_review_delta(new[0], 0, new[1] - old[1])
+    else:
+        apply_review_delta(old[0], -1, -old[1])
+        apply_review_delta(new[0], 1, new[1])
+    instance._stats_snapshot = new
+
+
+@receiver(post_delete, sender=Review)
+def update_stats_on_review_delete(sender, instance, **kwargs):
+    if instance._stats_snapshot is not None:
+        apply_review_delta(instance._stats_snapshot[0], -1, -instance._stats_snapshot[1])
+        instance._stats_snapshot = None
+
+
+@receiver(post_save, sender=Review)
+def fan_out_review(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out(TimelineEntry.REVIEW, instance)
+
+
+@receiver(post_save, sender=Follower)
+def backfill_timeline_on_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.backfill(instance.follower_id, instance.following_id)
+
+
+@receiver(post_delete, sender=Follower)
+def prune_timeline_on_unfollow(sender, instance, **kwargs):
+    timeline.remove_actor(instance.follower_id, instance.following_id)
+
+
+@receiver(post_save, sender=Follower)
+def add_graph_edge(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        graph.edge_changed(instance.follower_id, instance.following_id, added=True)
+
+
+@receiver(post_delete, sender=Follower)
+def remove_graph_edge(sender, instance, **kwargs):
+    graph.edge_changed(instance.follower_id, instance.following_id, added=False)
+
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    if sender.name == 'core':
+        search.ensure_index()
+
+
+@receiver(post_migrate)
+def create_cache_table(sender, using='default', **kwargs):
+    # CACHE_BACKEND=database; a no-op for other backends and tables that exist
+    if sender.name == 'core':
+        call_command('createcachetable', database=using, verbosity=0)
+
+
+@receiver(post_save, sender=Movie)
+def index_movie_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_movie(instance.id)
+
+
+@receiver(post_delete, sender=Movie)
+def unindex_movie_on_delete(sender, instance, **kwargs):
+    search.remove_movie(instance.id)
+
+
+@receiver(post_save, sender=MovieCast)
+@receiver(post_delete, sender=MovieCast)
+def reindex_movie_on_cast_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_movie(instance.movie_id)
+
+
+@receiver(post_save, sender=Person)
+def reindex_movies_on_person_rename(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_movies(MovieCast.objects.filter(person=instance).values_list('movie_id', flat=True))
+
+
+@receiver(post_save, sender=Follower)
+@receiver(post_save, sender=Review)
+def count_profile_row_added(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        for counter, user_field in counters_for(sender):
+            adjust_counter(getattr(instance, user_field), counter, 1)
+
+
+@receiver(post_delete, sender=Follower)
+@receiver(post_delete, sender=Review)
+def count_profile_row_removed(sender, instance, **kwargs):
+    for counter, user_field in counters_for(sender):
+        adjust_counter(getattr(instance, user_field), counter, -1)
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Watched)
+@receiver(post_save, sender=WatchList)
+def interaction_row_added(sender, instance, created, raw=False, **kwargs):
+    # trending, feeds, counters, cached sets and the movie page, see core.toggles
+    if created and not raw:
+        interaction_added(KINDS[sender], instance)
+
+
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Watched)
+@receiver(post_delete, sender=WatchList)
+def interaction_row_removed(sender, instance, **kwargs):
+    # the feed entries are already gone through the cascade
+    interaction_removed(KINDS[sender], instance.user_id, instance.movie_id)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_movie_fragments(sender, instance, raw=False, **kwargs):
+    # also purges the anonymous page cache (core.pagecache); stats changes,
+    # including a review moving between movies, bump in core.stats
+    if not raw:
+        bump_movie(instance.pk if sender is Movie else instance.movie_id)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def bump_movie_edits_version(sender, instance, raw=False, **kwargs):
+    # profiles list movie titles; reviews and likes alone don't change those
+    if not raw:
+        bump_movie_edits()
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=Review)
+def bump_profile_version(sender, instance, created, raw=False, **kwargs):
+    # new rows already bump through adjust_counter, edits (bio, avatar, review text) don't
+    if not raw and not (created and sender is Review):
+        bump_profile(instance.user_id)
+
+
+@receiver(post_save, sender=Review)
+def record_trending_event(sender, instance, created, raw=False, **kwargs):
+    # likes, watches and watchlist adds are recorded by interaction_added
+    if created and not raw:
+        trending.record_event(instance.movie_id, 'review')
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    apply_sqlite_pragmas(connection)
@@ -0,0 +1,78 @@
+from django.db.models import Count, F, FloatField, IntegerField, Sum
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .fragments import bump_movie
+from .models import MovieStats, Review
+
+
+def apply_review_delta(movie_id, count_delta, rating_delta):
+    """Shift the stored review count/rating sum of one movie in a single UPDATE"""
+    if not movie_id or (count_delta == 0 and rating_delta == 0):
+        return
+    new_count = F('review_count') + count_delta
+    new_sum = F('rating_sum') + rating_delta
+    updated = MovieStats.objects.filter(movie_id=movie_id).update(
+        review_count=new_count,
+        rating_sum=new_sum,
+        avg_rating=Cast(new_sum, FloatField()) / NullIf(new_count, 0),
+    )
+    if updated:
+        bump_movie(movie_id)
+    elif count_delta >= 0:
+        # first review for this movie, or stats never built: a delta alone would
+        # only count this change, so take the totals from the reviews instead
+        refresh_movie_stats(movie_id)
+
+
+def refresh_movie_stats(movie_id):
+    """Recompute one movie's MovieStats row from its reviews"""
+    totals = Review.objects.filter(movie_id=movie_id).aggregate(count=Count('id'), total=Sum('rating'))
+    count, total = totals['count'], totals['total'] or 0
+    MovieStats.objects.update_or_create(
+        movie_id=movie_id,
+        defaults={'review_count': count, 'rating_sum': total, 'avg_rating': total / count if count else None},
+    )
+    bump_movie(movie_id)
+
+
+def rebuild_movie_stats(dry_run=False):
+    """Recompute every MovieStats row from the Review table.
+
+    Returns (created, fixed, removed) counts.
+    """
+    actual = {
+        row['movie_id']: (row['count'], row['total'])
+        for row in Review.objects.values('movie_id').annotate(count=Count('id'), total=Sum('rating')).order_by()
+    }
+    stored = {s.movie_id: s for s in MovieStats.objects.all()}
+
+    to_create = []
+    to_update = []
+    for movie_id, (count, total) in actual.items():
+        stats = stored.pop(movie_id, None)
+        avg = total / count if count else None
+        if stats is None:
+            to_create.append(MovieStats(movie_id=movie_id, review_count=count, rating_sum=total, avg_rating=avg))
+        elif (stats.review_count, stats.rating_sum, stats.avg_rating) != (count, total, avg):
+            stats.review_count, stats.rating_sum, stats.avg_rating = count, total, avg
+            to_update.append(stats)
+    # anything left over has no reviews anymore
+    stale = [s for s in stored.values() if s.review_count or s.rating_sum or s.avg_rating is not None]
+    for stats in stale:
+        stats.review_count, stats.rating_sum, stats.avg_rating = 0, 0, None
+    to_update.extend(stale)
+
+    if not dry_run:
+        MovieStats.objects.bulk_create(to_create, batch_size=500)
+        MovieStats.objects.bulk_update(to_update, ['review_count', 'rating_sum', 'avg_rating'], batch_size=500)
+        for stats in to_create + to_update:
+            bump_movie(stats.movie_id)
+    return len(to_create), len(to_update) - len(stale), len(stale)
+
+
+def with_stats(queryset):
+    """Annotate movies with avg_rating/review_count read from MovieStats (no GROUP BY)"""
+    return queryset.annotate(
+        avg_rating=F('stats__avg_rating'),
+        review_count=Coalesce(F('stats__review_count'), 0, output_field=IntegerField()),
+    )
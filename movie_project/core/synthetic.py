@@ -0,0 +1,124 @@
+import io
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Follower, Like, Movie, MovieCast, Person, Profile, Review, WatchList, Watched
+from . import recommendations, search, trending
+from .signals import DEFAULT_AVATAR_URL
+from .profiles import rebuild_profile_counters
+from .stats import rebuild_movie_stats
+
+SYNTHETIC_PASSWORD = 'synthetic-pass'
+GENRES = ['Drama', 'Comedy', 'Action', 'Horror', 'Thriller', 'Romance', 'Animation', 'Documentary']
+WORDS = ['night', 'river', 'last', 'city', 'dark', 'summer', 'king', 'lost', 'star', 'road',
+         'silent', 'house', 'red', 'winter', 'ghost', 'blue', 'heart', 'storm', 'empire', 'dream']
+
+
+def _sample(rng, population, k):
+    return rng.sample(population, min(k, len(population)))
+
+
+def generate_dataset(users=200, movies=1000, people=2000, cast_per_movie=8, follows_per_user=20,
+                     reviews_per_user=10, likes_per_user=30, watched_per_user=30, watchlist_per_user=10,
+                     seed=42, log=None):
+    """Bulk-insert a deterministic synthetic dataset, returns the row counts written.
+
+    The same arguments always produce the same rows (ids aside), so benchmark
+    runs on different branches compare like with like. Meant for an empty
+    database (usernames are synth_<n>). Denormalized tables
+    (MovieStats, profile counters, the search index, feed timelines,
+    trending scores) are rebuilt at the end
+    because bulk_create skips the signals that normally maintain them.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda msg: None)
+    User = get_user_model()
+    password = make_password(SYNTHETIC_PASSWORD)
+    now = timezone.now()
+    counts = {}
+
+    with transaction.atomic():
+        user_objs = User.objects.bulk_create(
+            [User(username=f'synth_{i}', email=f'synth_{i}@example.com', password=password) for i in range(users)],
+            batch_size=500,
+        )
+        user_ids = [user.pk for user in user_objs]
+        # same defaults the post_save signal gives real signups
+        Profile.objects.bulk_create(
+            [Profile(user_id=user_id, bio='synthetic user', avatar_url=DEFAULT_AVATAR_URL) for user_id in user_ids],
+            batch_size=500,
+        )
+        counts['users'] = len(user_objs)
+        log(f'users: {len(user_objs)}')
+
+        movie_objs = Movie.objects.bulk_create([
+            Movie(
+                movie_name=' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title() + f' {i}',
+                movie_description=' '.join(rng.choice(WORDS) for _ in range(30)),
+                release_date=date(1970, 1, 1) + timedelta(days=rng.randint(0, 20000)),
+                genre=rng.choice(GENRES),
+                length=rng.randint(75, 200),
+                poster_url=f'https://example.com/posters/{i}.jpg',
+            )
+            for i in range(movies)
+        ], batch_size=500)
+        movie_ids = [movie.pk for movie in movie_objs]
+        counts['movies'] = len(movie_ids)
+        log(f'movies: {len(movie_ids)}')
+
+        person_objs = Person.objects.bulk_create(
+            [Person(person_name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}') for i in range(people)],
+            batch_size=500,
+        )
+        person_ids = [person.pk for person in person_objs]
+        cast = [
+            MovieCast(movie_id=movie_id, person_id=person_id, role_type='Lead' if n == 0 else 'Actor')
+            for movie_id in movie_ids
+            for n, person_id in enumerate(_sample(rng, person_ids, cast_per_movie))
+        ]
+        MovieCast.objects.bulk_create(cast, batch_size=1000, ignore_conflicts=True)
+        counts['people'], counts['cast'] = len(person_ids), len(cast)
+        log(f'people: {len(person_ids)}, cast rows: {len(cast)}')
+
+        follows, reviews, likes, watched, watchlist = [], [], [], [], []
+        for user_id in user_ids:
+            others = [other for other in _sample(rng, user_ids, follows_per_user + 1) if other != user_id]
+            follows += [Follower(follower_id=user_id, following_id=other) for other in others[:follows_per_user]]
+            reviews += [
+                Review(user_id=user_id, movie_id=movie_id, review_content=' '.join(rng.choice(WORDS) for _ in range(40)),
+                       rating=rng.randint(1, 5))
+                for movie_id in _sample(rng, movie_ids, reviews_per_user)
+            ]
+            likes += [Like(user_id=user_id, movie_id=movie_id) for movie_id in _sample(rng, movie_ids, likes_per_user)]
+            watched += [Watched(user_id=user_id, movie_id=movie_id) for movie_id in _sample(rng, movie_ids, watched_per_user)]
+            watchlist += [WatchList(user_id=user_id, movie_id=movie_id) for movie_id in _sample(rng, movie_ids, watchlist_per_user)]
+        for model, rows in ((Follower, follows), (Review, reviews), (Like, likes), (Watched, watched), (WatchList, watchlist)):
+            model.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+            counts[model._meta.model_name] = len(rows)
+            log(f'{model._meta.verbose_name_plural}: {len(rows)}')
+
+        # spread event times over the last 90 days so feeds have a real ordering
+        for model in (Review, Like, Watched):
+            rows = list(model.objects.filter(user__username__startswith='synth_').only('id').order_by('id'))
+            for row in rows:
+                row.created_at = now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600))
+            model.objects.bulk_update(rows, ['created_at'], batch_size=1000)
+
+    rebuild_movie_stats()
+    rebuild_profile_counters()
+    search.rebuild_index()
+    call_command('rebuild_timelines', stdout=io.StringIO())
+    trending.compact(rebuild=True)
+    log('rebuilt movie stats, profile counters, search index, timelines and trending scores')
+    try:
+        recommendations.build_neighbors()
+        log('built recommendation neighbor lists')
+    except ImportError:
+        log('numpy/scipy not installed, skipped recommendation neighbor lists')
+    return counts
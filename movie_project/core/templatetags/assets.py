@@ -0,0 +1,21 @@
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+from core.assets import BundlingStaticFilesStorage, bundled
+
+register = template.Library()
+
+
+@register.simple_tag
+def stylesheets(*sources):
+    """{% stylesheets 'core/base.css' 'core/feed.css' %}: <link>s for a page's stylesheets, in order.
+
+    Once `manage.py build_static` has built them (STATIC_BUNDLING), the
+    STATIC_BUNDLES among them are linked as one fingerprinted file each and
+    the rest as their minified, fingerprinted copies; otherwise each file
+    is linked through {% static %}.
+    """
+    names = bundled(sources) if isinstance(staticfiles_storage, BundlingStaticFilesStorage) else sources
+    return format_html_join('\n    ', '<link rel="stylesheet" href="{}">', ((static(name),) for name in names))
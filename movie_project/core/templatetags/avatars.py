@@ -0,0 +1,37 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from core.avatars import SIZES, is_external
+
+register = template.Library()
+
+
+def _variant(variants, pixels):
+    # smallest stored size covering `pixels`, else the largest one
+    size = next((size for size in SIZES if size >= pixels), SIZES[-1])
+    return variants.get(str(size))
+
+
+@register.simple_tag
+def avatar(profile, size, alt='', lazy=True):
+    """{% avatar profile 40 alt=user.username %}: <img> of a profile's avatar shown `size` css px wide.
+
+    Uses the resized WebP/JPEG variants (core.avatars) at 1x and 2x when
+    they exist, the original upload otherwise; empty without an avatar.
+    Pass lazy=False for avatars above the fold.
+    """
+    field = profile.avatar_url if profile else None
+    loading = 'lazy' if lazy else 'eager'
+    if not field:
+        return ''
+    one, two = _variant(profile.avatar_variants, size), _variant(profile.avatar_variants, size * 2)
+    if not one or not two:
+        src = field.name if is_external(field.name) else field.url
+        return format_html('<img src="{}" alt="{}" width="{}" height="{}" loading="{}">', src, alt, size, size, loading)
+    url = default_storage.url
+    return format_html(
+        '<picture><source type="image/webp" srcset="{} 1x, {} 2x">'
+        '<img src="{}" srcset="{} 1x, {} 2x" alt="{}" width="{}" height="{}" loading="{}" decoding="async"></picture>',
+        url(one['webp']), url(two['webp']), url(one['jpg']), url(one['jpg']), url(two['jpg']), alt, size, size, loading,
+    )
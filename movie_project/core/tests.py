@@ -1,3 +1,1382 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from array import array
+from contextlib import redirect_stdout
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlparse
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, connections, models
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.paginator import Page
+from django.db.models import QuerySet
+from django.template import Context, Template
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from movie_project import urls as project_urls
+import populate_tmdb
+
+from .advisor import advise
+from .assets import minify_css
+from .async_queries import gather_queries
+from .checks import check_shared_cache
+from .benchmark import benchmark_targets, run_benchmark
+from .fragments import fragment_stats
+from .ingest import IngestWriter
+from .instrumentation import current_recorder, record_queries
+from .interactions import interaction_sets
+from .models import Follower, Like, Movie, MovieCast, MovieNeighbors, MovieStats, Person, Profile, Review, TrendingScore, UserSeeds, WatchList, Watched
+from .pagination import KeysetPage, encode_cursor
+from .profiles import rebuild_profile_counters
+from .recommendations import build_neighbors, recommend
+from .stats import rebuild_movie_stats
+from .social import followed_likes
+from .synthetic import generate_dataset
+from .tmdb import TMDBClient, TMDBError, TokenBucket
+from . import avatars, fragments, graph, search, timeline, trending, views
 
 # Create your tests here.
+
+
+def create_movie(name, **fields):
+    """A movie with filler values for the required fields"""
+    defaults = {'movie_description': '', 'release_date': '2020-01-01', 'genre': 'Drama', 'length': 90}
+    return Movie.objects.create(movie_name=name, **{**defaults, **fields})
+
+
+def create_movies(count, **fields):
+    """`count` movies named 'Movie 0', 'Movie 1', ..."""
+    return [create_movie(f'Movie {i}', **fields) for i in range(count)]
+
+
+class StubTMDBHandler(BaseHTTPRequestHandler):
+    """Serves canned JSON (or raw bytes) per path; a path listed in `failures` answers with those statuses first"""
+    responses = {}
+    failures = {}
+    hits = []
+    retry_after = '0'
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self.hits.append(path)
+        pending = self.failures.get(path)
+        if pending:
+            status = pending.pop(0)
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', self.retry_after)
+            self.end_headers()
+            return
+        body = self.responses.get(path, {})
+        body = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(200 if path in self.responses else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServerTestCase(SimpleTestCase):
+    def setUp(self):
+        StubTMDBHandler.responses = {}
+        StubTMDBHandler.failures = {}
+        StubTMDBHandler.hits = []
+        StubTMDBHandler.retry_after = '0'
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubTMDBHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}/3'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TMDBClientTests(StubServerTestCase):
+    def test_retries_429_and_5xx(self):
+        StubTMDBHandler.responses['/3/movie/1'] = {'id': 1}
+        StubTMDBHandler.failures['/3/movie/1'] = [429, 503]
+        client = TMDBClient('key', base_url=self.base_url, rate=None, backoff=0, log=lambda msg: None)
+        self.assertEqual(client.get('movie/1'), {'id': 1})
+        self.assertEqual(client.requests_made, 3)
+
+    def test_gives_up_after_max_retries(self):
+        StubTMDBHandler.failures['/3/movie/1'] = [500] * 5
+        client = TMDBClient('key', base_url=self.base_url, rate=None, max_retries=2, backoff=0, log=lambda msg: None)
+        with self.assertRaises(TMDBError):
+            client.get('movie/1')
+        self.assertEqual(len(StubTMDBHandler.hits), 3)
+
+    def test_retry_after_is_capped(self):
+        StubTMDBHandler.responses['/3/movie/1'] = {'id': 1}
+        StubTMDBHandler.failures['/3/movie/1'] = [429]
+        StubTMDBHandler.retry_after = '86400'
+        client = TMDBClient('key', base_url=self.base_url, rate=None, max_retry_after=2, log=lambda msg: None)
+        with mock.patch('core.tmdb.time.sleep') as sleep:
+            self.assertEqual(client.get('movie/1'), {'id': 1})
+        sleep.assert_called_once_with(2)
+
+    def test_invalid_json_is_a_tmdb_error(self):
+        StubTMDBHandler.responses['/3/movie/1'] = b'<html>maintenance</html>'
+        client = TMDBClient('key', base_url=self.base_url, rate=None, log=lambda msg: None)
+        with self.assertRaisesMessage(TMDBError, 'movie/1: invalid JSON'):
+            client.get('movie/1')
+
+    def test_stage_reports_request_rate(self):
+        StubTMDBHandler.responses['/3/movie/1'] = {'id': 1}
+        client = TMDBClient('key', base_url=self.base_url, rate=None, log=lambda msg: None)
+        with client.stage('details'):
+            for _ in range(4):
+                client.get('movie/1')
+        self.assertEqual(client.stages[0]['stage'], 'details')
+        self.assertEqual(client.stages[0]['requests'], 4)
+        self.assertGreater(client.stages[0]['requests_per_second'], 0)
+
+
+class PopulateTMDBTests(StubServerTestCase, TestCase):
+    """populate_tmdb.populate_movies against the stub: resume, response cache and --incremental"""
+
+    def setUp(self):
+        super().setUp()
+        StubTMDBHandler.responses['/3/movie/popular'] = {'results': [
+            {'id': tmdb_id, 'title': f'Film {tmdb_id}', 'release_date': '2001-01-01', 'overview': 'x'} for tmdb_id in (1, 2)
+        ]}
+        for endpoint in ('top_rated', 'upcoming', 'now_playing'):
+            StubTMDBHandler.responses[f'/3/movie/{endpoint}'] = {'results': []}
+        for tmdb_id in (1, 2):
+            StubTMDBHandler.responses[f'/3/movie/{tmdb_id}'] = {'id': tmdb_id, 'runtime': 100, 'genres': [{'name': 'Drama'}]}
+            StubTMDBHandler.responses[f'/3/movie/{tmdb_id}/credits'] = {'cast': [{'name': f'Star {tmdb_id}'}], 'crew': []}
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.cache_dir = os.path.join(workdir.name, 'cache')
+        self.checkpoint = os.path.join(workdir.name, 'checkpoint.json')
+
+    def populate(self, **kwargs):
+        kwargs = {'num_movies': 2, 'workers': 2, 'rate': None, 'base_url': self.base_url, 'batch_size': 1,
+                  'cache_dir': self.cache_dir, 'checkpoint_path': self.checkpoint, **kwargs}
+        StubTMDBHandler.hits = []
+        with redirect_stdout(io.StringIO()):
+            return populate_tmdb.populate_movies(**kwargs)
+
+    def detail_hits(self):
+        return sorted(path for path in StubTMDBHandler.hits if path.split('/')[3].isdigit())
+
+    def test_pipeline_writes_movies_and_cast_through_429s(self):
+        StubTMDBHandler.responses['/3/movie/1/credits'] = {
+            'cast': [{'name': 'Star 1'}, {'name': 'Sidekick'}],
+            'crew': [{'name': 'Auteur', 'job': 'Director', 'department': 'Directing'}],
+        }
+        StubTMDBHandler.failures = {'/3/movie/popular': [429], '/3/movie/1': [429, 429], '/3/movie/2/credits': [429]}
+        self.populate(cache_dir=None)
+        self.assertEqual(StubTMDBHandler.hits.count('/3/movie/1'), 3)
+        self.assertEqual(
+            list(Movie.objects.order_by('tmdb_id').values_list('tmdb_id', 'movie_name', 'genre', 'length', 'release_date')),
+            [(1, 'Film 1', 'Drama', 100, date(2001, 1, 1)), (2, 'Film 2', 'Drama', 100, date(2001, 1, 1))],
+        )
+        self.assertEqual(
+            sorted(MovieCast.objects.values_list('movie__tmdb_id', 'person__person_name', 'role_type')),
+            [(1, 'Auteur', 'Director'), (1, 'Sidekick', 'Supporting'), (1, 'Star 1', 'Lead'), (2, 'Star 2', 'Lead')],
+        )
+
+    def test_resumes_an_interrupted_run(self):
+        build_movie = populate_tmdb.build_movie
+        calls = []
+        def crash_on_second(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return build_movie(*args)
+        with mock.patch('populate_tmdb.build_movie', side_effect=crash_on_second):
+            with self.assertRaises(KeyboardInterrupt):
+                self.populate(cache_dir=None)
+        (written,) = Movie.objects.values_list('tmdb_id', flat=True)
+        remaining = 3 - written
+
+        self.populate(cache_dir=None)
+        self.assertEqual(self.detail_hits(), [f'/3/movie/{remaining}', f'/3/movie/{remaining}/credits'])
+        self.assertEqual(sorted(Movie.objects.values_list('tmdb_id', flat=True)), [1, 2])
+        self.assertEqual(MovieCast.objects.count(), 2)
+
+    def test_cached_rerun_makes_no_requests(self):
+        self.populate()
+        self.assertEqual(len(self.detail_hits()), 4)
+        self.populate()
+        self.assertEqual(StubTMDBHandler.hits, [])
+        self.assertEqual(Movie.objects.count(), 2)
+
+    def test_incremental_rerun_only_fetches_changed_movies(self):
+        self.populate()
+        StubTMDBHandler.responses['/3/movie/changes'] = {'results': [], 'total_pages': 1}
+        self.populate(incremental=True)
+        self.assertIn('/3/movie/changes', StubTMDBHandler.hits)
+        self.assertEqual(self.detail_hits(), [])
+
+        StubTMDBHandler.responses['/3/movie/changes'] = {'results': [{'id': 2}], 'total_pages': 1}
+        StubTMDBHandler.responses['/3/movie/2'] = {'id': 2, 'title': 'Film 2 (Director\'s Cut)', 'runtime': 130}
+        self.populate(incremental=True)
+        self.assertEqual(self.detail_hits(), ['/3/movie/2', '/3/movie/2/credits'])
+        self.assertEqual(Movie.objects.get(tmdb_id=2).movie_name, "Film 2 (Director's Cut)")
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_limits_shared_rate(self):
+        bucket = TokenBucket(rate=50, capacity=1)
+        started = time.monotonic()
+        threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 20 tokens at 50/s with no burst can't take less than ~0.38s
+        self.assertGreaterEqual(time.monotonic() - started, 0.35)
+
+
+# small but non-trivial dataset the query budgets in settings are sized against
+BENCHMARK_DATASET = dict(users=30, movies=200, people=300, follows_per_user=10,
+                         reviews_per_user=8, likes_per_user=15, watched_per_user=15)
+
+
+class ViewQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        generate_dataset(**BENCHMARK_DATASET)
+
+    def test_views_stay_within_query_budget(self):
+        names = [name for name, _ in benchmark_targets(get_user_model().objects.get(username='synth_0'))]
+        self.assertTrue(names)
+        for name in names:
+            # every view starts cold, not warmed by the ones measured before it
+            cache.clear()
+            result = run_benchmark(iterations=1, only=[name])['views'][name]
+            with self.subTest(view=name):
+                self.assertEqual(result['status'], 200)
+                budget = settings.VIEW_QUERY_BUDGETS.get(name)
+                self.assertIsNotNone(budget, f'{name} has no entry in VIEW_QUERY_BUDGETS')
+                self.assertLessEqual(result['cold_queries'], budget)
+                self.assertLessEqual(result['queries'], budget)
+                self.assertFalse(result['over_budget'])
+
+    def test_hot_views_use_indexes(self):
+        report = advise(only=['get_all_movies', 'list_one_movie', 'profile', 'view_profile', 'feed'])
+        self.assertEqual(len(report), 5)
+        for name, findings in report.items():
+            with self.subTest(view=name):
+                self.assertEqual([finding['issues'] for finding in findings], [])
+
+
+class IngestWriterTests(TestCase):
+    def movie(self, length=170):
+        return Movie(tmdb_id=7, movie_name='Heat', movie_description='', release_date='1995-12-15', genre='Crime',
+                     length=length)
+
+    def cast_of(self, movie_id):
+        return sorted(MovieCast.objects.filter(movie_id=movie_id).values_list('person__person_name', 'role_type'))
+
+    def test_reimport_replaces_the_cast(self):
+        with IngestWriter() as writer:
+            writer.add(self.movie(), [('Al Pacino', 'Lead'), ('Robert De Niro', 'Lead')])
+        movie_id = Movie.objects.get(tmdb_id=7).id
+        with IngestWriter() as writer:
+            writer.add(self.movie(), [('Al Pacino', 'Lead'), ('Michael Mann', 'Director')])
+        self.assertEqual(self.cast_of(movie_id), [('Al Pacino', 'Lead'), ('Michael Mann', 'Director')])
+        if search.fts_available():
+            self.assertIsNone(search.ranked_page('niro'))
+
+    def test_missing_credits_keep_the_cast(self):
+        with IngestWriter() as writer:
+            writer.add(self.movie(), [('Al Pacino', 'Lead')])
+        with IngestWriter() as writer:
+            writer.add(self.movie(length=171), None)
+        movie = Movie.objects.get(tmdb_id=7)
+        self.assertEqual((movie.length, self.cast_of(movie.id)), (171, [('Al Pacino', 'Lead')]))
+
+
+class MovieStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(f'critic{i}', password='pass') for i in range(2)]
+        cls.movies = create_movies(2)
+
+    def stats(self, movie):
+        stats = MovieStats.objects.filter(movie=movie).first()
+        return (stats.review_count, stats.rating_sum, stats.avg_rating) if stats else None
+
+    def review(self, user, movie, rating):
+        return Review.objects.create(user=user, movie=movie, review_content='text', rating=rating)
+
+    def test_creates_and_rating_edits(self):
+        first, _ = self.movies
+        review = self.review(self.users[0], first, 4)
+        self.review(self.users[1], first, 1)
+        self.assertEqual(self.stats(first), (2, 5, 2.5))
+        review.rating = 2
+        review.save()
+        self.assertEqual(self.stats(first), (2, 3, 1.5))
+        # a fresh instance diffs against what it loaded, not against the first one
+        Review.objects.get(pk=review.pk).save()
+        self.assertEqual(self.stats(first), (2, 3, 1.5))
+
+    def test_review_moved_between_movies(self):
+        first, second = self.movies
+        review = self.review(self.users[0], first, 4)
+        review.movie = second
+        review.rating = 5
+        review.save()
+        self.assertEqual(self.stats(first), (0, 0, None))
+        self.assertEqual(self.stats(second), (1, 5, 5.0))
+
+    def test_deletes(self):
+        first, _ = self.movies
+        review = self.review(self.users[0], first, 4)
+        self.review(self.users[1], first, 2)
+        review.delete()
+        self.assertEqual(self.stats(first), (1, 2, 2.0))
+        Review.objects.filter(movie=first).delete()
+        self.assertEqual(self.stats(first), (0, 0, None))
+
+    def test_missing_row_is_recomputed_from_reviews(self):
+        first, _ = self.movies
+        review = self.review(self.users[0], first, 4)
+        self.review(self.users[1], first, 2)
+        MovieStats.objects.filter(movie=first).delete()
+        review.rating = 5
+        review.save()
+        self.assertEqual(self.stats(first), (2, 7, 3.5))
+
+    def test_rebuild_reconciles_drift(self):
+        first, second = self.movies
+        self.review(self.users[0], first, 4)
+        self.review(self.users[0], second, 3)
+        MovieStats.objects.filter(movie=first).update(review_count=7, rating_sum=1, avg_rating=0.1)
+        MovieStats.objects.filter(movie=second).delete()
+        MovieStats.objects.create(movie=create_movie('Orphan'), review_count=3, rating_sum=9, avg_rating=3.0)
+        self.assertEqual(rebuild_movie_stats(dry_run=True), (1, 1, 1))
+        self.assertEqual(self.stats(first), (7, 1, 0.1))
+        self.assertEqual(rebuild_movie_stats(), (1, 1, 1))
+        self.assertEqual((self.stats(first), self.stats(second)), ((1, 4, 4.0), (1, 3, 3.0)))
+        self.assertEqual(self.stats(Movie.objects.get(movie_name='Orphan')), (0, 0, None))
+        self.assertEqual(rebuild_movie_stats(), (0, 0, 0))
+
+
+class ProfileCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.quiet = User.objects.create_user('quiet', password='pass')
+        cls.busy = User.objects.create_user('busy', password='pass')
+        fans = [User.objects.create_user(f'fan{i}') for i in range(5)]
+        movies = create_movies(20)
+        for fan in fans:
+            Follower.objects.create(follower=fan, following=cls.busy)
+        for movie in movies:
+            for model in (Like, Watched, WatchList):
+                model.objects.create(user=cls.busy, movie=movie)
+            Review.objects.create(user=cls.busy, movie=movie, review_content='ok', rating=4)
+
+    def test_counters_follow_row_changes(self):
+        profile = self.busy.profile
+        profile.refresh_from_db()
+        self.assertEqual((profile.follower_count, profile.review_count, profile.like_count), (5, 20, 20))
+        Follower.objects.filter(follower__username__in=['fan0', 'fan1']).delete()
+        Like.objects.filter(user=self.busy).delete()
+        profile.refresh_from_db()
+        self.assertEqual((profile.follower_count, profile.like_count), (3, 0))
+        self.assertEqual(rebuild_profile_counters(), 0)
+
+    def test_full_profile_save_keeps_counters(self):
+        stale = get_user_model().objects.get(pk=self.busy.pk).profile
+        Review.objects.filter(user=self.busy).first().delete()
+        stale.bio = 'edited'
+        stale.save()
+        self.assertEqual(rebuild_profile_counters(), 0)
+
+    def test_profile_query_count_is_independent_of_activity(self):
+        # the follow graph is built once per process, not per request
+        graph._graph = None
+        graph.follow_graph()
+        counts = []
+        for user in (self.quiet, self.busy):
+            self.client.force_login(user)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class InteractionSetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('viewer', password='pass')
+        cls.movies = create_movies(3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sets_are_cached_and_invalidated_on_change(self):
+        Like.objects.create(user=self.user, movie=self.movies[0])
+        self.assertEqual(interaction_sets(self.user)['liked'], {self.movies[0].id})
+        with self.assertNumQueries(0):
+            interaction_sets(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(user=self.user, movie=self.movies[1])
+            WatchList.objects.create(user=self.user, movie=self.movies[2])
+        sets = interaction_sets(self.user)
+        self.assertEqual(sets['liked'], {self.movies[0].id, self.movies[1].id})
+        self.assertEqual(sets['watchlist'], {self.movies[2].id})
+
+    @override_settings(INTERACTION_SET_MAX=1)
+    def test_heavy_users_only_check_the_page(self):
+        for movie in self.movies:
+            Like.objects.create(user=self.user, movie=movie)
+        self.user.profile.refresh_from_db()
+        sets = interaction_sets(self.user, [self.movies[0].id])
+        self.assertEqual(sets['liked'], {self.movies[0].id})
+        # not cached, the next page gets its own lookup
+        self.assertEqual(interaction_sets(self.user, [self.movies[2].id])['liked'], {self.movies[2].id})
+
+
+class ToggleEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user('toggler', password='pass')
+        cls.fan = User.objects.create_user('fan', password='pass')
+        Follower.objects.create(follower=cls.fan, following=cls.user)
+        cls.movies = create_movies(2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def toggle(self, *actions):
+        body = {'actions': [{'kind': kind, 'movie_id': movie.id, 'active': active} for kind, movie, active in actions]}
+        return self.client.post(reverse('toggle_interactions'), json.dumps(body), content_type='application/json')
+
+    def test_batch_applies_and_reports_state(self):
+        first, second = self.movies
+        response = self.toggle(('liked', first, True), ('watchlist', second, True), ('liked', first, True))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(r['active'], r['changed']) for r in response.json()['results']],
+                         [(True, True), (True, True), (True, False)])
+        self.assertTrue(Like.objects.filter(user=self.user, movie=first).exists())
+        self.assertTrue(self.fan.timeline.filter(like__movie=first).exists())
+        self.user.profile.refresh_from_db()
+        self.assertEqual((self.user.profile.like_count, self.user.profile.watchlist_count), (1, 1))
+
+        response = self.toggle(('liked', first, False), ('watched', second, False))
+        self.assertEqual([r['changed'] for r in response.json()['results']], [True, False])
+        self.assertFalse(Like.objects.filter(user=self.user).exists())
+        self.assertFalse(self.fan.timeline.exists())
+        self.user.profile.refresh_from_db()
+        self.assertEqual((self.user.profile.like_count, self.user.profile.watched_count), (0, 0))
+
+    def test_cached_sets_see_the_change(self):
+        self.assertEqual(interaction_sets(self.user)['liked'], frozenset())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.toggle(('liked', self.movies[0], True))
+        self.assertEqual(interaction_sets(self.user)['liked'], {self.movies[0].id})
+
+    def test_rejects_bad_input(self):
+        self.assertEqual(self.client.post(reverse('toggle_interactions'), 'nope', content_type='application/json').status_code, 400)
+        self.assertEqual(self.toggle(('rated', self.movies[0], True)).status_code, 400)
+        missing = Movie(id=999999)
+        self.assertEqual(self.toggle(('liked', self.movies[0], True), ('liked', missing, True)).status_code, 404)
+        self.assertFalse(Like.objects.exists())
+
+    def test_links_still_work(self):
+        url = reverse('like', kwargs={'movie_id': self.movies[0].id})
+        self.assertEqual(self.client.get(url, HTTP_REFERER='/movies/').status_code, 302)
+        self.assertTrue(Like.objects.filter(user=self.user, movie=self.movies[0]).exists())
+        self.assertEqual(self.client.get(reverse('like', kwargs={'movie_id': 999999}), HTTP_REFERER='/movies/').status_code, 404)
+
+
+class ToggleRaceTests(TransactionTestCase):
+    """The foreign key catches a movie deleted after apply_toggles checked it, on commit"""
+
+    def test_movie_deleted_mid_batch_is_a_404(self):
+        user = get_user_model().objects.create_user('racer', password='pass')
+        movie = create_movie('Gone')
+        self.client.force_login(user)
+        body = {'actions': [{'kind': 'liked', 'movie_id': movie.id, 'active': True}]}
+        with mock.patch('core.toggles._check_movies', side_effect=lambda ids: Movie.objects.filter(id__in=ids).delete()):
+            response = self.client.post(reverse('toggle_interactions'), json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Like.objects.exists())
+        user.profile.refresh_from_db()
+        self.assertEqual(user.profile.like_count, 0)
+
+
+class CatalogPaginationTests(TestCase):
+    """Keyset cursors of the catalog (104 per page, newest release first)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('browser', password='pass')
+        # 23 movies per release date, so page boundaries fall inside a tie on the sort key
+        Movie.objects.bulk_create([
+            Movie(movie_name=f'Movie {i}', movie_description='', release_date=date(2020, 1, 1 + i % 10), genre='Drama',
+                  length=90, poster_url='poster.jpg')
+            for i in range(230)
+        ])
+        cls.expected = list(Movie.objects.order_by('-release_date', '-id').values_list('id', flat=True))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def page(self, cursor=None):
+        response = self.client.get(reverse('get_all_movies'), {'cursor': cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj']
+
+    def ids(self, page):
+        return [movie.id for movie in page]
+
+    def test_next_and_prev_round_trip(self):
+        pages = [self.page()]
+        self.assertFalse(pages[0].has_previous)
+        while pages[-1].has_next:
+            pages.append(self.page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [104, 104, 22])
+        self.assertEqual([movie_id for page in pages for movie_id in self.ids(page)], self.expected)
+
+        for newer, older in zip(reversed(pages[:-1]), reversed(pages[1:])):
+            back = self.page(older.prev_cursor)
+            self.assertEqual(self.ids(back), self.ids(newer))
+            self.assertEqual(self.ids(self.page(back.next_cursor)), self.ids(older))
+
+    def test_ties_on_release_date_split_across_pages(self):
+        first = self.page()
+        second = self.page(first.next_cursor)
+        self.assertEqual(first.object_list[-1].release_date, second.object_list[0].release_date)
+        self.assertEqual(self.ids(first) + self.ids(second), self.expected[:208])
+
+    def test_garbage_and_tampered_cursors_start_over(self):
+        first = self.ids(self.page())
+        for cursor in ['not a cursor', '!!!', encode_cursor('n'), encode_cursor('x', '2020-01-05', 1),
+                       encode_cursor('n', 'yesterday', 'x'), encode_cursor('n', '2020-01-05', 1, 2),
+                       encode_cursor('p', None, None), 'eyJhIjoxfQ']:
+            with self.subTest(cursor=cursor):
+                page = self.page(cursor)
+                self.assertEqual(self.ids(page), first)
+                self.assertFalse(page.has_previous)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('searcher', password='pass')
+        cls.title = create_movie('Star Wars')
+        cls.description = create_movie('Fandom', movie_description='a film about star wars fans')
+        cls.cast = create_movie('Heat')
+        MovieCast.objects.create(movie=cls.cast, person=Person.objects.create(person_name='Al Pacino'), role_type='Lead')
+
+    def setUp(self):
+        if not search.fts_available():
+            self.skipTest('needs SQLite with FTS5')
+        self.client.force_login(self.user)
+
+    def search(self, query, cursor=None):
+        params = {'q': query, 'cursor': cursor} if cursor else {'q': query}
+        return self.client.get(reverse('search_movies'), params).context['page_obj']
+
+    def ids(self, page):
+        return [movie.id for movie in page]
+
+    def test_title_outranks_description(self):
+        self.assertEqual(self.ids(self.search('wars')), [self.title.id, self.description.id])
+
+    def test_every_word_matches_as_a_prefix(self):
+        self.assertEqual(self.ids(self.search('sta war')), [self.title.id, self.description.id])
+        self.assertEqual(self.ids(self.search('star fans')), [self.description.id])
+        self.assertEqual(self.ids(self.search('pacin')), [self.cast.id])
+
+    def test_pages_forward_and_back(self):
+        for i in range(120):
+            create_movie(f'Alien {i}')
+        first = self.search('alien')
+        second = self.search('alien', first.next_cursor)
+        self.assertEqual((len(first), len(second), second.has_next), (100, 20, False))
+        self.assertFalse(set(self.ids(first)) & set(self.ids(second)))
+        self.assertEqual(self.ids(self.search('alien', second.prev_cursor)), self.ids(first))
+
+    def test_falls_back_to_icontains(self):
+        lodestar = create_movie('Lodestar Origins')
+        # no word starts with "star" followed by one starting with "or", the substring still matches
+        self.assertEqual(self.ids(self.search('star OR')), [lodestar.id])
+        self.assertEqual(self.ids(self.search('"')), [])
+        with mock.patch('core.search.fts_available', return_value=False):
+            self.assertEqual(self.ids(self.search('heat')), [self.cast.id])
+
+
+@override_settings(TIMELINE_MAX_ENTRIES=3)
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.star = User.objects.create_user('star', password='pass')
+        cls.fans = [User.objects.create_user(f'fan{i}', password='pass') for i in range(2)]
+        for fan in cls.fans:
+            Follower.objects.create(follower=fan, following=cls.star)
+        cls.movies = create_movies(5)
+
+    def test_fan_out_trims_every_follower(self):
+        likes = [Like.objects.create(user=self.star, movie=movie) for movie in self.movies]
+        for fan in self.fans:
+            self.assertEqual(list(fan.timeline.order_by('-created_at', '-id').values_list('like_id', flat=True)),
+                             [like.id for like in reversed(likes[2:])])
+
+    def test_trim_only_prunes_timelines_over_the_cap(self):
+        fan_ids = [fan.id for fan in self.fans]
+        Like.objects.create(user=self.star, movie=self.movies[0])
+        with self.assertNumQueries(1):
+            self.assertEqual(timeline.trim(fan_ids), 0)
+        with override_settings(TIMELINE_MAX_ENTRIES=10):
+            for movie in self.movies[1:]:
+                Like.objects.create(user=self.star, movie=movie)
+        self.fans[1].timeline.exclude(like__movie=self.movies[0]).delete()
+        self.assertEqual(timeline.trim(fan_ids), 2)
+        self.assertEqual([fan.timeline.count() for fan in self.fans], [3, 1])
+
+    def test_feed_read_does_not_write(self):
+        for movie in self.movies:
+            Like.objects.create(user=self.star, movie=movie)
+        self.client.force_login(self.fans[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('feed'))
+        self.assertEqual(len(response.context['entries']), 3)
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('DELETE')])
+
+    def test_shuffled_pages_seek_and_follow_the_seed(self):
+        fan = self.fans[0]
+        with override_settings(TIMELINE_MAX_ENTRIES=100):
+            for i in range(20):
+                movie = create_movie(f'Extra {i}')
+                Like.objects.create(user=self.star, movie=movie)
+
+        def walk(seed):
+            seen, cursor = [], None
+            while True:
+                with self.assertNumQueries(1):
+                    entries, cursor = timeline.shuffled_page(fan, seed, cursor=cursor, per_page=6)
+                seen += [entry.id for entry in entries]
+                if cursor is None:
+                    return seen
+
+        first = walk(1)
+        self.assertEqual(sorted(first), sorted(fan.timeline.values_list('id', flat=True)))
+        self.assertEqual(walk(1), first)
+        # another seed is another order, not the same one starting elsewhere
+        second = walk(2)
+        self.assertFalse(any(first[i:] + first[:i] == second for i in range(len(first))))
+
+        self.client.force_login(fan)
+        response = self.client.get(reverse('feed'), {'mode': 'shuffle'})
+        seed = self.client.session['feed_shuffle_seed']
+        self.assertEqual([entry.id for entry in response.context['entries']], walk(seed))
+        _, cursor = timeline.shuffled_page(fan, seed, per_page=6)
+        response = self.client.get(reverse('feed'), {'mode': 'shuffle', 'cursor': cursor})
+        self.assertEqual([entry.id for entry in response.context['entries']], walk(seed)[6:])
+
+    def test_prune_only_command_trims_in_batches(self):
+        for movie in self.movies:
+            Like.objects.create(user=self.star, movie=movie)
+        with override_settings(TIMELINE_MAX_ENTRIES=1), mock.patch('core.timeline.TRIM_BATCH', 1):
+            call_command('rebuild_timelines', '--prune-only', stdout=io.StringIO())
+        self.assertEqual([fan.timeline.count() for fan in self.fans], [1, 1])
+
+
+class TrendingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('trender', password='pass')
+        cls.movies = create_movies(3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_scores_decay_and_accumulate(self):
+        now = time.time()
+        old, fresh, busy = self.movies
+        trending.record_event(old.id, 'liked', when=now - 10 * trending.half_life())
+        trending.record_event(fresh.id, 'liked', when=now)
+        for _ in range(3):
+            trending.record_event(busy.id, 'liked', when=now)
+        scores = {row.movie_id: trending.score_at(row.rank_key, now) for row in TrendingScore.objects.all()}
+        self.assertAlmostEqual(scores[fresh.id], 3.0)
+        self.assertAlmostEqual(scores[busy.id], 9.0)
+        self.assertAlmostEqual(scores[old.id], 3.0 / 1024)
+        self.assertEqual([m['id'] for m in trending.top_movies()], [busy.id, fresh.id, old.id])
+
+    def test_signals_feed_scores_and_compaction_matches(self):
+        Like.objects.create(user=self.user, movie=self.movies[0])
+        WatchList.objects.create(user=self.user, movie=self.movies[1])
+        Review.objects.create(user=self.user, movie=self.movies[1], review_content='ok', rating=3)
+        self.client.force_login(self.user)
+        self.client.post(reverse('toggle_interactions'), json.dumps({'actions': [
+            {'kind': 'watched', 'movie_id': self.movies[2].id, 'active': True}]}), content_type='application/json')
+        self.assertEqual([m['id'] for m in trending.top_movies()], [self.movies[1].id, self.movies[0].id, self.movies[2].id])
+        incremental = dict(TrendingScore.objects.values_list('movie_id', 'rank_key'))
+        self.assertEqual(trending.compact(rebuild=True), (3, 0))
+        rebuilt = dict(TrendingScore.objects.values_list('movie_id', 'rank_key'))
+        self.assertAlmostEqual(rebuilt[self.movies[0].id], incremental[self.movies[0].id], places=3)
+        # watchlist rows carry no timestamp, so a rebuild only keeps the review
+        self.assertLess(rebuilt[self.movies[1].id], incremental[self.movies[1].id])
+        self.assertEqual(trending.compact(min_score=100), (0, 3))
+
+    def test_page_reads_the_cached_list(self):
+        trending.record_event(self.movies[0].id, 'review')
+        trending.refresh_top()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('trending'))
+        self.assertContains(response, 'Movie 0')
+        self.assertNotIn('core_trendingscore', ' '.join(q['sql'] for q in queries.captured_queries))
+        self.assertContains(self.client.get(reverse('home')), 'Trending now')
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user('reco', password='pass')
+        cls.others = [User.objects.create_user(f'other{i}') for i in range(3)]
+        cls.movies = create_movies(5)
+
+    def setUp(self):
+        cache.clear()
+
+    def store(self, movie, neighbors):
+        MovieNeighbors.objects.create(
+            movie=movie,
+            neighbor_ids=array('q', [m.id for m, _ in neighbors]).tobytes(),
+            scores=array('f', [score for _, score in neighbors]).tobytes(),
+        )
+
+    def store_seeds(self, seeds):
+        UserSeeds.objects.create(
+            user=self.user,
+            movie_ids=array('q', [m.id for m, _ in seeds]).tobytes(),
+            weights=array('f', [weight for _, weight in seeds]).tobytes(),
+        )
+
+    def test_scores_candidates_from_neighbor_lists(self):
+        m = self.movies
+        self.store_seeds([(m[0], 1.0), (m[1], 0.5)])
+        self.store(m[0], [(m[1], 0.9), (m[2], 0.5), (m[3], 0.4)])
+        self.store(m[1], [(m[3], 0.3), (m[0], 0.2)])
+        self.store(m[4], [(m[2], 0.99)])
+        # the user's seeds and the neighbor rows, never the interaction tables
+        with CaptureQueriesContext(connection) as queries:
+            ranked = recommend(self.user)
+        self.assertEqual([q['sql'].split(' FROM ')[1].split()[0] for q in queries.captured_queries],
+                         ['"core_userseeds"', '"core_movieneighbors"'])
+        self.assertEqual(ranked, [m[3].id, m[2].id])
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('recommendations'))
+        self.assertEqual([movie.id for movie in response.context['movies']], [m[3].id, m[2].id])
+
+    def test_low_ratings_push_down_and_cached_sets_exclude(self):
+        m = self.movies
+        self.store(m[0], [(m[1], 0.9), (m[2], 0.5)])
+        self.store(m[3], [(m[2], 0.8), (m[4], 0.6)])
+        self.store_seeds([(m[0], 1.0), (m[3], -1.0)])
+        self.assertEqual(recommend(self.user), [m[1].id])
+        self.assertEqual(recommend(get_user_model().objects.get(username='other0')), [])
+        # liked after the last build, known from the cached sets
+        Like.objects.create(user=self.user, movie=m[1])
+        interaction_sets(self.user)
+        self.assertEqual(recommend(self.user), [])
+
+    def test_build_from_interactions(self):
+        m = self.movies
+        for user in self.others:
+            Like.objects.create(user=user, movie=m[0])
+            Like.objects.create(user=user, movie=m[1])
+        Watched.objects.create(user=self.others[0], movie=m[2])
+        Review.objects.create(user=self.others[1], movie=m[3], review_content='bad', rating=1)
+        Like.objects.create(user=self.user, movie=m[0])
+        Review.objects.create(user=self.user, movie=m[4], review_content='meh', rating=3)
+        self.assertEqual(build_neighbors(k=2), 3)
+        seeds = UserSeeds.objects.get(user=self.user)
+        self.assertEqual(list(zip(array('q', seeds.movie_ids), array('f', seeds.weights))), [(m[0].id, 1.0), (m[4].id, 0.0)])
+        self.assertEqual(recommend(self.user), [m[1].id, m[2].id])
+        WatchList.objects.create(user=self.user, movie=m[1])
+        build_neighbors(k=2)
+        self.assertEqual(recommend(self.user), [m[2].id])
+
+    def test_benchmark_build_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'timings.json')
+            call_command('build_recommendations', '--benchmark', '--users', '200', '--movies', '50', '--per-user', '5',
+                         '--k', '5', '--output', output, stdout=io.StringIO())
+            with open(output) as f:
+                timings = json.load(f)
+        self.assertEqual((timings['users'], timings['movies'], timings['interactions']), (200, 50, 1000))
+        self.assertGreaterEqual(timings['neighbors_s'], 0)
+
+
+class FollowedLikesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user('watcher', password='pass')
+        cls.friends = [User.objects.create_user(f'friend{i}') for i in range(5)]
+        stranger = User.objects.create_user('stranger')
+        cls.movies = create_movies(3, poster_url='https://example.com/p.jpg')
+        for friend in cls.friends:
+            Follower.objects.create(follower=cls.user, following=friend)
+            Like.objects.create(user=friend, movie=cls.movies[0])
+        Like.objects.create(user=cls.friends[0], movie=cls.movies[1])
+        Like.objects.create(user=stranger, movie=cls.movies[1])
+        Like.objects.create(user=stranger, movie=cls.movies[2])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_one_query_for_the_page(self):
+        with self.assertNumQueries(1):
+            likes = followed_likes(self.user, [movie.id for movie in self.movies], samples=2)
+        self.assertEqual(set(likes), {self.movies[0].id, self.movies[1].id})
+        self.assertEqual(likes[self.movies[0].id][0], 5)
+        self.assertEqual(len(likes[self.movies[0].id][1]), 2)
+        self.assertEqual(likes[self.movies[1].id], (1, ['friend0']))
+        self.assertContains(self.client.get(reverse('get_all_movies')), 'Liked by friend0 you follow')
+
+    def test_liked_by_following_only_lists_followed_users(self):
+        response = self.client.get(reverse('liked_by_following', kwargs={'movie_id': self.movies[1].id}))
+        self.assertEqual([user.username for user in response.context['liked_by']], ['friend0'])
+        self.assertEqual(self.client.get(reverse('liked_by_following', kwargs={'movie_id': 999999})).status_code, 404)
+
+
+class FollowGraphTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.me = User.objects.create_user('me', password='pass')
+        cls.a, cls.b, cls.c, cls.d = [User.objects.create_user(name) for name in 'abcd']
+        # me -> a, b; a -> c, d; b -> c, me
+        for follower, following in ((cls.me, cls.a), (cls.me, cls.b), (cls.a, cls.c), (cls.a, cls.d),
+                                    (cls.b, cls.c), (cls.b, cls.me)):
+            Follower.objects.create(follower=follower, following=following)
+
+    def setUp(self):
+        cache.clear()
+        graph._graph = None
+
+    def test_suggestions_and_mutuals(self):
+        g = graph.follow_graph()
+        self.assertEqual(g.edge_count, 6)
+        self.assertEqual(g.suggestions(self.me.id), [(self.c.id, 2), (self.d.id, 1)])
+        self.assertTrue(g.is_mutual(self.me.id, self.b.id))
+        self.assertFalse(g.is_mutual(self.me.id, self.a.id))
+        self.assertEqual(g.mutuals(self.me.id), [self.b.id])
+        with self.assertNumQueries(0):
+            graph.follow_graph().suggestions(self.me.id)
+
+    def test_follow_and_unfollow_update_the_graph(self):
+        graph.follow_graph()
+        self.client.force_login(self.me)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('follow_user', kwargs={'username': 'c'}))
+        self.assertEqual(graph.follow_graph().suggestions(self.me.id), [(self.d.id, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('unfollow_user', kwargs={'username': 'b'}))
+        self.assertFalse(graph.follow_graph().follows(self.me.id, self.b.id))
+        self.assertEqual(graph.follow_graph().followers[self.b.id].tolist(), [])
+
+    def test_follow_committed_during_a_rebuild_is_kept(self):
+        graph.follow_graph()
+        snapshot = graph.build_graph
+
+        def slow_build():
+            built = snapshot()
+            # commits after the snapshot was read, applied to the old graph only
+            with self.captureOnCommitCallbacks(execute=True):
+                Follower.objects.create(follower=self.me, following=self.d)
+            return built
+
+        with mock.patch.object(graph, 'build_graph', slow_build):
+            graph._build_and_swap(None)
+        self.assertTrue(graph.follow_graph().follows(self.me.id, self.d.id))
+        self.assertIsNone(graph._pending)
+
+    def test_pages_use_the_graph(self):
+        self.client.force_login(self.me)
+        response = self.client.get(reverse('profile'))
+        self.assertEqual([(user.username, mutual) for user, mutual in response.context['suggestions']], [('c', 2), ('d', 1)])
+        self.assertTrue(self.client.get(reverse('view_profile', kwargs={'username': 'b'})).context['follows_you'])
+        self.assertFalse(self.client.get(reverse('view_profile', kwargs={'username': 'a'})).context['follows_you'])
+
+
+def image_file(name='me.png', size=(640, 480), mode='RGBA'):
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(out, 'PNG')
+    return SimpleUploadedFile(name, out.getvalue(), content_type='image/png')
+
+
+@override_settings(AVATAR_PROCESSING='sync')
+class AvatarTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = get_user_model().objects.create_user('pic', password='pass')
+        self.client.force_login(self.user)
+
+    def upload(self, file):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('edit_profile'), {'bio': 'hi', 'avatar_url': file})
+        self.assertEqual(response.status_code, 302)
+        return Profile.objects.get(user=self.user)
+
+    def test_upload_writes_square_variants(self):
+        from PIL import Image
+        profile = self.upload(image_file())
+        self.assertEqual(sorted(profile.avatar_variants, key=int), ['48', '96', '256'])
+        for size, formats in profile.avatar_variants.items():
+            for ext, fmt in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+                with default_storage.open(formats[ext]) as f, Image.open(f) as image:
+                    self.assertEqual((image.format, image.size), (fmt, (int(size), int(size))))
+
+        html = Template('{% load avatars %}{% avatar profile 40 alt="me" %}').render(Context({'profile': profile}))
+        self.assertIn('<picture>', html)
+        self.assertIn(default_storage.url(profile.avatar_variants['48']['webp']) + ' 1x', html)
+        self.assertIn(default_storage.url(profile.avatar_variants['96']['jpg']) + ' 2x', html)
+
+        old = avatars.variant_paths(profile.avatar_variants)
+        profile = self.upload(image_file('new.png', mode='RGB'))
+        self.assertTrue(profile.avatar_variants)
+        self.assertFalse(any(default_storage.exists(path) for path in old))
+
+    def test_deferred_processing_and_backfill(self):
+        with self.settings(AVATAR_PROCESSING='deferred'):
+            profile = self.upload(image_file())
+        self.assertEqual(profile.avatar_variants, {})
+        # originals are served until the backfill runs
+        html = Template('{% load avatars %}{% avatar profile 40 %}').render(Context({'profile': profile}))
+        self.assertIn(profile.avatar_url.url, html)
+        self.assertEqual(list(avatars.pending_profiles()), [profile])
+
+        call_command('process_avatars', stdout=io.StringIO())
+        profile.refresh_from_db()
+        self.assertEqual(len(profile.avatar_variants), 3)
+        self.assertFalse(avatars.pending_profiles().exists())
+
+    def test_decompression_bomb_is_skipped(self):
+        from PIL import Image
+        with self.settings(AVATAR_PROCESSING='deferred'):
+            profile = self.upload(image_file())
+        # Pillow refuses images over twice its limit outright
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 10), self.assertLogs('core.avatars', 'WARNING'):
+            self.assertEqual(avatars.process_avatar(profile.id), {})
+
+    def test_default_avatar_url_is_left_alone(self):
+        profile = self.user.profile
+        self.assertTrue(avatars.is_external(profile.avatar_url.name))
+        self.assertFalse(avatars.pending_profiles().exists())
+        html = Template('{% load avatars %}{% avatar profile 40 %}').render(Context({'profile': profile}))
+        self.assertIn(f'src="{profile.avatar_url.name}"'.replace('&', '&amp;'), html)
+
+
+class StaticBundleTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('styled', password='pass')
+        self.client.force_login(self.user)
+
+    def test_minify_css(self):
+        css = '/* nav */\n.a > .b ,\n.c {\n    color: red;\n    height: calc(100vh - 70px);\n}\n'
+        self.assertEqual(minify_css(css), '.a>.b,.c{color:red;height:calc(100vh - 70px)}')
+
+    def test_pages_link_their_stylesheets_separately_until_built(self):
+        response = self.client.get(reverse('feed'))
+        self.assertContains(response, 'href="/static/core/base.css"')
+        self.assertContains(response, 'href="/static/core/feed.css"')
+
+    def test_build_links_the_shared_bundle_and_the_page_stylesheet(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        storages = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'core.assets.BundlingStaticFilesStorage'}}
+        with self.settings(STATIC_ROOT=root.name, STORAGES=storages):
+            out = io.StringIO()
+            call_command('build_static', stdout=out)
+            self.assertIn('core/feed.html', out.getvalue())
+            links = {}
+            for page in ('feed', 'profile'):
+                html = self.client.get(reverse(page)).content.decode()
+                links[page] = [line.split('/static/')[1].split('"')[0]
+                               for line in html.splitlines() if 'rel="stylesheet"' in line and '/static/' in line]
+            base, feed = links['feed']
+            self.assertEqual(links['profile'][0], base)
+            self.assertRegex(base, r'^core/bundles/base\.[0-9a-f]{12}\.css$')
+            self.assertRegex(feed, r'^core/feed\.[0-9a-f]{12}\.css$')
+            with open(os.path.join(root.name, base)) as f:
+                self.assertIn('.navbar{', f.read())
+            with open(os.path.join(root.name, feed)) as f:
+                stylesheet = f.read()
+            self.assertIn('.feed-container{', stylesheet)
+            self.assertNotIn('.navbar{', stylesheet)
+            self.assertTrue(os.path.exists(os.path.join(root.name, base + '.gz')))
+
+
+class FragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.author = User.objects.create_user('author', password='pass')
+        cls.reader = User.objects.create_user('reader', password='pass')
+        cls.movie = create_movie('Cached', poster_url='https://example.com/p.jpg')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def test_review_list_is_shared_and_refreshed_on_change(self):
+        url = reverse('list_one_movie', args=[self.movie.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.author, movie=self.movie, review_content='first take', rating=4)
+        self.assertContains(self.client.get(url), 'first take')
+        hits = fragment_stats()['movie_reviews']['hits']
+        self.assertContains(self.client.get(url), 'first take')
+        self.assertEqual(fragment_stats()['movie_reviews']['hits'], hits + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.reader, movie=self.movie, review_content='second take', rating=2)
+        response = self.client.get(url)
+        self.assertContains(response, 'second take')
+        # the author's actions are in the shared html but only revealed for the author
+        self.assertContains(response, f'data-owner="{self.author.id}"')
+        self.assertContains(response, f'.review-actions[data-owner="{self.reader.id}"]')
+
+    def test_movie_card_picks_up_new_stats(self):
+        self.client.get(reverse('get_all_movies'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.author, movie=self.movie, review_content='ok', rating=3)
+        self.assertContains(self.client.get(reverse('get_all_movies')), '3.0/5 (1)')
+
+
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('critic', password='pass')
+        cls.movie = create_movie('Public', poster_url='https://example.com/p.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_cached_until_purged(self):
+        url = reverse('list_one_movie', args=[self.movie.id])
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(url + '?page=2')['X-Page-Cache'], 'miss')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.user, movie=self.movie, review_content='purged', rating=5)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'purged')
+        self.assertEqual(self.client.get(reverse('get_all_movies'))['X-Page-Cache'], 'miss')
+
+    def test_likes_only_purge_the_movie_page(self):
+        movie_url, catalog_url = reverse('list_one_movie', args=[self.movie.id]), reverse('get_all_movies')
+        self.client.get(movie_url)
+        self.client.get(catalog_url)
+        versions = fragments.movie_versions([self.movie.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(user=self.user, movie=self.movie)
+        self.assertEqual(self.client.get(catalog_url)['X-Page-Cache'], 'hit')
+        self.assertEqual(fragments.movie_versions([self.movie.id]), versions)
+        response = self.client.get(movie_url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertEqual(response.context['movie'].liked_by.count(), 1)
+
+    def test_reviews_only_purge_the_catalog_pages_listing_the_movie(self):
+        Movie.objects.bulk_create([
+            Movie(movie_name=f'Old {i}', movie_description='', release_date=date(2000, 1, 1), genre='Drama', length=90,
+                  poster_url='https://example.com/p.jpg')
+            for i in range(104)
+        ])
+        first_url = reverse('get_all_movies')
+        second_url = f"{first_url}?cursor={self.client.get(first_url).context['page_obj'].next_cursor}"
+        self.client.get(second_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.user, movie=self.movie, review_content='purged', rating=5)
+        self.assertEqual(self.client.get(second_url)['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(first_url)['X-Page-Cache'], 'miss')
+
+        # an edit can move movies between pages
+        with self.captureOnCommitCallbacks(execute=True):
+            Movie.objects.filter(movie_name='Old 0').first().save()
+        self.assertEqual(self.client.get(second_url)['X-Page-Cache'], 'miss')
+
+    def test_logged_in_users_bypass_the_cache(self):
+        url = reverse('get_all_movies')
+        self.client.get(url)
+        self.client.force_login(self.user)
+        self.assertFalse(self.client.get(url).has_header('X-Page-Cache'))
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.viewer = User.objects.create_user('viewer', password='pass')
+        cls.other = User.objects.create_user('other', password='pass')
+        cls.movie = create_movie('Fresh', poster_url='https://example.com/p.jpg')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.viewer)
+
+    def revalidate(self, url, client=None):
+        client = client or self.client
+        etag = client.get(url)['ETag']
+        return etag, client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_answer_304_without_their_queries(self):
+        for url in (reverse('list_one_movie', args=[self.movie.id]), reverse('get_all_movies'),
+                    reverse('view_profile', kwargs={'username': 'other'})):
+            etag, _ = self.revalidate(url)
+            # session and user, plus the profile's user id
+            with self.assertNumQueries(3 if 'profile' in url else 2):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_changes_and_viewers_get_new_etags(self):
+        movie_url = reverse('list_one_movie', args=[self.movie.id])
+        etag, _ = self.revalidate(movie_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.other, movie=self.movie, review_content='new', rating=4)
+        self.assertEqual(self.client.get(movie_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # the viewer's own marks on the page
+        etag, _ = self.revalidate(movie_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('add_to_watchlist', args=[self.movie.id]))
+        self.assertEqual(self.client.get(movie_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag, _ = self.revalidate(movie_url)
+        other = self.client_class()
+        other.force_login(self.other)
+        self.assertEqual(other.get(movie_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        profile_url = reverse('view_profile', kwargs={'username': 'other'})
+        etag, response = self.revalidate(profile_url)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('follow_user', kwargs={'username': 'other'}))
+        self.assertEqual(self.client.get(profile_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag, _ = self.revalidate(profile_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Profile.objects.filter(user=self.other).first().save()
+        self.assertEqual(self.client.get(profile_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+# the ASYNC_VIEWS routes ahead of the project's, for AsyncViewTests
+urlpatterns = [
+    path('movies/', views.alist_movies),
+    path('movies/<int:movie_id>/', views.alist_one_movie),
+    path('profile/<str:username>/', views.aview_profile),
+    path('feed/', views.afeed),
+    *project_urls.urlpatterns,
+]
+
+
+def context_snapshot(response, keys):
+    """The given context values with models reduced to their pks, comparable across responses"""
+    def plain(value):
+        if isinstance(value, models.Model):
+            return value.pk, getattr(value, 'avg_rating', None), getattr(value, 'review_count', None)
+        if isinstance(value, Page):
+            return [plain(item) for item in value.object_list], value.number, value.paginator.count
+        if isinstance(value, KeysetPage):
+            return [plain(item) for item in value.object_list], value.next_cursor, value.prev_cursor
+        if isinstance(value, (list, tuple, QuerySet)):
+            return [plain(item) for item in value]
+        return value
+    return {key: plain(response.context[key]) for key in keys}
+
+
+class AsyncViewTests(TestCase):
+    """The async page variants render the same context as the sync views they replace"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.viewer = User.objects.create_user('viewer', password='pass')
+        cls.critic = User.objects.create_user('critic', password='pass')
+        Follower.objects.create(follower=cls.viewer, following=cls.critic)
+        cls.movies = create_movies(3, poster_url='https://example.com/p.jpg')
+        for i, movie in enumerate(cls.movies):
+            Review.objects.create(user=cls.critic, movie=movie, review_content=f'review {i}', rating=i + 2)
+        Like.objects.create(user=cls.critic, movie=cls.movies[0])
+        Like.objects.create(user=cls.viewer, movie=cls.movies[1])
+        Watched.objects.create(user=cls.critic, movie=cls.movies[2])
+        WatchList.objects.create(user=cls.viewer, movie=cls.movies[2])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.viewer)
+        self.async_client.force_login(self.viewer)
+
+    def assertSameContext(self, url, keys):
+        expected = self.client.get(url)
+        sync_view = expected.resolver_match.func.__name__
+        with override_settings(ROOT_URLCONF=__name__):
+            response = async_to_sync(self.async_client.get)(url)
+            self.assertEqual(response.resolver_match.func.__name__, 'a' + sync_view)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(context_snapshot(response, keys), context_snapshot(expected, keys))
+
+    def test_catalog(self):
+        self.assertSameContext(reverse('get_all_movies'), ['movies', 'page_obj', 'watchlist', 'liked_movies', 'watched_movies'])
+
+    def test_movie(self):
+        self.assertSameContext(reverse('list_one_movie', args=[self.movies[1].id]),
+                               ['movie', 'page_obj', 'reviews', 'watchlist', 'liked', 'watched'])
+
+    def test_profile(self):
+        self.assertSameContext(reverse('view_profile', kwargs={'username': 'critic'}),
+                               ['username', 'profile', 'bio', 'watch_list', 'reviews', 'liked', 'watched',
+                                'is_following', 'follows_you'])
+
+    def test_feed(self):
+        self.assertSameContext(reverse('feed'), ['mode', 'entries', 'next_cursor', 'is_first_page'])
+
+
+@override_settings(SQLITE_PRAGMAS={})
+class QueryInstrumentationTests(TransactionTestCase):
+    """gather_queries workers use their own connections, their queries still count towards the request"""
+
+    def test_worker_queries_are_recorded(self):
+        with record_queries() as recorder:
+            async_to_sync(gather_queries)(lambda: Movie.objects.count(), lambda: Review.objects.count())
+        self.assertEqual(recorder.count, 2)
+        self.assertIsNone(current_recorder())
+
+    def test_async_view_reports_worker_queries(self):
+        User = get_user_model()
+        viewer = User.objects.create_user('viewer', password='pass')
+        User.objects.create_user('critic', password='pass')
+        url = reverse('view_profile', kwargs={'username': 'critic'})
+
+        def logged_queries(client, get):
+            client.force_login(viewer)
+            with self.assertLogs('core.queries', 'INFO') as logs:
+                # the second request, once the follow graph and the interaction sets are cached
+                for _ in range(2):
+                    self.assertEqual(get(url).status_code, 200)
+            return json.loads(logs.records[-1].getMessage())['queries']
+
+        with override_settings(QUERY_INSTRUMENTATION=True):
+            client = self.client_class()
+            expected = logged_queries(client, client.get)
+            with override_settings(ROOT_URLCONF=__name__):
+                client = self.async_client_class()
+                self.assertEqual(logged_queries(client, async_to_sync(client.get)), expected)
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_per_process_cache_is_flagged_for_deploys(self):
+        self.assertEqual([w.id for w in check_shared_cache(None)], ['core.W001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'django_cache'}}
+        with self.settings(CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class SQLiteWALTests(SimpleTestCase):
+    """Readers on their own connections keep answering while another connection commits write bursts"""
+    PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'wal.sqlite3')
+
+    def connect(self, read_only=False):
+        # a standalone connection to a file database, configured through the connection_created receiver
+        name = f'file:{self.path}?mode=ro' if read_only else self.path
+        wrapper = DatabaseWrapper({**connections['default'].settings_dict, 'NAME': name}, alias='wal_test')
+        wrapper.ensure_connection()
+        return wrapper
+
+    @override_settings(SQLITE_PRAGMAS=PRAGMAS)
+    def test_readers_are_not_blocked_by_write_bursts(self):
+        primary = self.connect()
+        self.addCleanup(primary.close)
+        with primary.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('CREATE TABLE burst (id INTEGER PRIMARY KEY, payload TEXT)')
+            # bursts bigger than the page cache, which in rollback-journal mode would spill
+            # to the database file under an EXCLUSIVE lock and stall every reader
+            cursor.execute('PRAGMA cache_size = 16')
+
+        bursts, rows_per_burst = 30, 200
+        writing = threading.Event()
+        done = threading.Event()
+        results = []
+
+        def reader():
+            db = self.connect(read_only=True)
+            slowest, seen, errors = 0.0, [], []
+            writing.wait()
+            try:
+                while not done.is_set():
+                    started = time.perf_counter()
+                    try:
+                        with db.cursor() as cursor:
+                            cursor.execute('SELECT COUNT(*) FROM burst')
+                            seen.append(cursor.fetchone()[0])
+                    except Exception as e:
+                        errors.append(e)
+                    slowest = max(slowest, time.perf_counter() - started)
+            finally:
+                db.close()
+            results.append((slowest, seen, errors))
+
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        writing.set()
+        try:
+            for _ in range(bursts):
+                primary.connection.execute('BEGIN IMMEDIATE')
+                primary.connection.executemany('INSERT INTO burst (payload) VALUES (?)', [('x' * 1000,)] * rows_per_burst)
+                time.sleep(0.01)  # hold the write lock like a slow request would
+                primary.connection.execute('COMMIT')
+        finally:
+            done.set()
+            for thread in readers:
+                thread.join()
+
+        for slowest, seen, errors in results:
+            self.assertEqual(errors, [])
+            self.assertTrue(seen, 'reader never got a read in during the bursts')
+            # readers only ever see whole, committed bursts, in order
+            self.assertEqual(seen, sorted(seen))
+            self.assertTrue(all(count % rows_per_burst == 0 for count in seen))
+            # nobody waited on the writer's lock (10ms per burst, 300ms in total)
+            self.assertLess(slowest, 0.1)
@@ -0,0 +1,169 @@
+import hashlib
+from itertools import islice
+from heapq import merge
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Follower, Like, Review, TimelineEntry, Watched
+from .pagination import decode_cursor, encode_cursor
+
+
+# odd, so multiplying by it modulo 2**31 reorders keys without collisions
+SHUFFLE_MULTIPLIER = 0x9E3779B1
+# owners trimmed per query, keeps the IN lists under SQLite's variable limit
+TRIM_BATCH = 500
+
+
+def max_entries():
+    return getattr(settings, 'TIMELINE_MAX_ENTRIES', 500)
+
+
+def shuffle_key(kind, event_id):
+    """31-bit hash of an event, identical for every follower's copy, see shuffled_position()"""
+    digest = hashlib.blake2b(f'{kind}:{event_id}'.encode(), digest_size=4).digest()
+    return int.from_bytes(digest, 'big') & 0x7FFFFFFF
+
+
+def _entry(owner_id, kind, event):
+    return TimelineEntry(
+        owner_id=owner_id,
+        actor_id=event.user_id,
+        kind=kind,
+        movie_id=event.movie_id,
+        review=event if kind == TimelineEntry.REVIEW else None,
+        like=event if kind == TimelineEntry.LIKE else None,
+        watched=event if kind == TimelineEntry.WATCHED else None,
+        created_at=event.created_at,
+        shuffle_key=shuffle_key(kind, event.pk),
+    )
+
+
+def fan_out(kind, event):
+    """Push a freshly written review/like/watched into every follower's timeline and trim those timelines"""
+    follower_ids = list(Follower.objects.filter(following_id=event.user_id).values_list('follower_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        [_entry(owner_id, kind, event) for owner_id in follower_ids],
+        batch_size=500,
+    )
+    trim(follower_ids)
+
+
+def recent_events(actor_id, limit):
+    """Newest `limit` events of one user as (kind, event) pairs, newest first"""
+    sources = [
+        (TimelineEntry.REVIEW, Review.objects.filter(user_id=actor_id)),
+        (TimelineEntry.LIKE, Like.objects.filter(user_id=actor_id)),
+        (TimelineEntry.WATCHED, Watched.objects.filter(user_id=actor_id)),
+    ]
+    streams = [
+        [(kind, event) for event in qs.only('id', 'user_id', 'movie_id', 'created_at').order_by('-created_at', '-id')[:limit]]
+        for kind, qs in sources
+    ]
+    return list(islice(merge(*streams, key=lambda pair: pair[1].created_at, reverse=True), limit))
+
+
+def backfill(owner_id, actor_id):
+    """Copy the recent history of a newly followed user into the follower's timeline"""
+    entries = [_entry(owner_id, kind, event) for kind, event in recent_events(actor_id, max_entries())]
+    TimelineEntry.objects.bulk_create(entries, batch_size=500)
+    prune(owner_id)
+
+
+def remove_actor(owner_id, actor_id):
+    TimelineEntry.objects.filter(owner_id=owner_id, actor_id=actor_id).delete()
+
+
+def prune(owner_id):
+    """Drop everything older than the newest max_entries() rows of one timeline"""
+    cutoff = (
+        TimelineEntry.objects.filter(owner_id=owner_id)
+        .order_by('-created_at', '-id')
+        .values_list('created_at', 'id')[max_entries():max_entries() + 1]
+    )
+    cutoff = list(cutoff)
+    if not cutoff:
+        return 0
+    created_at, entry_id = cutoff[0]
+    deleted, _ = TimelineEntry.objects.filter(owner_id=owner_id).filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=entry_id)
+    ).delete()
+    return deleted
+
+
+def trim(owner_ids):
+    """Cut every timeline of `owner_ids` to its newest max_entries() rows, returns the number of rows deleted.
+
+    One grouped COUNT per TRIM_BATCH owners finds the timelines over the cap
+    and only those are pruned, so a fan_out to followers with short
+    timelines costs a single index-only query.
+    """
+    owner_ids = list(owner_ids)
+    deleted = 0
+    for start in range(0, len(owner_ids), TRIM_BATCH):
+        over_cap = list(
+            TimelineEntry.objects.filter(owner_id__in=owner_ids[start:start + TRIM_BATCH])
+            .values('owner_id').annotate(entries=Count('id')).filter(entries__gt=max_entries())
+            .values_list('owner_id', flat=True)
+        )
+        for owner_id in over_cap:
+            deleted += prune(owner_id)
+    return deleted
+
+
+def timeline_page(owner, cursor=None, per_page=30):
+    """One newest-first page of a user's timeline.
+
+    Returns (entries, next_cursor); next_cursor is None on the last page.
+    """
+    entries = TimelineEntry.objects.filter(owner=owner)
+    position = decode_cursor(cursor)
+    if position and len(position) == 2 and isinstance(position[1], int):
+        created_at = parse_datetime(str(position[0]))
+        if created_at is not None:
+            entries = entries.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=position[1])
+            )
+    entries = list(
+        entries.select_related('actor__profile', 'movie', 'review')
+        .order_by('-created_at', '-id')[:per_page + 1]
+    )
+    next_cursor = None
+    if len(entries) > per_page:
+        entries = entries[:per_page]
+        last = entries[-1]
+        next_cursor = encode_cursor(last.created_at.isoformat(), last.id)
+    return entries, next_cursor
+
+
+def shuffled_position(seed):
+    """Per-seed position of an entry: its stored shuffle_key mixed with `seed`.
+
+    XOR with the seed then a multiply by an odd constant (a bijection on 31
+    bits) gives every seed its own order rather than a rotation of one
+    shared order. Computed in SQL, so pages can seek on it.
+    """
+    return (F('shuffle_key').bitxor(seed) * SHUFFLE_MULTIPLIER).bitand(0x7FFFFFFF)
+
+
+def shuffled_page(owner, seed, cursor=None, per_page=30):
+    """One page of a user's timeline in the shuffled order of `seed`.
+
+    Returns (entries, next_cursor) like timeline_page. Each page seeks past
+    the last (position, id) seen, with no OFFSET or COUNT; timelines are
+    capped at max_entries() rows, so sorting one is cheap.
+    """
+    entries = TimelineEntry.objects.filter(owner=owner).annotate(position=shuffled_position(seed))
+    position = decode_cursor(cursor)
+    if position and len(position) == 2 and all(isinstance(value, int) for value in position):
+        entries = entries.filter(Q(position__gt=position[0]) | Q(position=position[0], id__gt=position[1]))
+    entries = list(
+        entries.select_related('actor__profile', 'movie', 'review')
+        .order_by('position', 'id')[:per_page + 1]
+    )
+    next_cursor = None
+    if len(entries) > per_page:
+        entries = entries[:per_page]
+        next_cursor = encode_cursor(entries[-1].position, entries[-1].id)
+    return entries, next_cursor
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TMDB_BASE_URL = 'https://api.themoviedb.org/3'
+IMAGE_BASE_URL = 'https://image.tmdb.org/t/p/w500'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# longest Retry-After we honour, a bad header shouldn't park a worker for hours
+MAX_RETRY_AFTER = 60
+
+
+class TMDBError(Exception):
+    pass
+
+
+def _write_json(path, data):
+    """Atomically replace `path` with `data` so a crash never leaves half a file"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class ResponseCache:
+    """On-disk cache of decoded TMDB responses, keyed by path and params (minus the api key)"""
+
+    def __init__(self, directory, max_age=None):
+        self.directory = Path(directory)
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, path, params):
+        key = json.dumps([path, sorted((k, str(v)) for k, v in params.items() if k != 'api_key')])
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return self.directory / digest[:2] / f'{digest}.json'
+
+    def get(self, path, params):
+        file = self._file(path, params)
+        try:
+            if self.max_age is not None and time.time() - file.stat().st_mtime > self.max_age:
+                raise FileNotFoundError
+            with open(file) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def set(self, path, params, data):
+        _write_json(self._file(path, params), data)
+
+
+class Checkpoint:
+    """Progress of an import run, saved to a JSON file so a crashed run can resume"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.data = {'in_progress': False, 'written': [], 'last_completed': None}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.data.update(json.load(f))
+        self.written = set(self.data['written'])
+
+    @property
+    def resuming(self):
+        return self.data['in_progress']
+
+    @property
+    def last_completed(self):
+        value = self.data['last_completed']
+        return datetime.fromisoformat(value) if value else None
+
+    def start(self):
+        """Begin a run; an unfinished previous run is continued instead of reset"""
+        if not self.resuming:
+            self.written = set()
+            self.data['started'] = datetime.now(timezone.utc).isoformat()
+        self.data['in_progress'] = True
+        self.save()
+
+    def mark_written(self, tmdb_ids):
+        self.written.update(tmdb_ids)
+        self.save()
+
+    def finish(self):
+        self.data['in_progress'] = False
+        self.data['last_completed'] = self.data.get('started')
+        self.written = set()
+        self.save()
+
+    def save(self):
+        self.data['written'] = sorted(self.written)
+        _write_json(self.path, self.data)
+
+
+class TokenBucket:
+    """Thread-safe token bucket, `rate` tokens per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TMDBClient:
+    """Pooled, rate limited TMDB client that is safe to share between worker threads"""
+
+    def __init__(self, api_key, base_url=TMDB_BASE_URL, rate=40, workers=8,
+                 max_retries=5, backoff=0.5, timeout=10, cache=None, log=print, max_retry_after=MAX_RETRY_AFTER):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.limiter = TokenBucket(rate) if rate else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.cache = cache
+        self.log = log
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests_made = 0
+        self.stages = []
+        self._count_lock = threading.Lock()
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0), self.max_retry_after)
+            except ValueError:
+                pass
+        return self.backoff * (2 ** attempt) * (1 + random.random() / 2)
+
+    def get(self, path, refresh=False, **params):
+        """GET a TMDB endpoint and return the decoded JSON, retrying 429/5xx with backoff.
+
+        With a ResponseCache, a cached answer is replayed unless `refresh` is set.
+        """
+        url = f'{self.base_url}/{path.lstrip("/")}'
+        params = {'api_key': self.api_key, 'language': 'en-US', **params}
+        if self.cache and not refresh:
+            cached = self.cache.get(path, params)
+            if cached is not None:
+                return cached
+        for attempt in range(self.max_retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            with self._count_lock:
+                self.requests_made += 1
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise TMDBError(f'{path}: {e}') from e
+                time.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                time.sleep(self._retry_delay(attempt, response))
+                continue
+            if response.status_code != 200:
+                raise TMDBError(f'{path}: HTTP {response.status_code}')
+            try:
+                data = response.json()
+            except ValueError as e:
+                raise TMDBError(f'{path}: invalid JSON: {e}') from e
+            if self.cache:
+                self.cache.set(path, params, data)
+            return data
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage and report its wall time and request rate"""
+        started = time.perf_counter()
+        requests_before = self.requests_made
+        stats = {'stage': name}
+        try:
+            yield stats
+        finally:
+            elapsed = time.perf_counter() - started
+            count = self.requests_made - requests_before
+            stats.update(seconds=round(elapsed, 3), requests=count,
+                         requests_per_second=round(count / elapsed, 2) if elapsed else 0.0)
+            self.stages.append(stats)
+            self.log(f"[{name}] {count} requests in {elapsed:.2f}s ({stats['requests_per_second']} req/s)")
@@ -0,0 +1,141 @@
+from django.db import IntegrityError, connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from .fragments import bump_movie_page
+from .interactions import INTERACTIONS, invalidate
+from .models import Like, Movie, TimelineEntry
+from .profiles import adjust_counter
+from . import timeline, trending
+
+# interaction kinds that are fanned out to followers' feeds -> TimelineEntry kind (and its foreign key)
+FEED_KINDS = {'liked': TimelineEntry.LIKE, 'watched': TimelineEntry.WATCHED}
+# interaction model -> kind
+KINDS = {model: kind for kind, (model, _) in INTERACTIONS.items()}
+# most toggles accepted in one request
+MAX_TOGGLES = 100
+
+
+class ToggleError(ValueError):
+    pass
+
+
+def parse_toggles(data):
+    """Validate a decoded {"actions": [{"kind", "movie_id", "active"}, ...]} body into (kind, movie_id, active) tuples"""
+    actions = data.get('actions') if isinstance(data, dict) else None
+    if not isinstance(actions, list) or not actions:
+        raise ToggleError('expected a non-empty "actions" list')
+    if len(actions) > MAX_TOGGLES:
+        raise ToggleError(f'at most {MAX_TOGGLES} actions per request')
+    toggles = []
+    for action in actions:
+        if not isinstance(action, dict) or action.get('kind') not in INTERACTIONS:
+            raise ToggleError(f"kind must be one of {', '.join(INTERACTIONS)}")
+        movie_id, active = action.get('movie_id'), action.get('active')
+        if type(movie_id) is not int or type(active) is not bool:
+            raise ToggleError('movie_id must be an integer and active a boolean')
+        toggles.append((action['kind'], movie_id, active))
+    return toggles
+
+
+def _insert(model, user_id, movie_id, now):
+    """INSERT the row unless it exists, returns the new id or None"""
+    ops, meta = connection.ops, model._meta
+    values = {'user': user_id, 'movie': movie_id}
+    if any(field.name == 'created_at' for field in meta.concrete_fields):
+        values['created_at'] = ops.adapt_datetimefield_value(now)
+    columns = ', '.join(ops.quote_name(meta.get_field(name).column) for name in values)
+    placeholders = ', '.join(['%s'] * len(values))
+    sql = f'{ops.insert_statement(on_conflict=OnConflict.IGNORE)} {ops.quote_name(meta.db_table)} ({columns}) VALUES ({placeholders})'
+    suffix = ops.on_conflict_suffix_sql([], OnConflict.IGNORE, None, None)
+    if suffix:
+        sql += ' ' + suffix
+    returning = connection.features.can_return_columns_from_insert
+    if returning:
+        sql += ' RETURNING ' + ops.quote_name(meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(values.values()))
+        if returning:
+            row = cursor.fetchone()
+            return row[0] if row else None
+        inserted = cursor.rowcount == 1
+    # backend can't return the id from an insert
+    return model.objects.filter(user_id=user_id, movie_id=movie_id).values_list('pk', flat=True).get() if inserted else None
+
+
+def _delete(model, user_id, movie_id):
+    """DELETE the row if it exists, returns whether it did"""
+    ops, meta = connection.ops, model._meta
+    sql = (f"DELETE FROM {ops.quote_name(meta.db_table)} "
+           f"WHERE {ops.quote_name(meta.get_field('user').column)} = %s AND {ops.quote_name(meta.get_field('movie').column)} = %s")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, movie_id])
+        return cursor.rowcount > 0
+
+
+def interaction_added(kind, row):
+    """Side effects of a new like/watched/watchlist row, for the post_save signal and apply_toggles' raw inserts"""
+    trending.record_event(row.movie_id, kind)
+    if kind in FEED_KINDS:
+        timeline.fan_out(FEED_KINDS[kind], row)
+    _interaction_changed(kind, row.user_id, row.movie_id, 1)
+
+
+def interaction_removed(kind, user_id, movie_id, cascade=False):
+    """Side effects of a deleted like/watched/watchlist row.
+
+    `cascade` also drops the row's feed entries, which a model delete has
+    already done through the foreign key but a raw DELETE has not.
+    """
+    if cascade and kind in FEED_KINDS:
+        TimelineEntry.objects.filter(actor_id=user_id, movie_id=movie_id, kind=FEED_KINDS[kind]).delete()
+    _interaction_changed(kind, user_id, movie_id, -1)
+
+
+def _interaction_changed(kind, user_id, movie_id, delta):
+    model, counter = INTERACTIONS[kind]
+    adjust_counter(user_id, counter, delta)
+    invalidate(user_id, kind)
+    if model is Like:
+        # the like count is only on the movie page
+        bump_movie_page(movie_id)
+
+
+def _check_movies(movie_ids):
+    missing = movie_ids - set(Movie.objects.filter(id__in=movie_ids).values_list('id', flat=True))
+    if missing:
+        raise Movie.DoesNotExist(f"no movie with id {', '.join(map(str, sorted(missing)))}")
+
+
+def apply_toggles(user, toggles):
+    """Set (kind, movie_id, active) toggles in one transaction, returns (kind, movie_id, active, changed) tuples.
+
+    Each toggle is a single insert-or-ignore or delete statement. Those skip
+    the model signals, so the rows that actually changed go through
+    interaction_added/interaction_removed here.
+    Raises Movie.DoesNotExist if any movie id is unknown, including one
+    deleted while the batch ran.
+    """
+    now = timezone.now()
+    results = []
+    try:
+        with transaction.atomic():
+            _check_movies({movie_id for _, movie_id, _ in toggles})
+            for kind, movie_id, active in toggles:
+                model, _ = INTERACTIONS[kind]
+                if active:
+                    new_id = _insert(model, user.pk, movie_id, now)
+                    changed = new_id is not None
+                    if changed:
+                        row = model(id=new_id, user_id=user.pk, movie_id=movie_id)
+                        row.created_at = now
+                        interaction_added(kind, row)
+                else:
+                    changed = _delete(model, user.pk, movie_id)
+                    if changed:
+                        interaction_removed(kind, user.pk, movie_id, cascade=True)
+                results.append((kind, movie_id, active, changed))
+    except IntegrityError:
+        # a movie deleted between the check and the insert fails the foreign key
+        raise Movie.DoesNotExist('a movie in the batch no longer exists')
+    return results
@@ -0,0 +1,116 @@
+import math
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least, Log, Power
+
+from .models import Like, Review, TrendingScore, Watched
+
+TOP_KEY = 'trending:top'
+# weight of one event of each kind, see settings.TRENDING_WEIGHTS
+DEFAULT_WEIGHTS = {'review': 4.0, 'liked': 3.0, 'watched': 2.0, 'watchlist': 1.0}
+# timestamped event tables a full rebuild replays (watchlist rows carry no time)
+REBUILD_SOURCES = {'review': Review, 'liked': Like, 'watched': Watched}
+
+
+def half_life():
+    return getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 48) * 3600
+
+
+def weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'TRENDING_WEIGHTS', {})}
+
+
+def event_key(kind, when=None):
+    """rank_key of a single event: log2(weight) + its time in half-lives"""
+    return math.log2(weights()[kind]) + (time.time() if when is None else when) / half_life()
+
+
+def score_at(rank_key, when=None):
+    """The decayed score a rank_key stands for at `when` (default now)"""
+    return 2 ** (rank_key - (time.time() if when is None else when) / half_life())
+
+
+def _log_add(a, b):
+    # log2(2**a + 2**b) without overflowing
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def record_event(movie_id, kind, when=None):
+    """Add one event to a movie's decayed score in a single UPDATE (an INSERT for its first event)"""
+    key = Value(event_key(kind, when))
+    # same log-space sum as _log_add, done by the database so concurrent events can't overwrite each other
+    high, low = Greatest(F('rank_key'), key), Least(F('rank_key'), key)
+    new_key = high + Log(Value(2.0), Value(1.0) + Power(Value(2.0), low - high))
+    if TrendingScore.objects.filter(movie_id=movie_id).update(rank_key=new_key):
+        return
+    try:
+        with transaction.atomic():
+            TrendingScore.objects.create(movie_id=movie_id, rank_key=key.value)
+    except IntegrityError:
+        # created by a concurrent event in the meantime
+        TrendingScore.objects.filter(movie_id=movie_id).update(rank_key=new_key)
+
+
+def refresh_top():
+    """Rebuild the cached ranked list from the score table; an index walk on rank_key, no event tables involved"""
+    size = getattr(settings, 'TRENDING_LIST_SIZE', 100)
+    now = time.time()
+    rows = (TrendingScore.objects.select_related('movie')
+            .only('rank_key', 'movie__movie_name', 'movie__poster_url', 'movie__genre')
+            .order_by('-rank_key')[:size])
+    top = [
+        {'id': row.movie_id, 'movie_name': row.movie.movie_name, 'poster_url': row.movie.poster_url,
+         'genre': row.movie.genre, 'score': round(score_at(row.rank_key, now), 3)}
+        for row in rows
+    ]
+    cache.set(TOP_KEY, top, getattr(settings, 'TRENDING_LIST_TTL', 300))
+    return top
+
+
+def top_movies(limit=10):
+    """The `limit` highest scoring movies as dicts (id, movie_name, poster_url, genre, score)"""
+    top = cache.get(TOP_KEY)
+    if top is None:
+        top = refresh_top()
+    return top[:limit]
+
+
+def compact(min_score=0.01, rebuild=False):
+    """Drop movies whose score decayed below `min_score` and refresh the ranked list.
+
+    With `rebuild`, scores are first recomputed from the review/like/watched
+    tables, e.g. after a bulk import that skipped the signals. Returns
+    (rows kept, rows removed).
+    """
+    now = time.time()
+    floor = math.log2(min_score) + now / half_life()
+    with transaction.atomic():
+        if rebuild:
+            keys = defaultdict(lambda: -math.inf)
+            # older events can't lift a movie over the floor on their own
+            horizon = now - half_life() * (math.log2(max(weights().values())) - math.log2(min_score))
+            since = datetime.fromtimestamp(horizon, tz=timezone.utc)
+            for kind, model in REBUILD_SOURCES.items():
+                events = model.objects.filter(created_at__gte=since).values_list('movie_id', 'created_at')
+                for movie_id, created_at in events.iterator(chunk_size=5000):
+                    keys[movie_id] = _log_add(keys[movie_id], event_key(kind, created_at.timestamp()))
+            before = TrendingScore.objects.count()
+            TrendingScore.objects.all().delete()
+            TrendingScore.objects.bulk_create(
+                [TrendingScore(movie_id=movie_id, rank_key=key) for movie_id, key in keys.items() if key >= floor],
+                batch_size=1000,
+            )
+            kept = TrendingScore.objects.count()
+            removed = max(before - kept, 0)
+        else:
+            removed, _ = TrendingScore.objects.filter(rank_key__lt=floor).delete()
+            kept = TrendingScore.objects.count()
+    refresh_top()
+    return kept, removed
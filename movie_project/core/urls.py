@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# ASYNC_VIEWS routes the read-heavy pages to their async variants (serve with ASGI, see movie_project/asgi.py)
+list_movies = views.alist_movies if settings.ASYNC_VIEWS else views.list_movies
+list_one_movie = views.alist_one_movie if settings.ASYNC_VIEWS else views.list_one_movie
+view_profile = views.aview_profile if settings.ASYNC_VIEWS else views.view_profile
+feed = views.afeed if settings.ASYNC_VIEWS else views.feed
+
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -9,13 +16,16 @@ urlpatterns = [
     path('profile/edit/', views.edit_profile, name='edit_profile'),
     path('profile/watchlist/add/<int:movie_id>/', views.add_to_watchlist, name='add_to_watchlist'),
     path('profile/watchlist/remove/<int:movie_id>/', views.remove_from_watchlist, name='remove_from_watchlist'),
-    path('profile/<str:username>/', views.view_profile, name='view_profile'),
+    path('profile/<str:username>/', view_profile, name='view_profile'),
+    path('profile/<str:username>/movies/<str:list_name>/', views.profile_movies, name='profile_movies'),
     path('profile/<str:username>/<str:action>/', views.list_follow, name='show_follow'),
-    path('movies/', views.list_movies, name='get_all_movies'),
+    path('movies/', list_movies, name='get_all_movies'),
     path('movies/add/', views.add_movie, name='add_movie'),
     path('movies/search/', views.search_movies, name='search_movies'),
+    path('movies/trending/', views.trending_movies, name='trending'),
+    path('recommendations/', views.recommendations, name='recommendations'),
     path('liked_by/<int:movie_id>',views.liked_by_following,name='liked_by_following'),
-    path('movies/<int:movie_id>/',views.list_one_movie,name='list_one_movie'),
+    path('movies/<int:movie_id>/',list_one_movie,name='list_one_movie'),
     path('movies/<int:movie_id>/review/', views.write_review, name='add_review'),
     path('review/delete/<int:review_id>/', views.delete_review, name='delete_review'),
     path('review/edit/<int:review_id>/',views.edit_review,name = 'edit_review'),
@@ -25,5 +35,7 @@ urlpatterns = [
     path('unlike/<int:movie_id>/',views.unlike_movie,name='unlike'),
     path('watched/<int:movie_id>/',views.watched_movie,name='watched'),
     path('unwatch/<int:movie_id>/',views.unwatch_movie,name='unwatched'),
-    path('feed/', views.feed, name='feed'),
+    path('interactions/toggle/', views.toggle_interactions, name='toggle_interactions'),
+    path('feed/', feed, name='feed'),
+    path('stats/fragments/', views.fragment_cache_stats, name='fragment_cache_stats'),
 ]
\ No newline at end of file
@@ -1,58 +1,122 @@
 from django.shortcuts import render,redirect,get_object_or_404
+from django.http import Http404, JsonResponse
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
 from django.core.paginator import Paginator
-from django.db.models import Avg,Count
 from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
 from .models import *
 from .forms import *
+from .stats import with_stats
+from .ingest import IngestWriter
+from .pagination import keyset_paginate
+from .profiles import PROFILE_LISTS, profile_list, profile_lists
+from .interactions import interaction_sets
+from .toggles import apply_toggles, parse_toggles
+from .recommendations import recommend
+from .social import attach_followed_likes
+from .graph import follow_graph
+from .async_queries import gather_queries
+from .pagecache import (
+    cache_anonymous_page, conditional_page, movie_page_etag, movie_page_version, profile_page_etag,
+)
+from . import fragments, search, timeline, trending
 from django.conf import settings
+from django.core.cache import cache
+import json
+import secrets
+from asgiref.sync import sync_to_async
+
+# catalog pages are keyset-paginated newest first, see core.pagination
+CATALOG_ORDERING = ['-release_date', '-id']
+CATALOG_PAGE_SIZE = 104
+# how long the "about N movies" figure on the catalog may be stale, in seconds
+CATALOG_TOTAL_TTL = 600
+# rows shown per list on a profile page, the rest is behind "see all" (profile_movies)
+PROFILE_LIST_SIZE = 12
+# movies on the home page trending shelf and on the trending page
+HOME_TRENDING_SIZE = 8
+TRENDING_PAGE_SIZE = 48
+RECOMMENDATIONS_SIZE = 48
+# "people you may know" on the own profile page
+FOLLOW_SUGGESTIONS = 6
 
 # Create your views here.
 def home(request):
     all_movies = Movie.objects.all()
     person = Person.objects.all()
     context = {'movie':all_movies,
-            'person':person}
+            'person':person,
+            'trending': trending.top_movies(HOME_TRENDING_SIZE)}
     return render(request,'core/home.html',context=context)
 
 
 
+@conditional_page(profile_page_etag)
 def view_profile(request,username:str):
     User = get_user_model()
-    curr_user = get_object_or_404(User,username=username)
+    curr_user = get_object_or_404(User.objects.select_related('profile'),username=username)
     if username == request.user.username:
         return redirect('profile')
     
     username = curr_user.username
-    followers = curr_user.followers.all()
-    following = curr_user.following.all()
-    avatar = curr_user.profile.avatar_url if hasattr(curr_user, 'profile') else None
-    bio = curr_user.profile.bio if hasattr(curr_user, 'profile') else "bio"
-    watch_list = WatchList.objects.filter(user=curr_user)
-    watched = Watched.objects.filter(user=curr_user)
-    liked = Like.objects.filter(user=curr_user)
-    reviews = curr_user.reviews.all()
+    profile = curr_user.profile if hasattr(curr_user, 'profile') else None
+    avatar = profile.avatar_url if profile else None
+    bio = profile.bio if profile else "bio"
+    lists = profile_lists(curr_user, PROFILE_LIST_SIZE)
     is_following = Follower.objects.filter(
         follower = request.user,
         following = curr_user
     ).exists()
+    follows_you = request.user.is_authenticated and follow_graph().follows(curr_user.id, request.user.id)
     context = {
         'username': username,
-        'followers': followers,
-        'following': following,
+        'profile': profile,
         'avatar': avatar,
         'bio': bio,
-        'watch_list': watch_list,
-        'reviews': reviews,
+        'watch_list': lists['watchlist'],
+        'reviews': lists['reviews'],
         'is_following':is_following,
-        'liked':liked,
-        'watched':watched
+        'follows_you': follows_you,
+        'liked':lists['liked'],
+        'watched':lists['watched']
     }
     return render(request,'core/view_profile.html',context=context)
 
 
+@conditional_page(profile_page_etag)
+async def aview_profile(request,username:str):
+    """view_profile for ASGI: the four movie lists and the follow check run concurrently"""
+    User = get_user_model()
+    viewer = await request.auser()
+    curr_user = await sync_to_async(get_object_or_404)(User.objects.select_related('profile'),username=username)
+    if username == viewer.username:
+        return redirect('profile')
+
+    profile = curr_user.profile if hasattr(curr_user, 'profile') else None
+    loaders = [lambda name=name: profile_list(curr_user, name, PROFILE_LIST_SIZE) for name in PROFILE_LISTS]
+    *lists, is_following, follows_you = await gather_queries(
+        *loaders,
+        lambda: Follower.objects.filter(follower=viewer, following=curr_user).exists(),
+        lambda: viewer.is_authenticated and follow_graph().follows(curr_user.id, viewer.id),
+    )
+    lists = dict(zip(PROFILE_LISTS, lists))
+    context = {
+        'username': curr_user.username,
+        'profile': profile,
+        'avatar': profile.avatar_url if profile else None,
+        'bio': profile.bio if profile else "bio",
+        'watch_list': lists['watchlist'],
+        'reviews': lists['reviews'],
+        'is_following':is_following,
+        'follows_you': follows_you,
+        'liked':lists['liked'],
+        'watched':lists['watched']
+    }
+    return await sync_to_async(render)(request,'core/view_profile.html',context=context)
+
+
 
 @login_required
 def secret(request):
@@ -64,30 +128,48 @@ def secret(request):
 def profile(request):
     curr_user = request.user
     username = curr_user.username
-    followers = curr_user.followers.all()
-    following = curr_user.following.all()
-    avatar = curr_user.profile.avatar_url if hasattr(curr_user, 'profile') else None
-    bio = curr_user.profile.bio if hasattr(curr_user, 'profile') else "bio"
-    watch_list = WatchList.objects.filter(user=curr_user)
-    watched = Watched.objects.filter(user=curr_user)
-    liked = Like.objects.filter(user=curr_user)
-    reviews = curr_user.reviews.all()
+    profile = curr_user.profile if hasattr(curr_user, 'profile') else None
+    avatar = profile.avatar_url if profile else None
+    bio = profile.bio if profile else "bio"
+    lists = profile_lists(curr_user, PROFILE_LIST_SIZE)
+    # friends of friends from the in-memory follow graph, one query for their names
+    suggested = follow_graph().suggestions(curr_user.id, FOLLOW_SUGGESTIONS)
+    suggested_users = get_user_model().objects.in_bulk([user_id for user_id, _ in suggested])
     
     context = {
         'username': username,
-        'followers': followers,
-        'following': following,
+        'profile': profile,
         'avatar': avatar,
         'bio': bio,
-        'watch_list': watch_list,
-        'watched': watched,
-        'liked': liked,
-        'reviews': reviews
+        'watch_list': lists['watchlist'],
+        'watched': lists['watched'],
+        'liked': lists['liked'],
+        'reviews': lists['reviews'],
+        'suggestions': [(suggested_users[user_id], mutual) for user_id, mutual in suggested if user_id in suggested_users],
     }
     return render(request, 'core/profile.html', context=context)
 
 
 
+def profile_movies(request, username: str, list_name: str):
+    """Full, keyset-paginated version of one of the capped lists on a profile"""
+    User = get_user_model()
+    selected_user = get_object_or_404(User, username=username)
+    if list_name not in PROFILE_LISTS:
+        raise Http404
+    model, _ = PROFILE_LISTS[list_name]
+    rows = model.objects.filter(user=selected_user).select_related('movie')
+    page_obj = keyset_paginate(rows, ['-id'], cursor=request.GET.get('cursor'), per_page=48)
+    context = {
+        'username': username,
+        'list_name': list_name,
+        'page_obj': page_obj,
+        'items': page_obj.object_list,
+    }
+    return render(request, 'core/profile_movies.html', context=context)
+
+
+
 @login_required
 def edit_profile(request):
     curr_user = request.user
@@ -104,6 +186,12 @@ def edit_profile(request):
     return render(request,'core/edit_profile.html',context=context)
 
 
+@staff_member_required
+def fragment_cache_stats(request):
+    """Fragment cache hit/miss counters of the process serving the request"""
+    return JsonResponse(fragments.fragment_stats())
+
+
 def is_admin(user):
     return user.is_staff
 
@@ -130,20 +218,14 @@ def add_movie(request):
                 cast_names = [name.strip() for name in cast_input.split(',')]
                 role_types = [role.strip() for role in role_input.split(',')] if role_input else []
                 
-                for index, cast_name in enumerate(cast_names):
-                    if cast_name:
-                        #default to actor as role if role not provided.
-                        role_type = role_types[index] if index < len(role_types) else 'Actor'
-                        
-                        person, created = Person.objects.get_or_create(
-                            person_name=cast_name
-                        )
-                        
-                        MovieCast.objects.create(
-                            movie=movie,
-                            person=person,
-                            role_type=role_type
-                        )
+                #default to actor as role if role not provided.
+                cast = [
+                    (cast_name, role_types[index] if index < len(role_types) else 'Actor')
+                    for index, cast_name in enumerate(cast_names) if cast_name
+                ]
+                # one bulk insert for people and cast rows, see core.ingest
+                with IngestWriter() as writer:
+                    writer.add(movie, cast)
             
             return redirect('get_all_movies')
     else:
@@ -190,10 +272,10 @@ def list_follow(request, username: str, action: str):
     
     if action == 'followers':
         # get followers
-        follow_data = [f.follower for f in selected_user.followers.all()]
+        follow_data = [f.follower for f in selected_user.followers.select_related('follower__profile')]
     elif action == 'following':
         # get following
-        follow_data = [f.following for f in selected_user.following.all()]
+        follow_data = [f.following for f in selected_user.following.select_related('following__profile')]
     else:
         follow_data = []
     
@@ -205,108 +287,240 @@ def list_follow(request, username: str, action: str):
     return render(request, 'core/show_follow.html', context=context)
 
 
+def catalog_movies():
+    return Movie.objects.filter(poster_url__isnull=False).exclude(poster_url='')
+
+
+def catalog_page_version(request, **kwargs):
+    """Version of the requested catalog page, moved only by changes to the movies on it"""
+    cursor = request.GET.get('cursor')
+    def page_ids():
+        page = keyset_paginate(catalog_movies().only('id', 'release_date'), CATALOG_ORDERING, cursor=cursor, per_page=CATALOG_PAGE_SIZE)
+        return [movie.id for movie in page]
+    return fragments.listing_version('catalog', cursor or '', page_ids)
+
+
+def catalog_page_etag(request, user, **kwargs):
+    # follows bump the viewer's profile; likes don't bump the catalog, but logged-in
+    # pages show which followed users liked each movie
+    return [catalog_page_version(request)] + ([fragments.likes_version()] if user.is_authenticated else [])
+
+
+@conditional_page(catalog_page_etag)
+@cache_anonymous_page(catalog_page_version)
 def list_movies(request):
-    watchlist = []
-    liked_movies = []
-    watched_movies = []
-    if request.user.is_authenticated:
-        user = request.user
-        watchlist = WatchList.objects.filter(user=user).values_list('movie_id', flat=True)
-        liked_movies = Like.objects.filter(user=user).values_list('movie_id', flat=True)
-        watched_movies = Watched.objects.filter(user=user).values_list('movie_id', flat=True)
-    
-    data = Movie.objects.filter(poster_url__isnull=False).exclude(poster_url='').annotate(
-        avg_rating=Avg('reviews__rating'),
-        review_count=Count('reviews')).all().order_by('-release_date')
-    paginator = Paginator(data,104)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    data = with_stats(catalog_movies())
+    # keyset pagination on (release_date, id): no COUNT(*) and no deep OFFSETs
+    approx_total = cache.get_or_set('catalog:approx_total', data.count, CATALOG_TOTAL_TTL)
+    page_obj = keyset_paginate(data, CATALOG_ORDERING, cursor=request.GET.get('cursor'), per_page=CATALOG_PAGE_SIZE, approx_total=approx_total)
+    # cached sets, so `movie.id in watchlist` is a hash lookup per card
+    interactions = interaction_sets(request.user, [movie.id for movie in page_obj.object_list])
+    attach_followed_likes(request.user, page_obj.object_list)
+    fragments.attach_versions(page_obj.object_list)
     context = {
         'page_obj':page_obj,
         'movies':page_obj.object_list,
-        'watchlist':watchlist,
-        'liked_movies': liked_movies,
-        'watched_movies': watched_movies,
+        'watchlist':interactions['watchlist'],
+        'liked_movies': interactions['liked'],
+        'watched_movies': interactions['watched'],
     }
     return render(request,'core/show_all_movies.html',context=context)
 
 
+def trending_movies(request):
+    """Most active movies lately, in the order of the precomputed core.trending list"""
+    ranked = [entry['id'] for entry in trending.top_movies(TRENDING_PAGE_SIZE)]
+    found = with_stats(Movie.objects.filter(id__in=ranked)).in_bulk()
+    movies = [found[movie_id] for movie_id in ranked if movie_id in found]
+    interactions = interaction_sets(request.user, [movie.id for movie in movies])
+    context = {
+        'movies': movies,
+        'watchlist': interactions['watchlist'],
+        'liked_movies': interactions['liked'],
+    }
+    return render(request,'core/trending.html',context=context)
+
+
+@login_required
+def recommendations(request):
+    """Movies similar to what the user liked, watched or saved, from the precomputed neighbor lists"""
+    ranked = recommend(request.user, RECOMMENDATIONS_SIZE)
+    found = with_stats(Movie.objects.filter(id__in=ranked)).in_bulk()
+    context = {
+        'movies': [found[movie_id] for movie_id in ranked if movie_id in found],
+        # recommendations never include movies from these sets
+        'watchlist': frozenset(),
+        'liked_movies': frozenset(),
+    }
+    return render(request,'core/recommendations.html',context=context)
+
+
+@conditional_page(catalog_page_etag)
+@cache_anonymous_page(catalog_page_version)
+async def alist_movies(request):
+    """list_movies for ASGI: the page query runs alongside the catalog count, then the per-user lookups alongside each other"""
+    user = await request.auser()
+    data = with_stats(catalog_movies())
+    page_obj, approx_total = await gather_queries(
+        lambda: keyset_paginate(data, CATALOG_ORDERING, cursor=request.GET.get('cursor'), per_page=CATALOG_PAGE_SIZE),
+        lambda: cache.get_or_set('catalog:approx_total', data.count, CATALOG_TOTAL_TTL),
+    )
+    page_obj.approx_total = approx_total
+    movie_ids = [movie.id for movie in page_obj.object_list]
+    interactions, _, _ = await gather_queries(
+        lambda: interaction_sets(user, movie_ids),
+        lambda: attach_followed_likes(user, page_obj.object_list),
+        lambda: fragments.attach_versions(page_obj.object_list),
+    )
+    context = {
+        'page_obj':page_obj,
+        'movies':page_obj.object_list,
+        'watchlist':interactions['watchlist'],
+        'liked_movies': interactions['liked'],
+        'watched_movies': interactions['watched'],
+    }
+    return await sync_to_async(render)(request,'core/show_all_movies.html',context=context)
+
 
+
+@conditional_page(movie_page_etag)
+@cache_anonymous_page(movie_page_version)
 def list_one_movie(request, movie_id: int):
-    movie = Movie.objects.annotate(
-        avg_rating=Avg('reviews__rating'),
-        total_reviews=Count('reviews')
-    ).get(id=movie_id)
-    reviews = Review.objects.filter(movie=movie).order_by('-created_at')
+    movie = get_object_or_404(with_stats(Movie.objects.all()), id=movie_id)
+    fragments.attach_versions([movie])
+    # only evaluated when the cached review list fragment misses
+    reviews = Review.objects.filter(movie=movie).select_related('user').order_by('-created_at')
     # paginate reviews
     paginator = Paginator(reviews, 10)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
-    watchlist = []
-    liked = False
-    watched = False
-    if request.user.is_authenticated:
-        watchlist = WatchList.objects.filter(user=request.user).values_list('movie_id', flat=True)
-        liked = Like.objects.filter(user=request.user, movie=movie).exists()
-        watched = Watched.objects.filter(user=request.user, movie=movie).exists()
+    interactions = interaction_sets(request.user, [movie.id])
     
     context = {
         'movie': movie,
         'page_obj': page_obj,
         'reviews': page_obj.object_list,
-        'watchlist': watchlist,
-        'liked': liked,
-        'watched': watched,
+        'watchlist': interactions['watchlist'],
+        'liked': movie.id in interactions['liked'],
+        'watched': movie.id in interactions['watched'],
     }
     return render(request, 'core/movie.html', context=context)
 
+
+@conditional_page(movie_page_etag)
+@cache_anonymous_page(movie_page_version)
+async def alist_one_movie(request, movie_id: int):
+    """list_one_movie for ASGI: movie, review page, interaction sets and fragment version load concurrently"""
+    user = await request.auser()
+    reviews = Review.objects.filter(movie_id=movie_id).select_related('user').order_by('-created_at')
+    movie, page_obj, interactions, versions = await gather_queries(
+        lambda: get_object_or_404(with_stats(Movie.objects.all()), id=movie_id),
+        lambda: Paginator(reviews, 10).get_page(request.GET.get('page')),
+        lambda: interaction_sets(user, [movie_id]),
+        lambda: fragments.movie_versions([movie_id]),
+    )
+    movie.fragment_version = versions[movie_id]
+    context = {
+        'movie': movie,
+        'page_obj': page_obj,
+        'reviews': page_obj.object_list,
+        'watchlist': interactions['watchlist'],
+        'liked': movie.id in interactions['liked'],
+        'watched': movie.id in interactions['watched'],
+    }
+    return await sync_to_async(render)(request, 'core/movie.html', context=context)
+
 @login_required
 def add_to_watchlist(request, movie_id: int):
-    curr_user = request.user
-    movie = get_object_or_404(Movie, id=movie_id)
-    
-    if not WatchList.objects.filter(user=curr_user, movie=movie).exists():
-        WatchList.objects.create(user=curr_user, movie=movie)
-    
+    _toggle_or_404(request.user, 'watchlist', movie_id, True)
     return redirect(request.META.get('HTTP_REFERER', 'get_all_movies'))
 
 @login_required
 def remove_from_watchlist(request, movie_id: int):
-    curr_user = request.user
-    movie = get_object_or_404(Movie, id=movie_id)
-    WatchList.objects.filter(user=curr_user, movie_id=movie.id).delete()
+    _toggle_or_404(request.user, 'watchlist', movie_id, False)
     return redirect(request.META.get('HTTP_REFERER', 'get_all_movies'))
 
 
+def _toggle_or_404(user, kind, movie_id, active):
+    try:
+        apply_toggles(user, [(kind, movie_id, active)])
+    except Movie.DoesNotExist:
+        raise Http404('No Movie matches the given query.')
+
+
+@login_required
+@require_POST
+def toggle_interactions(request):
+    """Apply a JSON batch of like/watchlist/watched toggles and answer with the new state instead of redirecting"""
+    try:
+        toggles = parse_toggles(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    try:
+        results = apply_toggles(request.user, toggles)
+    except Movie.DoesNotExist as e:
+        return JsonResponse({'error': str(e)}, status=404)
+    return JsonResponse({'results': [
+        {'kind': kind, 'movie_id': movie_id, 'active': active, 'changed': changed}
+        for kind, movie_id, active, changed in results
+    ]})
+
+
 
 @login_required
 def feed(request):
     curr_user = request.user
-    
-    # get all users that current user is following
-    following_users = Follower.objects.filter(
-        follower=curr_user
-    ).values_list('following', flat=True)
-    
-    # get reviews from people user is following in random order
-    reviews = Review.objects.filter(
-        user__in=following_users
-    ).order_by('?')
-    
-    likes = Like.objects.filter(user__in=following_users).order_by('?')
+    mode = request.GET.get('mode', 'latest')
+
+    if mode == 'shuffle':
+        # per-session seed keeps the shuffled order stable while paging
+        seed = request.session.get('feed_shuffle_seed')
+        if seed is None or 'reshuffle' in request.GET:
+            seed = secrets.randbelow(2**31)
+            request.session['feed_shuffle_seed'] = seed
+        cursor = None if 'reshuffle' in request.GET else request.GET.get('cursor')
+        entries, next_cursor = timeline.shuffled_page(curr_user, seed, cursor=cursor, per_page=30)
+        context = {
+            'mode': mode,
+            'entries': entries,
+            'next_cursor': next_cursor,
+            'is_first_page': not cursor,
+        }
+        return render(request, 'core/feed.html', context=context)
+
+    cursor = request.GET.get('cursor')
+    # newest-first read of the materialized timeline, trimmed on write, see core.timeline
+    entries, next_cursor = timeline.timeline_page(curr_user, cursor=cursor, per_page=30)
 
-    paginator = Paginator(reviews, 30)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
     context = {
-        'page_obj': page_obj,
-        'reviews': page_obj.object_list
+        'mode': 'latest',
+        'entries': entries,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
     }
     return render(request, 'core/feed.html', context=context)
 
 
+@login_required
+async def afeed(request):
+    """feed for ASGI, the timeline read runs off the event loop"""
+    if request.GET.get('mode') == 'shuffle':
+        # the shuffle seed lives in the session
+        return await sync_to_async(feed)(request)
+    user = request.user = await request.auser()
+    cursor = request.GET.get('cursor')
+    entries, next_cursor = await sync_to_async(timeline.timeline_page)(user, cursor=cursor, per_page=30)
+
+    context = {
+        'mode': 'latest',
+        'entries': entries,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
+    }
+    return await sync_to_async(render)(request, 'core/feed.html', context=context)
+
+
 
 @login_required
 def write_review(request, movie_id: int):
@@ -363,28 +577,23 @@ def edit_review(request, review_id: int):
 @login_required
 def search_movies(request):
     query = request.GET.get('q', '')
-    watchlist = []
-    liked_movies = []
-    if request.user.is_authenticated:
-        watchlist = WatchList.objects.filter(user=request.user).values_list('movie_id', flat=True)
-        liked_movies = Like.objects.filter(user=request.user).values_list('movie_id', flat=True)
-    if query:
-        movies_list = Movie.objects.filter(movie_name__icontains=query).annotate(
-            avg_rating=Avg('reviews__rating'),
-            review_count=Count('reviews')
-        ).all()
-    else:
-        movies_list = []
-    
-    paginator = Paginator(movies_list, 100)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    cursor = request.GET.get('cursor')
+    # bm25-ranked FTS5 search, falls back to icontains where FTS5 isn't available or matches nothing
+    page_obj = search.ranked_page(query, cursor=cursor, per_page=100) if query else None
+    if page_obj is None:
+        if query:
+            movies_list = with_stats(Movie.objects.filter(movie_name__icontains=query))
+        else:
+            movies_list = Movie.objects.none()
+        page_obj = keyset_paginate(movies_list, CATALOG_ORDERING, cursor=cursor, per_page=100)
+    interactions = interaction_sets(request.user, [movie.id for movie in page_obj.object_list])
+    attach_followed_likes(request.user, page_obj.object_list)
     
     context = {
         'page_obj': page_obj,
         'movies': page_obj.object_list,
-        'watchlist': watchlist,
-        'liked_movies': liked_movies,
+        'watchlist': interactions['watchlist'],
+        'liked_movies': interactions['liked'],
         'search_query': query
     }
     return render(request, 'core/search_results.html', context=context)
@@ -392,39 +601,25 @@ def search_movies(request):
 
 @login_required
 def like_movie(request,movie_id:int):
-    curr_user = request.user
-    movie = get_object_or_404(Movie,id=movie_id)
-    if not Like.objects.filter(user=curr_user,movie=movie).exists():
-        Like.objects.create(user=curr_user,movie=movie)
-
+    _toggle_or_404(request.user, 'liked', movie_id, True)
     return redirect(request.META.get('HTTP_REFERER'))
 
 @login_required
 def unlike_movie(request,movie_id:int):
-    curr_user = request.user
-    movie = get_object_or_404(Movie,id=movie_id)
-    if Like.objects.filter(user=curr_user,movie=movie).exists():
-        Like.objects.filter(user=curr_user,movie=movie).delete()
+    _toggle_or_404(request.user, 'liked', movie_id, False)
     return redirect(request.META.get('HTTP_REFERER'))
 
 
 
 @login_required
 def watched_movie(request,movie_id:int):
-    curr_user = request.user
-    movie = get_object_or_404(Movie,id=movie_id)
-    if not Watched.objects.filter(user=curr_user,movie=movie).exists():
-        Watched.objects.create(user=curr_user,movie=movie)
-    
+    _toggle_or_404(request.user, 'watched', movie_id, True)
     return redirect(request.META.get('HTTP_REFERER'))
 
 
 @login_required
 def unwatch_movie(request,movie_id:int):
-    curr_user = request.user
-    movie = get_object_or_404(Movie,id=movie_id)
-    if Watched.objects.filter(user=curr_user,movie=movie).exists():
-        Watched.objects.filter(user=curr_user,movie=movie).delete()
+    _toggle_or_404(request.user, 'watched', movie_id, False)
     return redirect(request.META.get('HTTP_REFERER'))
 
 
@@ -433,9 +628,9 @@ def unwatch_movie(request,movie_id:int):
 @login_required
 def liked_by_following(request,movie_id:int):
     curr_user = request.user
-    movie = get_object_or_404(Movie, id=movie_id)
-    liked_user_ids = Like.objects.filter(movie=movie).values_list('user_id', flat=True)
-    following_users = curr_user.following.filter(following_id__in=liked_user_ids).values_list('following_id', flat=True)
-    users = get_user_model().objects.filter(id__in=following_users)
+    movie = get_object_or_404(Movie.objects.only('id'), id=movie_id)
+    # one join from the user's follow rows to their (user, movie) like rows, however many likes the movie has
+    users = get_user_model().objects.filter(followers__follower=curr_user, likes__movie=movie).select_related('profile')
+    users = sorted(users, key=lambda user: user.username)
     context = {'liked_by':users}
     return render(request,'core/movie_liked_by_following.html',context=context)
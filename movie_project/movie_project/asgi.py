@@ -3,6 +3,18 @@ ASGI config for movie_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+ASGI deployment: set ASYNC_VIEWS=True so the catalog, movie, profile and
+feed pages use their async variants (core.views.a*), then serve this module
+with an ASGI server instead of wsgi.py, e.g.
+
+    ASYNC_VIEWS=True uvicorn movie_project.asgi:application --workers 4
+
+The async views fan their independent queries out to the event loop's
+default thread pool (core.async_queries), so each worker process can hold
+up to min(32, CPUs + 4) extra database connections.
+Compare against the WSGI path with
+`manage.py benchmark_views --load --handler asgi|wsgi`.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -51,6 +51,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # no-op unless QUERY_INSTRUMENTATION is on
+    'core.instrumentation.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -93,6 +95,60 @@ DATABASES = {
     }
 }
 
+# DB_PROFILE=production: WAL + tuned pragmas (applied by core.db.apply_sqlite_pragmas),
+# persistent connections and IMMEDIATE transactions so writers queue on busy_timeout
+# instead of failing with "database is locked" on lock upgrade
+DB_PROFILE = os.getenv('DB_PROFILE', 'default')
+SQLITE_PRAGMAS = {}
+if DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 5},
+    })
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,  # KiB, i.e. 20MB of page cache per connection
+        'mmap_size': 268435456,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    }
+    # optional read-only connection for SELECTs, routed by core.db.PrimaryReplicaRouter
+    if os.getenv('SQLITE_READ_REPLICA', 'False').lower() in ('true', '1', 'yes'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'NAME': f"file:{DATABASES['default']['NAME']}?mode=ro",
+            'OPTIONS': {'timeout': 5},
+            'TEST': {'MIRROR': 'default'},
+        }
+        DATABASE_ROUTERS = ['core.db.PrimaryReplicaRouter']
+
+
+# Cache
+# page/fragment versions and ETags (core.fragments, core.pagecache), interaction sets, the trending
+# list and the follow graph generation are written by one process and read by all of them, so
+# anything with more than one worker, or running management commands against a live site, needs a
+# shared cache: REDIS_URL (needs the redis package), MEMCACHED_LOCATION (pymemcache) or the
+# database (`manage.py migrate` creates the table). `check --deploy` warns about a per-process cache.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'database' if DB_PROFILE == 'production' else 'locmem')
+if os.getenv('REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('REDIS_URL')}}
+elif os.getenv('MEMCACHED_LOCATION'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+                          'LOCATION': os.getenv('MEMCACHED_LOCATION')}}
+elif CACHE_BACKEND == 'database':
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        # the default of 300 would keep culling version stamps and interaction sets
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 200_000))},
+    }}
+else:
+    # one cache per process: tests and single-process development only
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+SHARED_CACHE = not CACHES['default']['BACKEND'].endswith('LocMemCache')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -161,4 +217,121 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False').lower() in ('true', '1', 'yes')
 
 ACCOUNT_EMAIL_VERIFICATION = os.getenv('ACCOUNT_EMAIL_VERIFICATION', 'optional')
-ACCOUNT_EMAIL_REQUIRED = True
\ No newline at end of file
+ACCOUNT_EMAIL_REQUIRED = True
+
+
+#feed timeline config
+# max rows kept per user in the materialized feed (core.timeline)
+TIMELINE_MAX_ENTRIES = int(os.getenv('TIMELINE_MAX_ENTRIES', 500))
+
+
+#query budgets
+# max SQL queries per request for each url name, checked by `manage.py benchmark_views`,
+# core.tests against the synthetic benchmark dataset (core.synthetic) and, when
+# QUERY_INSTRUMENTATION is on, core.instrumentation.QueryInstrumentationMiddleware;
+# they cover a cold request too, one that fills the cached counts and interaction sets
+VIEW_QUERY_BUDGETS = {
+    'home': 2,
+    'secret': 5,
+    'profile': 9,
+    'edit_profile': 5,
+    'view_profile': 10,
+    'profile_movies': 6,
+    'show_follow': 6,
+    'get_all_movies': 10,
+    'search_movies': 9,
+    'trending': 8,
+    'recommendations': 6,
+    'liked_by_following': 8,
+    'list_one_movie': 10,
+    'add_review': 6,
+    'edit_review': 6,
+    'feed': 8,
+}
+
+#query instrumentation
+# per-request SQL stats as Server-Timing headers and 'core.queries' log lines
+QUERY_INSTRUMENTATION = os.getenv('QUERY_INSTRUMENTATION', 'False').lower() in ('true', '1', 'yes')
+QUERY_INSTRUMENTATION_TOP_N = int(os.getenv('QUERY_INSTRUMENTATION_TOP_N', 5))
+# 'log' warns about requests over their VIEW_QUERY_BUDGETS entry, 'raise' fails them
+QUERY_BUDGET_ACTION = os.getenv('QUERY_BUDGET_ACTION', 'log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.queries': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+
+#interaction set cache
+# per-user watchlist/liked/watched movie id sets (core.interactions); a write only drops the set from
+# the cache its own process sees, so without a shared cache other workers keep theirs until it expires
+INTERACTION_CACHE_TTL = int(os.getenv('INTERACTION_CACHE_TTL', 3600 if SHARED_CACHE else 60))
+# users with longer lists only get the movies on the current page checked
+INTERACTION_SET_MAX = int(os.getenv('INTERACTION_SET_MAX', 5000))
+
+
+#fragment cache
+# lifetime of cached movie card / review list HTML (core.fragments); keys are
+# versioned per movie, so this only bounds memory and relative dates like "2 hours ago"
+FRAGMENT_CACHE_TTL = int(os.getenv('FRAGMENT_CACHE_TTL', 600))
+
+# anonymous /movies/ and /movies/<id>/ responses (core.pagecache), purged through the same versions
+ANONYMOUS_PAGE_CACHE_TTL = int(os.getenv('ANONYMOUS_PAGE_CACHE_TTL', 600))
+
+
+#async views
+# route catalog, movie, profile and feed pages to their async variants, which run
+# independent queries concurrently; only worth it under ASGI (movie_project/asgi.py)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() in ('true', '1', 'yes')
+# set to False to keep the async views but run their queries one after another
+ASYNC_CONCURRENT_QUERIES = os.getenv('ASYNC_CONCURRENT_QUERIES', 'True').lower() in ('true', '1', 'yes')
+
+
+#trending
+# core.trending: per-movie activity scores that halve every TRENDING_HALF_LIFE_HOURS;
+# run `manage.py compact_trending` periodically to prune dead scores
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 48))
+TRENDING_WEIGHTS = {'review': 4.0, 'liked': 3.0, 'watched': 2.0, 'watchlist': 1.0}
+# length of the precomputed ranked list and how long it is cached before being re-read
+TRENDING_LIST_SIZE = int(os.getenv('TRENDING_LIST_SIZE', 100))
+TRENDING_LIST_TTL = int(os.getenv('TRENDING_LIST_TTL', 300))
+
+
+#follow graph
+# seconds before a process refreshes its in-memory follow graph (core.graph) in the
+# background; its own follows apply immediately, `rebuild_follow_graph` refreshes all
+FOLLOW_GRAPH_TTL = int(os.getenv('FOLLOW_GRAPH_TTL', 900))
+
+
+#avatars
+# uploads are resized to 48/96/256px WebP and JPEG copies (core.avatars): 'sync' during the
+# upload request, 'thread' in a background thread after it, 'deferred' by `manage.py process_avatars`
+AVATAR_PROCESSING = os.getenv('AVATAR_PROCESSING', 'thread')
+
+
+#static bundles
+# `manage.py build_static` runs collectstatic into STATIC_ROOT with minified stylesheets,
+# content-hashed names and .gz/.br copies; serve STATIC_ROOT with far-future caching and
+# gzip_static/brotli_static. Every page links the shared base bundle, cached once for the
+# whole site, plus its own small stylesheet (see {% stylesheets %})
+STATIC_BUNDLES = {
+    'core/bundles/base.css': ['core/base.css'],
+}
+STATIC_BUNDLING = os.getenv('STATIC_BUNDLING', 'False').lower() in ('true', '1', 'yes')
+if STATIC_BUNDLING:
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'core.assets.BundlingStaticFilesStorage'},
+    }
+
+
+#conditional GET
+# movie, profile and catalog pages carry an ETag built from the version stamps in core.fragments
+# (core.pagecache.conditional_page); change this on deploys that change those templates
+PAGE_ETAG_VERSION = os.getenv('PAGE_ETAG_VERSION', '')
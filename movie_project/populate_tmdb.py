@@ -1,81 +1,103 @@
 import os
+import argparse
 import django
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import time
+from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
 # Setup Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movie_project.settings')
 django.setup()
 
-from core.models import Movie, Person, MovieCast
+from core.models import Movie
+from core.ingest import IngestWriter
+from core.tmdb import TMDBClient, TMDBError, ResponseCache, Checkpoint, TMDB_BASE_URL, IMAGE_BASE_URL
 
 # TMDB API Configuration
 TMDB_API_KEY = os.getenv('TMDB_API_KEY')  # Replace with your actual API key
-TMDB_BASE_URL = 'https://api.themoviedb.org/3'
-IMAGE_BASE_URL = 'https://image.tmdb.org/t/p/w500'
+# requests per second shared by all workers (TMDB allows ~50/s)
+TMDB_RATE_LIMIT = float(os.getenv('TMDB_RATE_LIMIT', 40))
+TMDB_WORKERS = int(os.getenv('TMDB_WORKERS', 8))
+# replayable response cache and resume checkpoint, both kept next to this script
+TMDB_CACHE_DIR = Path(__file__).resolve().parent / '.tmdb_cache'
+TMDB_CHECKPOINT = Path(__file__).resolve().parent / '.tmdb_checkpoint.json'
 
-def get_movies_by_endpoint(endpoint, num_pages=500):
-    """Fetch movies from different TMDB endpoints"""
+def get_list_page(client, endpoint, page, refresh=False, **params):
+    """Fetch one page of a TMDB list endpoint"""
+    try:
+        data = client.get(endpoint, refresh=refresh, page=page, **params)
+    except TMDBError as e:
+        print(f"  Error on {endpoint} page {page}: {e}")
+        return []
+    return data.get('results') or []
+
+def get_movies_by_endpoint(client, executor, endpoint, num_pages=500, refresh=False):
+    """Fetch movies from different TMDB endpoints, all pages in parallel"""
     movies = []
-    
-    for page in range(1, num_pages + 1):
-        url = f'{TMDB_BASE_URL}/{endpoint}'
-        params = {
-            'api_key': TMDB_API_KEY,
-            'page': page,
-            'language': 'en-US'
-        }
-        
-        try:
-            response = requests.get(url, params=params, timeout=10)
-            data = response.json()
-            
-            if not data.get('results'):
-                print(f"No more results for {endpoint} at page {page}")
-                break
-            
-            movies.extend(data['results'])
-            print(f"  Page {page}: {len(data['results'])} movies")
-            
-            # Rate limiting
-            time.sleep(0.25)
-        
-        except Exception as e:
-            print(f"  Error on page {page}: {e}")
-            time.sleep(1)
-    
+    pages = executor.map(lambda page: get_list_page(client, endpoint, page, refresh), range(1, num_pages + 1))
+    for results in pages:
+        movies.extend(results)
+    print(f"  {endpoint}: {len(movies)} movies from {num_pages} pages")
     return movies
 
-def get_movie_details(movie_id):
+def get_changed_movie_ids(client, executor, since):
+    """Ids of every movie TMDB reports as changed since `since` (at most 14 days back)"""
+    params = {'start_date': since.date().isoformat()}
+    try:
+        first = client.get('movie/changes', refresh=True, page=1, **params)
+    except TMDBError as e:
+        print(f"  Error fetching changes: {e}")
+        return set()
+    pages = [first.get('results') or []]
+    total_pages = min(first.get('total_pages') or 1, 500)
+    pages.extend(executor.map(
+        lambda page: get_list_page(client, 'movie/changes', page, True, **params), range(2, total_pages + 1)
+    ))
+    return {item['id'] for results in pages for item in results}
+
+def get_movie_details(client, movie_id, refresh=False):
     """Fetch detailed movie info including runtime and genres"""
-    url = f'{TMDB_BASE_URL}/movie/{movie_id}'
-    params = {
-        'api_key': TMDB_API_KEY,
-        'language': 'en-US'
-    }
     try:
-        response = requests.get(url, params=params, timeout=10)
-        time.sleep(0.1)
-        return response.json()
-    except Exception as e:
+        return client.get(f'movie/{movie_id}', refresh=refresh)
+    except TMDBError as e:
         return {}
 
-def get_movie_credits(movie_id):
+def get_movie_credits(client, movie_id, refresh=False):
     """Fetch cast, directors, and writers"""
-    url = f'{TMDB_BASE_URL}/movie/{movie_id}/credits'
-    params = {
-        'api_key': TMDB_API_KEY,
-        'language': 'en-US'
-    }
     try:
-        response = requests.get(url, params=params, timeout=10)
-        time.sleep(0.1)
-        return response.json()
-    except Exception as e:
+        return client.get(f'movie/{movie_id}/credits', refresh=refresh)
+    except TMDBError as e:
         return {}
 
+def fetch_movie(client, movie_id, refresh=False):
+    """Details and credits for one movie, run on a worker thread"""
+    return movie_id, get_movie_details(client, movie_id, refresh), get_movie_credits(client, movie_id, refresh)
+
+def parse_release_date(movie_data):
+    """Release date of a TMDB movie, None if missing or malformed"""
+    try:
+        return datetime.strptime(movie_data.get('release_date') or '', '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def adopt_legacy_movies(candidates):
+    """Attach TMDB ids to rows imported before tmdb_id existed, matched on title + release date"""
+    legacy = {
+        (name, release_date): movie_id
+        for movie_id, name, release_date in Movie.objects.filter(
+            tmdb_id__isnull=True,
+            movie_name__in=[movie_data['title'] for movie_data, _ in candidates.values()],
+        ).values_list('id', 'movie_name', 'release_date')
+    }
+    adopted = []
+    for tmdb_id, (movie_data, release_date_obj) in candidates.items():
+        movie_id = legacy.pop((movie_data['title'], release_date_obj), None)
+        if movie_id is not None:
+            adopted.append(Movie(id=movie_id, tmdb_id=tmdb_id))
+    Movie.objects.bulk_update(adopted, ['tmdb_id'], batch_size=500)
+    return len(adopted)
+
 def get_movie_crew(credits):
     """Extract top crew members (directors, writers, producers)"""
     crew = credits.get('crew', [])
@@ -95,8 +117,61 @@ def get_movie_crew(credits):
     
     return top_crew
 
-def populate_movies(num_movies=10000):
-    """Populate database with movies from TMDB"""
+def build_movie(movie_data, release_date_obj, details, credits):
+    """Unsaved Movie plus its (person_name, role_type) cast and crew list"""
+    # Extract data
+    genres = details.get('genres', [])
+    genre_name = genres[0]['name'] if genres else 'Unknown'
+    runtime = details.get('runtime') or 120
+    runtime = runtime if runtime > 0 else 120
+    
+    poster_url = f"{IMAGE_BASE_URL}{movie_data['poster_path']}" if movie_data.get('poster_path') else ''
+    
+    movie = Movie(
+        tmdb_id=movie_data['id'],
+        movie_name=movie_data['title'],
+        movie_description=movie_data.get('overview') or 'No description available',
+        release_date=release_date_obj,
+        genre=genre_name,
+        length=runtime,
+        poster_url=poster_url
+    )
+    
+    cast = []
+    # Add cast (top 10)
+    cast_list = credits.get('cast', [])[:10]
+    for cast_index, cast_member in enumerate(cast_list):
+        # Determine role type
+        if cast_index == 0:
+            role_type = 'Lead'
+        elif cast_index < 5:
+            role_type = 'Supporting'
+        else:
+            role_type = 'Actor'
+        cast.append((cast_member.get('name', ''), role_type))
+    
+    # Add crew (directors, writers, producers)
+    for crew_member in get_movie_crew(credits):
+        cast.append((crew_member.get('name', ''), crew_member.get('job', 'Crew')))
+    
+    return movie, cast
+
+def report_saved(saved_movies, writer, total):
+    """Progress lines for a flushed batch"""
+    first = writer.movies_written - len(saved_movies)
+    for index, movie in enumerate(saved_movies, start=first + 1):
+        print(f"[{index}/{total}] ✓ {movie.movie_name} ({movie.genre}) - {movie.length}m")
+
+def populate_movies(num_movies=10000, workers=TMDB_WORKERS, rate=TMDB_RATE_LIMIT, base_url=TMDB_BASE_URL,
+                    batch_size=200, cache_dir=TMDB_CACHE_DIR, checkpoint_path=TMDB_CHECKPOINT, incremental=False):
+    """Populate database with movies from TMDB.
+
+    Movies are upserted on their TMDB id, so reruns are idempotent. An
+    interrupted run resumes from the checkpoint file, and responses are
+    replayed from `cache_dir` instead of being downloaded again. With
+    `incremental`, only new movies and those TMDB reports as changed since
+    the last completed run are fetched.
+    """
     
     endpoints = [
         'movie/popular',
@@ -107,130 +182,117 @@ def populate_movies(num_movies=10000):
     
     all_movies = []
     movies_added = 0
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    client = TMDBClient(TMDB_API_KEY, base_url=base_url, rate=rate, workers=workers, cache=cache)
+    checkpoint = Checkpoint(checkpoint_path)
     
     print(f"\n{'='*70}")
-    print(f"TMDB Database Population - Fetching {num_movies} movies")
-    print(f"{'='*70}\n")
-    
-    # Fetch movies from all endpoints
-    movies_per_endpoint = int(num_movies / len(endpoints))
-    for endpoint in endpoints:
-        print(f"\n[Fetching] {endpoint} (~{movies_per_endpoint} movies)")
-        movies = get_movies_by_endpoint(endpoint, num_pages=int(movies_per_endpoint / 20))
-        all_movies.extend(movies)
-        print(f"  Total fetched: {len(all_movies)}")
-    
-    # Remove duplicates by movie ID
-    unique_movies = {}
-    for movie in all_movies:
-        if movie['id'] not in unique_movies:
-            unique_movies[movie['id']] = movie
-    
-    print(f"\n{'='*70}")
-    print(f"[Processing] {len(unique_movies)} unique movies")
+    print(f"TMDB Database Population - Fetching {num_movies} movies ({workers} workers, {rate} req/s)")
+    if checkpoint.resuming:
+        print(f"Resuming previous run: {len(checkpoint.written)} movies already written")
     print(f"{'='*70}\n")
     
-    # Process each movie
-    for movie_id, movie_data in unique_movies.items():
-        if movies_added >= num_movies:
-            break
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        changed_ids = set()
+        since = checkpoint.last_completed
+        if incremental and since is None:
+            print("No completed run recorded, doing a full import")
+            incremental = False
+        if incremental:
+            with client.stage('changes'):
+                changed_ids = get_changed_movie_ids(client, executor, since)
+            print(f"  {len(changed_ids)} movies changed since {since.date()}")
+        checkpoint.start()
         
-        try:
-            # Skip movies without release date or title
-            if not movie_data.get('title') or not movie_data.get('release_date'):
-                continue
-            
-            # Check if movie already exists
-            if Movie.objects.filter(movie_name=movie_data['title']).exists():
+        # Fetch movies from all endpoints (list pages are re-fetched in incremental mode)
+        movies_per_endpoint = int(num_movies / len(endpoints))
+        with client.stage('list pages'):
+            for endpoint in endpoints:
+                print(f"\n[Fetching] {endpoint} (~{movies_per_endpoint} movies)")
+                movies = get_movies_by_endpoint(client, executor, endpoint, num_pages=max(1, int(movies_per_endpoint / 20)), refresh=incremental)
+                all_movies.extend(movies)
+                print(f"  Total fetched: {len(all_movies)}")
+        
+        # Remove duplicates by TMDB id, skip movies without release date/title
+        candidates = {}
+        for movie_data in all_movies:
+            if movie_data['id'] in candidates or len(candidates) >= num_movies:
                 continue
-            
-            # Parse release date
-            try:
-                release_date_obj = datetime.strptime(movie_data['release_date'], '%Y-%m-%d').date()
-            except:
+            release_date_obj = parse_release_date(movie_data)
+            if not movie_data.get('title') or release_date_obj is None:
                 continue
-            
-            # Get detailed info
-            details = get_movie_details(movie_id)
-            
-            # Extract data
-            genres = details.get('genres', [])
-            genre_name = genres[0]['name'] if genres else 'Unknown'
-            runtime = details.get('runtime', 120)
-            runtime = runtime if runtime > 0 else 120
-            
-            poster_url = f"{IMAGE_BASE_URL}{movie_data['poster_path']}" if movie_data.get('poster_path') else ''
-            
-            # Create Movie
-            movie = Movie.objects.create(
-                movie_name=movie_data['title'],
-                movie_description=movie_data.get('overview', 'No description available'),
-                release_date=release_date_obj,
-                genre=genre_name,
-                length=runtime,
-                poster_url=poster_url
-            )
-            
-            movies_added += 1
-            print(f"[{movies_added}/{num_movies}] ✓ {movie.movie_name} ({genre_name}) - {runtime}m")
-            
-            # Get credits
-            credits = get_movie_credits(movie_id)
-            
-            # Add cast (top 10)
-            cast_list = credits.get('cast', [])[:10]
-            for cast_index, cast_member in enumerate(cast_list):
-                try:
-                    person, created = Person.objects.get_or_create(
-                        person_name=cast_member['name']
-                    )
-                    
-                    # Determine role type
-                    if cast_index == 0:
-                        role_type = 'Lead'
-                    elif cast_index < 5:
-                        role_type = 'Supporting'
-                    else:
-                        role_type = 'Actor'
-                    
-                    MovieCast.objects.create(
-                        movie=movie,
-                        person=person,
-                        role_type=role_type
-                    )
-                except Exception as e:
-                    pass
-            
-            # Add crew (directors, writers, producers)
-            crew_list = get_movie_crew(credits)
-            for crew_member in crew_list:
-                try:
-                    person, created = Person.objects.get_or_create(
-                        person_name=crew_member['name']
-                    )
-                    
-                    role_type = crew_member.get('job', 'Crew')
-                    
-                    MovieCast.objects.create(
-                        movie=movie,
-                        person=person,
-                        role_type=role_type
-                    )
-                except Exception as e:
-                    pass
+            candidates[movie_data['id']] = (movie_data, release_date_obj)
+        adopted = adopt_legacy_movies(candidates)
+        if adopted:
+            print(f"  Linked {adopted} previously imported movies to their TMDB ids")
+        
+        # already stored or written earlier in this run: skip unless TMDB says it changed
+        existing = set(Movie.objects.filter(tmdb_id__in=set(candidates) | changed_ids).values_list('tmdb_id', flat=True))
+        todo = {
+            tmdb_id for tmdb_id in candidates
+            if tmdb_id not in checkpoint.written and (tmdb_id not in existing or tmdb_id in changed_ids)
+        }
+        todo |= (changed_ids & existing) - checkpoint.written
+        
+        print(f"\n{'='*70}")
+        print(f"[Processing] {len(todo)} movies")
+        print(f"{'='*70}\n")
+        
+        # details + credits are fetched on the pool, rows are buffered and bulk written here
+        writer = IngestWriter(batch_size=batch_size, preload_people=True)
+        def write(saved):
+            if saved:
+                report_saved(saved, writer, len(todo))
+                checkpoint.mark_written(movie.tmdb_id for movie in saved)
         
-        except Exception as e:
-            print(f"  ✗ Error: {str(e)[:50]}")
-            continue
+        with client.stage('details + credits'):
+            futures = [executor.submit(fetch_movie, client, tmdb_id, tmdb_id in changed_ids) for tmdb_id in todo]
+            for future in as_completed(futures):
+                tmdb_id, details, credits = future.result()
+                list_data, release_date_obj = candidates.get(tmdb_id, ({}, None))
+                # details carry the same title/overview/poster fields as list results
+                movie_data = {**list_data, **{k: v for k, v in details.items() if v}, 'id': tmdb_id}
+                release_date_obj = parse_release_date(movie_data) or release_date_obj
+                if not movie_data.get('title') or release_date_obj is None:
+                    continue
+                movie, cast = build_movie(movie_data, release_date_obj, details, credits)
+                # no credits (fetch failed): keep the cast already stored
+                write(writer.add(movie, cast if credits else None))
+            write(writer.flush())
+        movies_added = writer.movies_written
+        checkpoint.finish()
     
     print(f"\n{'='*70}")
-    print(f"✓ Successfully added {movies_added} movies to database!")
+    print(f"✓ Successfully added or updated {movies_added} movies in the database!")
+    for stats in client.stages:
+        print(f"  {stats['stage']}: {stats['seconds']}s, {stats['requests']} requests, {stats['requests_per_second']} req/s")
+    if cache:
+        print(f"  response cache: {cache.hits} hits, {cache.misses} misses")
     print(f"{'='*70}\n")
+    return client.stages
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed the database with movies from TMDB')
+    parser.add_argument('--movies', type=int, default=10000, help='number of movies to add')
+    parser.add_argument('--workers', type=int, default=TMDB_WORKERS, help='concurrent HTTP workers')
+    parser.add_argument('--rate', type=float, default=TMDB_RATE_LIMIT, help='max requests per second across all workers')
+    parser.add_argument('--batch-size', type=int, default=200, help='movies per bulk write transaction')
+    parser.add_argument('--base-url', default=TMDB_BASE_URL, help='TMDB API root (point at a stub server for testing)')
+    parser.add_argument('--incremental', action='store_true', help='only fetch new movies and ones changed since the last completed run')
+    parser.add_argument('--cache-dir', default=TMDB_CACHE_DIR, help='on-disk response cache directory')
+    parser.add_argument('--no-cache', action='store_true', help='always hit the network')
+    parser.add_argument('--checkpoint', default=TMDB_CHECKPOINT, help='checkpoint file used to resume interrupted runs')
+    parser.add_argument('--fresh', action='store_true', help='ignore an unfinished run recorded in the checkpoint')
+    args = parser.parse_args()
+    if args.fresh:
+        checkpoint = Checkpoint(args.checkpoint)
+        checkpoint.data['in_progress'] = False
+        checkpoint.save()
     try:
-        populate_movies(num_movies=10000)
+        populate_movies(num_movies=args.movies, workers=args.workers, rate=args.rate, base_url=args.base_url,
+                        batch_size=args.batch_size, cache_dir=None if args.no_cache else args.cache_dir,
+                        checkpoint_path=args.checkpoint, incremental=args.incremental)
     except KeyboardInterrupt:
         print("\n\nScript interrupted by user")
     except Exception as e:
-        print(f"Fatal Error: {e}")
\ No newline at end of file
+        print(f"Fatal Error: {e}")
@@ -0,0 +1,70 @@
+// Like/watchlist links on movie cards: clicks are queued for a moment and sent
+// to the toggle endpoint as one JSON batch instead of following the link.
+(function () {
+    const script = document.currentScript;
+    const endpoint = script.dataset.endpoint;
+    const csrf = script.dataset.csrf;
+    const ICONS = {
+        liked: ['far fa-heart', 'fas fa-heart'],
+        watchlist: ['fas fa-plus', 'fas fa-minus'],
+    };
+    const TITLES = {
+        liked: ['Like', 'Unlike'],
+        watchlist: ['Add to watchlist', 'Remove from watchlist'],
+    };
+    let queue = [];
+    // state of each queued link before its first click in the batch, restored if the batch fails
+    let originals = new Map();
+    let timer = null;
+
+    function render(link, active) {
+        const kind = link.dataset.toggleKind;
+        if ((link.dataset.active === '1') !== active) {
+            const href = link.getAttribute('href');
+            link.setAttribute('href', link.dataset.altHref);
+            link.dataset.altHref = href;
+        }
+        link.dataset.active = active ? '1' : '0';
+        link.title = TITLES[kind][+active];
+        link.querySelector('i').className = ICONS[kind][+active];
+        if (kind === 'watchlist') {
+            link.style.color = active ? '#6B8E23' : '';
+        }
+    }
+
+    function flush() {
+        const batch = queue;
+        const before = originals;
+        queue = [];
+        originals = new Map();
+        timer = null;
+        fetch(endpoint, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrf},
+            body: JSON.stringify({actions: batch.map(item => item.action)}),
+        }).then(response => {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+        }).catch(() => {
+            // put the links back the way the server still has them, once each even if clicked repeatedly
+            before.forEach((active, link) => render(link, active));
+        });
+    }
+
+    document.addEventListener('click', event => {
+        const link = event.target.closest('a[data-toggle-kind]');
+        if (!link) {
+            return;
+        }
+        event.preventDefault();
+        const active = link.dataset.active !== '1';
+        if (!originals.has(link)) {
+            originals.set(link, !active);
+        }
+        render(link, active);
+        queue.push({link: link, action: {kind: link.dataset.toggleKind, movie_id: +link.dataset.movieId, active: active}});
+        clearTimeout(timer);
+        timer = setTimeout(flush, 300);
+    });
+})();